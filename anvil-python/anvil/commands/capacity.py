@@ -0,0 +1,363 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from dataclasses import asdict, dataclass
+import logging
+import math
+from pathlib import Path
+from typing import Any
+
+import click
+from rich.console import Console
+from rich.table import Table
+from sunbeam.clusterd.service import ClusterServiceUnavailableException
+from sunbeam.jobs.common import FORMAT_TABLE, FORMAT_YAML
+from sunbeam.jobs.questions import load_answers
+import yaml
+
+from anvil.commands.haproxy import get_haproxy_tuning
+from anvil.commands.manifest import generate_software_manifest
+from anvil.commands.postgresql import (
+    AUTO_PROFILE_LARGE_RAM_KB,
+    MAX_CONNECTIONS_PER_REGION,
+    POSTGRESQL_CONFIG_KEY,
+    STORAGE_POOLS,
+    get_max_connections,
+    get_max_connections_per_region,
+)
+from anvil.jobs.manifest import Manifest
+from anvil.provider.local.deployment import LocalDeployment
+from anvil.utils import FormatEpilogCommand
+
+LOG = logging.getLogger(__name__)
+console = Console()
+
+# Sizing model, documented in the "Plan the capacity" section of the README
+# Nodes of a role needed to survive the loss of one node
+MIN_HA_NODES = 3
+# Machines a single MAAS region node manages
+MACHINES_PER_REGION = 1000
+# Concurrent deployments a MAAS region worker serves, MAAS starts one
+# worker per core
+DEPLOYS_PER_REGION_CORE = 5
+MIN_REGION_CORES = 4
+# Concurrent deployments a MAAS agent serves boot files and images to
+DEPLOYS_PER_AGENT = 100
+# Upper bound of a fixed max_connections, see validate_max_connections
+MAX_FIXED_CONNECTIONS = 500
+# RAM of the database nodes in GB, base and per started 1000 machines
+DATABASE_BASE_RAM_GB = 8
+DATABASE_RAM_GB_PER_1000_MACHINES = 4
+# Database size in MB per machine for events, script results and history,
+# doubled for WAL and backups
+DATABASE_BASE_DISK_GB = 20
+DATABASE_DISK_MB_PER_MACHINE = 10
+# Boot resources in GB, two versions of every image are kept while syncing
+IMAGE_BASE_DISK_GB = 10
+IMAGE_SIZE_GB = 2
+
+
+@dataclass
+class CapacityPlan:
+    """Recommended sizing of a MAAS Anvil cluster."""
+
+    nodes: int
+    region_nodes: int
+    agent_nodes: int
+    database_nodes: int
+    haproxy_nodes: int
+    region_workers: int
+    max_connections: int
+    database_ram_gb: int
+    postgresql_profile: str
+    haproxy_server_maxconn: int
+    haproxy_global_maxconn: int
+    database_disk_gb: int
+    image_disk_gb: int
+
+    def planned_answers(
+        self,
+        storage_pool: str | None = None,
+        boot_resources_path: str | None = None,
+    ) -> dict[str, dict[str, Any]]:
+        """Return the plan as answers to the deployment questions.
+
+        The region workers have no setting, MAAS starts one worker per
+        core of the region nodes.
+
+        :param storage_pool: Juju storage pool the database disk is planned
+                             in, no storage is planned without
+        :param boot_resources_path: mount point of the image disk, no boot
+                                    resources storage is planned without
+        """
+        answers: dict[str, dict[str, Any]] = {
+            "postgres": {
+                "max_connections": str(self.max_connections),
+                "profile": self.postgresql_profile,
+            },
+            "haproxy": {
+                "tuning": {
+                    "server_maxconn": self.haproxy_server_maxconn,
+                    "global_maxconn": self.haproxy_global_maxconn,
+                }
+            },
+        }
+        if storage_pool:
+            answers["postgres"]["storage"] = {
+                "pgdata": {
+                    "pool": storage_pool,
+                    "size": f"{self.database_disk_gb}G",
+                }
+            }
+        if boot_resources_path:
+            for application in ("maas-region", "maas-agent"):
+                answers[application] = {
+                    "boot_resources": {
+                        "path": boot_resources_path,
+                        "size": f"{self.image_disk_gb}G",
+                    }
+                }
+        return answers
+
+
+def plan_cluster(
+    machines: int,
+    racks: int,
+    concurrent_deploys: int,
+    images: int,
+    connections_per_region: int = MAX_CONNECTIONS_PER_REGION,
+) -> CapacityPlan:
+    """Size a MAAS Anvil cluster with the model of this module.
+
+    :param machines: machines managed by MAAS
+    :param racks: racks, every rack gets at least one MAAS agent
+    :param concurrent_deploys: machines deployed at the same time
+    :param images: boot images synced, i.e. releases times architectures
+    :param connections_per_region: max_connections_per_region of the
+                                   postgresql plan
+    :raises ValueError: if the region nodes need more connections than
+                        PostgreSQL serves
+    """
+    region_nodes = max(MIN_HA_NODES, math.ceil(machines / MACHINES_PER_REGION))
+    # Workers per region node, every worker needs a core
+    region_workers = max(
+        MIN_REGION_CORES,
+        math.ceil(concurrent_deploys / DEPLOYS_PER_REGION_CORE / region_nodes),
+    )
+    agent_nodes = max(
+        MIN_HA_NODES, racks, math.ceil(concurrent_deploys / DEPLOYS_PER_AGENT)
+    )
+
+    max_connections = get_max_connections(
+        "dynamic", region_nodes, connections_per_region
+    )
+    if max_connections > MAX_FIXED_CONNECTIONS:
+        raise ValueError(
+            f"{region_nodes} region nodes need {max_connections} PostgreSQL "
+            f"connections, more than the {MAX_FIXED_CONNECTIONS} a cluster "
+            "serves"
+        )
+
+    database_ram_gb = DATABASE_BASE_RAM_GB + (
+        DATABASE_RAM_GB_PER_1000_MACHINES * math.ceil(machines / 1000)
+    )
+    profile = (
+        "oltp-large"
+        if database_ram_gb * 1024 * 1024 >= AUTO_PROFILE_LARGE_RAM_KB
+        else "oltp-small"
+    )
+    haproxy_tuning = get_haproxy_tuning(region_nodes, region_workers, {})
+
+    return CapacityPlan(
+        nodes=max(region_nodes, agent_nodes, MIN_HA_NODES),
+        region_nodes=region_nodes,
+        agent_nodes=agent_nodes,
+        database_nodes=MIN_HA_NODES,
+        haproxy_nodes=MIN_HA_NODES,
+        region_workers=region_workers,
+        max_connections=max_connections,
+        database_ram_gb=database_ram_gb,
+        postgresql_profile=profile,
+        haproxy_server_maxconn=haproxy_tuning["server_maxconn"],
+        haproxy_global_maxconn=haproxy_tuning["global_maxconn"],
+        database_disk_gb=DATABASE_BASE_DISK_GB
+        + math.ceil(machines * DATABASE_DISK_MB_PER_MACHINE * 2 / 1024),
+        image_disk_gb=IMAGE_BASE_DISK_GB + images * IMAGE_SIZE_GB * 2,
+    )
+
+
+def get_connections_per_region(deployment: LocalDeployment) -> int:
+    """Return the connections per region node of the bootstrapped cluster.
+
+    Before the cluster is bootstrapped, the default of the postgresql plan
+    is returned.
+    """
+    try:
+        client = deployment.get_client()
+        answers = load_answers(client, POSTGRESQL_CONFIG_KEY)
+        return get_max_connections_per_region(client, answers)
+    except ClusterServiceUnavailableException:
+        return MAX_CONNECTIONS_PER_REGION
+
+
+def write_manifest(
+    deployment: LocalDeployment,
+    plan: CapacityPlan,
+    output: Path,
+    storage_pool: str | None = None,
+    boot_resources_path: str | None = None,
+) -> None:
+    """Write a manifest with the plan, as generated by 'manifest generate'."""
+    preseed_content = deployment.generate_preseed(
+        console,
+        planned=plan.planned_answers(storage_pool, boot_resources_path),
+    )
+    software_content = generate_software_manifest(
+        Manifest.get_default_manifest(deployment)
+    )
+    output.parent.mkdir(mode=0o775, parents=True, exist_ok=True)
+    try:
+        with output.open("w") as file:
+            file.write("# Generated Anvil Deployment Manifest\n")
+            file.write(
+                f"# Give every region node {plan.region_workers} CPU cores, "
+                "MAAS starts one worker per core\n\n"
+            )
+            file.write(preseed_content)
+            file.write("\n")
+            file.write(software_content)
+    except OSError as e:
+        LOG.debug(e)
+        raise click.ClickException(f"Manifest generation failed: {e!s}")
+
+
+@click.command(
+    cls=FormatEpilogCommand,
+    epilog="""
+    \b
+    Size a cluster for 2000 machines in 10 racks, deploying 200 at a time.
+    maas-anvil plan-capacity --machines 2000 --racks 10 --concurrent-deploys 200
+    \b
+    Write the plan to a manifest file to bootstrap the cluster with.
+    maas-anvil plan-capacity --machines 2000 --output manifest.yaml
+    \b
+    Also plan the database and image disks, mounted on every node.
+    maas-anvil plan-capacity --machines 2000 --storage-pool rootfs \\\
+    \b
+    --boot-resources-path /srv/maas --output manifest.yaml
+    """,
+)
+@click.option(
+    "--machines",
+    type=click.IntRange(min=1),
+    required=True,
+    help="Number of machines managed by MAAS.",
+)
+@click.option(
+    "--racks",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of racks, each gets at least one MAAS agent.",
+)
+@click.option(
+    "--concurrent-deploys",
+    type=click.IntRange(min=0),
+    default=10,
+    show_default=True,
+    help="Number of machines deployed at the same time.",
+)
+@click.option(
+    "--images",
+    type=click.IntRange(min=1),
+    default=2,
+    show_default=True,
+    help="Number of boot images, i.e. releases times architectures.",
+)
+@click.option(
+    "-f",
+    "--format",
+    type=click.Choice([FORMAT_TABLE, FORMAT_YAML]),
+    default=FORMAT_TABLE,
+    help="Output format of the plan.",
+)
+@click.option(
+    "-o",
+    "--output",
+    help="Write the plan to this manifest file.",
+    type=click.Path(dir_okay=False, path_type=Path),
+)
+@click.option(
+    "--storage-pool",
+    type=click.Choice(STORAGE_POOLS),
+    help=(
+        "Plan the PostgreSQL data in this Juju storage pool, on the disk "
+        "mounted at /var/lib/juju/storage. Used with --output."
+    ),
+)
+@click.option(
+    "--boot-resources-path",
+    help=(
+        "Plan the boot resources on the disk mounted at this path. Used "
+        "with --output."
+    ),
+)
+@click.pass_context
+def plan_capacity(
+    ctx: click.Context,
+    machines: int,
+    racks: int,
+    concurrent_deploys: int,
+    images: int,
+    format: str,
+    output: Path | None,
+    storage_pool: str | None,
+    boot_resources_path: str | None,
+) -> None:
+    """Recommends the size of a MAAS Anvil cluster.
+    The role counts, PostgreSQL, HAProxy and MAAS region settings and disk
+    sizes are derived from the machines, racks and concurrent deployments.
+    """
+    try:
+        plan = plan_cluster(
+            machines,
+            racks,
+            concurrent_deploys,
+            images,
+            get_connections_per_region(ctx.obj),
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    LOG.debug(f"Capacity plan: {plan}")
+
+    if format == FORMAT_TABLE:
+        table = Table()
+        table.add_column("Setting", justify="left")
+        table.add_column("Value", justify="right")
+        for name, value in asdict(plan).items():
+            table.add_row(name.replace("_", " ").capitalize(), str(value))
+        console.print(table)
+        console.print(
+            "Region workers are advisory: MAAS starts one worker per CPU "
+            "core, so give every region node as many cores."
+        )
+    elif format == FORMAT_YAML:
+        click.echo(yaml.dump(asdict(plan), sort_keys=False))
+
+    if output:
+        write_manifest(
+            ctx.obj, plan, output, storage_pool, boot_resources_path
+        )
+        click.echo(f"Generated manifest is at {output!s}")
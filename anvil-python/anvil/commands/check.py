@@ -0,0 +1,134 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from dataclasses import asdict
+import logging
+
+import click
+from rich.console import Console
+from rich.table import Table
+from sunbeam import utils
+from sunbeam.clusterd.service import ClusterServiceUnavailableException
+from sunbeam.jobs.common import FORMAT_TABLE, FORMAT_YAML
+from sunbeam.jobs.deployment import Deployment
+import yaml
+
+from anvil.jobs.network import (
+    THROUGHPUT_PORT,
+    NetworkResult,
+    check_peer,
+)
+from anvil.utils import FormatEpilogCommand
+
+LOG = logging.getLogger(__name__)
+console = Console()
+
+
+def _format(value: float | None, precision: int) -> str:
+    return "-" if value is None else f"{value:.{precision}f}"
+
+
+def get_cluster_peers(deployment: Deployment) -> list[str]:
+    """Return the clusterd addresses of the other cluster members."""
+    client = deployment.get_client()
+    fqdn = utils.get_fqdn()
+    try:
+        members = client.cluster.get_cluster_members()
+    except ClusterServiceUnavailableException as e:
+        LOG.debug(e)
+        raise click.ClickException("Not able to connect to Cluster DB")
+    return [member["address"] for member in members if member["name"] != fqdn]
+
+
+def print_results(results: list[NetworkResult], format: str) -> None:
+    if format == FORMAT_YAML:
+        click.echo(yaml.dump([asdict(result) for result in results]))
+        return
+    table = Table()
+    table.add_column("Peer", justify="left")
+    table.add_column("RTT (ms)", justify="right")
+    table.add_column("Jitter (ms)", justify="right")
+    table.add_column("Lost", justify="right")
+    table.add_column("Throughput (Mbit/s)", justify="right")
+    for result in results:
+        table.add_row(
+            result.peer,
+            _format(result.rtt, 2),
+            _format(result.jitter, 2),
+            str(result.lost),
+            _format(result.throughput, 0),
+        )
+    console.print(table)
+    for result in results:
+        for warning in result.warnings:
+            console.print(f"[yellow]WARNING:[/yellow] {warning}")
+
+
+@click.command(
+    cls=FormatEpilogCommand,
+    epilog="""
+    \b
+    Measure the network to all other cluster members.
+    maas-anvil check network
+    \b
+    Measure the network to infra1.
+    maas-anvil check network --peer infra1
+    """,
+)
+@click.option(
+    "--peer",
+    "peers",
+    multiple=True,
+    help="Address of a node as host[:port], the port defaults to the "
+    "clusterd port 7000. Defaults to all other cluster members.",
+)
+@click.option(
+    "--port",
+    type=int,
+    default=THROUGHPUT_PORT,
+    show_default=True,
+    help="Port of the throughput listener.",
+)
+@click.option(
+    "-f",
+    "--format",
+    type=click.Choice([FORMAT_TABLE, FORMAT_YAML]),
+    default=FORMAT_TABLE,
+    help="Output format of the results.",
+)
+@click.pass_context
+def network(
+    ctx: click.Context,
+    peers: tuple[str, ...],
+    port: int,
+    format: str,
+) -> None:
+    """Checks the network performance to other nodes.
+    Measures the RTT, jitter and TCP throughput and warns about values that
+    slow down dqlite, PostgreSQL replication or image sync. The throughput
+    is measured against the throughput listener every node runs.
+    """
+    if not peers:
+        peers = tuple(get_cluster_peers(ctx.obj))
+    if not peers:
+        raise click.ClickException(
+            "No other cluster members, select nodes with --peer"
+        )
+
+    results = []
+    for peer in peers:
+        with console.status(f"Measuring the network to {peer}"):
+            results.append(check_peer(peer, port))
+    print_results(results, format)
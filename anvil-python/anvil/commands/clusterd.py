@@ -16,7 +16,9 @@
 import logging
 from typing import List
 
+from rich.status import Status
 from sunbeam.clusterd.client import Client
+from sunbeam.clusterd.service import ConfigItemNotFoundException
 
 LOG = logging.getLogger(__name__)
 
@@ -25,7 +27,10 @@ from sunbeam.commands.clusterd import (
     ClusterJoinNodeStep as SunbeamClusterJoinNodeStep,
     ClusterListNodeStep as SunbeamClusterListNodeStep,
     ClusterRemoveNodeStep as SunbeamClusterRemoveNodeStep,
+    ClusterUpdateJujuControllerStep as SunbeamClusterUpdateJujuControllerStep,
 )
+from sunbeam.jobs.common import Result, ResultType
+from sunbeam.jobs.juju import ControllerNotFoundException, JujuController
 
 
 class ClusterInitStep(SunbeamClusterInitStep):
@@ -66,3 +71,30 @@ class ClusterRemoveNodeStep(SunbeamClusterRemoveNodeStep):
 
         self.name = "Remove node from Cluster"
         self.description = "Removing node from Anvil cluster"
+
+
+class ClusterUpdateJujuControllerStep(SunbeamClusterUpdateJujuControllerStep):
+    """Save the Juju controller endpoints in the Anvil cluster database.
+
+    The endpoints are saved again when they changed, e.g. after controller
+    high availability was enabled or a controller machine was removed.
+    """
+
+    def is_skip(self, status: Status | None = None) -> Result:
+        try:
+            stored = JujuController.load(self.client).api_endpoints
+        except ConfigItemNotFoundException:
+            LOG.debug("Juju controller not present in database")
+            return Result(ResultType.COMPLETED)
+        try:
+            controller = self.get_controller(self.controller)
+        except ControllerNotFoundException as e:
+            LOG.debug(e)
+            return Result(
+                ResultType.FAILED, f"Controller {self.controller} not found"
+            )
+        endpoints = controller["details"]["api-endpoints"]
+        if sorted(stored) == sorted(endpoints):
+            return Result(ResultType.SKIPPED)
+        LOG.debug(f"Controller endpoints changed from {stored} to {endpoints}")
+        return Result(ResultType.COMPLETED)
@@ -0,0 +1,454 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from abc import ABC, abstractmethod
+import csv
+import json
+import logging
+from pathlib import Path
+import shlex
+import subprocess
+from typing import Any, List
+
+from rich.status import Status
+from sunbeam.clusterd.client import Client
+from sunbeam.commands.juju import JujuStepHelper
+from sunbeam.jobs import questions
+from sunbeam.jobs.common import BaseStep, Result, ResultType
+from sunbeam.jobs.juju import (
+    ApplicationNotFoundException,
+    JujuHelper,
+    run_sync,
+)
+
+from anvil.commands.haproxy import HAPROXY_CONFIG_KEY
+
+LOG = logging.getLogger(__name__)
+
+# Socket configured in the global section by the haproxy charm
+HAPROXY_SOCKET_PATH = "/var/run/haproxy/haproxy.sock"
+HAPROXY_STAT_FIELDS = [
+    "pxname",
+    "svname",
+    "status",
+    "qcur",
+    "qmax",
+    "scur",
+    "smax",
+    "slim",
+    "stot",
+    "rate",
+    "rate_max",
+    "qtime",
+    "ctime",
+    "rtime",
+    "ttime",
+    "hrsp_5xx",
+]
+REGION_PROCESSES = ["regiond", "rackd", "maas-agent", "maas-http"]
+# Patroni configuration written by the postgresql charm, it holds the
+# password of the operator superuser
+PATRONI_CONFIG_PATH = (
+    "/var/snap/charmed-postgresql/current/etc/patroni/patroni.yaml"
+)
+
+PG_ACTIVITY_QUERY = """
+SELECT datname, usename, application_name, client_addr, state,
+       wait_event_type, wait_event, backend_type,
+       extract(epoch FROM now() - xact_start) AS xact_age,
+       extract(epoch FROM now() - query_start) AS query_age,
+       left(query, 256) AS query
+FROM pg_stat_activity
+"""
+PG_STATEMENTS_QUERY = """
+SELECT queryid, calls, total_exec_time, mean_exec_time, rows,
+       shared_blks_hit, shared_blks_read, left(query, 512) AS query
+FROM pg_stat_statements
+ORDER BY total_exec_time DESC
+LIMIT 25
+"""
+PG_REPLICATION_QUERY = """
+SELECT pg_is_in_recovery() AS in_recovery,
+       extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+           AS replay_delay,
+       (SELECT coalesce(jsonb_agg(r), '[]') FROM (
+           SELECT application_name, client_addr, state, sync_state,
+                  extract(epoch FROM write_lag) AS write_lag,
+                  extract(epoch FROM flush_lag) AS flush_lag,
+                  extract(epoch FROM replay_lag) AS replay_lag,
+                  pg_wal_lsn_diff(pg_current_wal_lsn(), replay_lsn)
+                      AS replay_lag_bytes
+           FROM pg_stat_replication) r) AS replicas
+"""
+PG_DATABASE_SIZE_QUERY = """
+SELECT datname, pg_database_size(datname) AS size
+FROM pg_database
+WHERE NOT datistemplate
+"""
+PG_TABLE_SIZE_QUERY = """
+SELECT current_database() AS datname, schemaname, relname,
+       pg_total_relation_size(relid) AS total_size,
+       pg_relation_size(relid) AS table_size,
+       n_live_tup, n_dead_tup
+FROM pg_stat_user_tables
+ORDER BY pg_total_relation_size(relid) DESC
+LIMIT 25
+"""
+
+
+def as_json_query(query: str) -> str:
+    """Wrap a query so that PostgreSQL returns its rows as a JSON array.
+
+    json_agg separates the rows with newlines, jsonb prints on one line.
+    """
+    return (
+        f"SELECT coalesce(jsonb_agg(t), '[]')::text FROM ({query.strip()}) t"
+    )
+
+
+class CollectPerformanceStep(ABC, BaseStep, JujuStepHelper):
+    """Base step for collecting performance data from application units.
+
+    Commands are run on the units with 'juju exec' and the collected data is
+    written as JSON to the given file. Collection is best effort: a unit
+    failing to report is recorded in the output instead of failing the
+    inspection.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        jhelper: JujuHelper,
+        model: str,
+        application: str,
+        file_path: Path,
+    ):
+        super().__init__(name, description)
+        self.jhelper = jhelper
+        self.model = model
+        self.application = application
+        self.file_path = file_path
+
+    def is_skip(self, status: Status | None = None) -> Result:
+        try:
+            run_sync(
+                self.jhelper.get_application(self.application, self.model)
+            )
+        except ApplicationNotFoundException:
+            LOG.debug(f"{self.application} not deployed, skipping")
+            return Result(ResultType.SKIPPED)
+        return Result(ResultType.COMPLETED)
+
+    def exec(self, command: str, unit: str | None = None) -> dict[str, Any]:
+        """Run a shell command on one unit or on all units of the application.
+
+        :return: dict of unit name and the results of the command
+        """
+        target = (
+            ["--unit", unit] if unit else ["--application", self.application]
+        )
+        cmd = [
+            self._get_juju_binary(),
+            "exec",
+            "-m",
+            self.model,
+            "--format",
+            "json",
+            *target,
+            "--",
+            "bash",
+            "-c",
+            command,
+        ]
+        LOG.debug(f"Running command {' '.join(cmd[:-1])} <script>")
+        process = subprocess.run(
+            cmd, capture_output=True, text=True, check=True
+        )
+        output = json.loads(process.stdout)
+        return {
+            name: result.get("results", result)
+            for name, result in output.items()
+        }
+
+    @abstractmethod
+    def collect(self) -> dict[str, Any]:
+        """Collect the data of the application units."""
+
+    def run(self, status: Status | None = None) -> Result:
+        try:
+            data = self.collect()
+        except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
+            LOG.debug(e, exc_info=True)
+            LOG.warning(f"Unable to collect {self.name.lower()}")
+            data = {"error": getattr(e, "stderr", None) or str(e)}
+
+        with self.file_path.open("w") as f:
+            json.dump(data, f, indent=2, default=str)
+        return Result(ResultType.COMPLETED)
+
+
+class CollectPostgreSQLStatsStep(CollectPerformanceStep):
+    """Collect activity, statements, replication and size statistics.
+
+    The statistics are collected on every unit rather than on the leader:
+    activity and statement statistics are kept per server, and replicas
+    report their own replay delay. The leader is not necessarily the
+    primary either.
+    """
+
+    def __init__(self, jhelper: JujuHelper, model: str, file_path: Path):
+        super().__init__(
+            "PostgreSQL statistics",
+            "Collecting PostgreSQL statistics",
+            jhelper,
+            model,
+            "postgresql",
+            file_path,
+        )
+
+    def psql(self, query: str, database: str = "postgres") -> str:
+        return (
+            f'charmed-postgresql.psql -h "$PGHOST" -U operator -d {database} '
+            f"-X -A -t -c {shlex.quote(as_json_query(query))}"
+        )
+
+    def psql_environment(self) -> List[str]:
+        """Return the script lines setting up psql to connect as operator.
+
+        The password is read from the Patroni configuration on the unit, so
+        it is not part of the script kept in the operation log of the model.
+        """
+        read_password = (
+            "import sys, yaml; "
+            "config = yaml.safe_load(open(sys.argv[1])); "
+            "print(config['postgresql']['authentication']"
+            "['superuser']['password'])"
+        )
+        return [
+            "export PGPASSWORD=$(python3 -c "
+            f"{shlex.quote(read_password)} {PATRONI_CONFIG_PATH})",
+            "export PGHOST=$(network-get database-peers --bind-address)",
+        ]
+
+    def collect(self) -> dict[str, Any]:
+        queries = {
+            "activity": PG_ACTIVITY_QUERY,
+            "statements": PG_STATEMENTS_QUERY,
+            "replication": PG_REPLICATION_QUERY,
+            "database_sizes": PG_DATABASE_SIZE_QUERY,
+        }
+        script = self.psql_environment()
+        for key, query in queries.items():
+            script.append(f"echo '## {key}'; {self.psql(query)}")
+        script.append(
+            "for db in $(charmed-postgresql.psql -h \"$PGHOST\" -U operator "
+            "-d postgres -X -A -t -c \"SELECT datname FROM pg_database WHERE "
+            "NOT datistemplate AND datname <> 'postgres'\"); do "
+            f"echo '## table_sizes'; {self.psql(PG_TABLE_SIZE_QUERY, '$db')}; "
+            "done"
+        )
+
+        data: dict[str, Any] = {}
+        for unit, result in self.exec("\n".join(script)).items():
+            data[unit] = self._parse_sections(result)
+        return data
+
+    def _parse_sections(self, result: dict[str, Any]) -> dict[str, Any]:
+        """Parse the '## <section>' delimited output of the script."""
+        blocks: List[tuple[str, List[str]]] = []
+        for line in result.get("stdout", "").splitlines():
+            if line.startswith("## "):
+                blocks.append((line[3:], []))
+            elif blocks:
+                blocks[-1][1].append(line)
+
+        sections: dict[str, Any] = {}
+        for section, lines in blocks:
+            output = "\n".join(lines).strip()
+            if not output:
+                continue
+            rows = json.loads(output)
+            if section == "table_sizes":
+                sections.setdefault(section, []).extend(rows)
+            else:
+                sections[section] = rows
+        if result.get("return-code", 0) != 0 or result.get("stderr"):
+            sections["errors"] = result.get("stderr", "")
+        return sections
+
+
+class CollectHAProxyStatsStep(CollectPerformanceStep):
+    """Collect HAProxy backend statistics and session counts."""
+
+    def __init__(self, jhelper: JujuHelper, model: str, file_path: Path):
+        super().__init__(
+            "HAProxy statistics",
+            "Collecting HAProxy statistics",
+            jhelper,
+            model,
+            "haproxy",
+            file_path,
+        )
+
+    def collect(self) -> dict[str, Any]:
+        script = (
+            "python3 - <<'EOF'\n"
+            "import socket\n"
+            "for command in ('show info', 'show stat'):\n"
+            "    s = socket.socket(socket.AF_UNIX)\n"
+            f"    s.connect({HAPROXY_SOCKET_PATH!r})\n"
+            "    s.sendall(command.encode() + b'\\n')\n"
+            "    print('## ' + command)\n"
+            "    while chunk := s.recv(65536):\n"
+            "        print(chunk.decode(), end='')\n"
+            "    s.close()\n"
+            "EOF"
+        )
+        data: dict[str, Any] = {}
+        for unit, result in self.exec(script).items():
+            data[unit] = self._parse(result)
+        return data
+
+    def _parse(self, result: dict[str, Any]) -> dict[str, Any]:
+        info: dict[str, str] = {}
+        stat_lines: List[str] = []
+        section = None
+        for line in result.get("stdout", "").splitlines():
+            if line.startswith("## "):
+                section = line[3:]
+            elif section == "show info" and ":" in line:
+                key, value = line.split(":", 1)
+                info[key.strip()] = value.strip()
+            elif section == "show stat" and line.strip():
+                stat_lines.append(line.removeprefix("# "))
+
+        stats = [
+            {field: row.get(field, "") for field in HAPROXY_STAT_FIELDS}
+            for row in csv.DictReader(stat_lines)
+        ]
+        parsed: dict[str, Any] = {
+            "sessions": {
+                "current": info.get("CurrConns"),
+                "max": info.get("MaxConn"),
+                "rate": info.get("SessRate"),
+                "idle_pct": info.get("Idle_pct"),
+            },
+            "stats": stats,
+        }
+        if result.get("return-code", 0) != 0:
+            parsed["errors"] = result.get("stderr", "")
+        return parsed
+
+
+class CollectKeepalivedStateStep(CollectPerformanceStep):
+    """Collect the VRRP state of keepalived on every HAProxy node."""
+
+    def __init__(
+        self, client: Client, jhelper: JujuHelper, model: str, file_path: Path
+    ):
+        super().__init__(
+            "Keepalived state",
+            "Collecting keepalived VRRP state",
+            jhelper,
+            model,
+            "keepalived",
+            file_path,
+        )
+        self.client = client
+
+    def collect(self) -> dict[str, Any]:
+        answers = questions.load_answers(self.client, HAPROXY_CONFIG_KEY)
+        virtual_ip = answers.get("virtual_ip", "")
+        script = (
+            'echo "## active $(systemctl is-active keepalived)"; '
+            "ip -j -4 addr show"
+        )
+        data: dict[str, Any] = {}
+        for unit, result in self.exec(script).items():
+            stdout = result.get("stdout", "")
+            header, _, addresses = stdout.partition("\n")
+            local_ips = [
+                addr_info.get("local")
+                for link in json.loads(addresses or "[]")
+                for addr_info in link.get("addr_info", [])
+            ]
+            data[unit] = {
+                "service": header.removeprefix("## active ").strip(),
+                "virtual_ip": virtual_ip,
+                "state": "MASTER" if virtual_ip in local_ips else "BACKUP",
+                "addresses": local_ips,
+            }
+        return data
+
+
+class CollectRegionProcessesStep(CollectPerformanceStep):
+    """Collect CPU and memory usage of the MAAS region processes."""
+
+    def __init__(self, jhelper: JujuHelper, model: str, file_path: Path):
+        super().__init__(
+            "Region processes",
+            "Collecting MAAS region process usage",
+            jhelper,
+            model,
+            "maas-region",
+            file_path,
+        )
+
+    def collect(self) -> dict[str, Any]:
+        script = "ps -eo pid=,pcpu=,rss=,etimes=,args="
+        data: dict[str, Any] = {}
+        for unit, result in self.exec(script).items():
+            processes = []
+            for line in result.get("stdout", "").splitlines():
+                fields = line.split(None, 4)
+                if len(fields) < 5 or not any(
+                    name in fields[4] for name in REGION_PROCESSES
+                ):
+                    continue
+                pid, pcpu, rss, etimes, args = fields
+                processes.append(
+                    {
+                        "pid": int(pid),
+                        "cpu_percent": float(pcpu),
+                        "rss_kb": int(rss),
+                        "elapsed_seconds": int(etimes),
+                        "command": args,
+                    }
+                )
+            data[unit] = {
+                "processes": processes,
+                "cpu_percent": sum(p["cpu_percent"] for p in processes),
+                "rss_kb": sum(p["rss_kb"] for p in processes),
+            }
+        return data
+
+
+def performance_collect_steps(
+    client: Client, jhelper: JujuHelper, model: str, output_dir: Path
+) -> List[BaseStep]:
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return [
+        CollectPostgreSQLStatsStep(
+            jhelper, model, output_dir / "postgresql.json"
+        ),
+        CollectHAProxyStatsStep(jhelper, model, output_dir / "haproxy.json"),
+        CollectKeepalivedStateStep(
+            client, jhelper, model, output_dir / "keepalived.json"
+        ),
+        CollectRegionProcessesStep(
+            jhelper, model, output_dir / "maas-region.json"
+        ),
+    ]
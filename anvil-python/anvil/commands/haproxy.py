@@ -18,19 +18,21 @@ import logging
 from typing import Any, Callable, List
 
 from rich.console import Console
+from rich.status import Status
 from sunbeam.clusterd.client import Client
 from sunbeam.commands.juju import BOOTSTRAP_CONFIG_KEY
 from sunbeam.commands.terraform import TerraformException, TerraformInitStep
 from sunbeam.jobs import questions
-from sunbeam.jobs.common import BaseStep, ResultType
+from sunbeam.jobs.common import BaseStep, Result, ResultType, update_config
 from sunbeam.jobs.juju import JujuHelper
 from sunbeam.jobs.steps import (
     AddMachineUnitsStep,
     DeployMachineApplicationStep,
 )
+import yaml
 
 from anvil.jobs.manifest import Manifest
-from anvil.jobs.steps import RemoveMachineUnitStep
+from anvil.jobs.steps import RemoveMachineUnitStep, get_role_host_resources
 from anvil.utils import get_architecture
 
 LOG = logging.getLogger(__name__)
@@ -38,11 +40,37 @@ LOG = logging.getLogger(__name__)
 APPLICATION = "haproxy"
 CONFIG_KEY = "TerraformVarsHaproxyPlan"
 HAPROXY_CONFIG_KEY = "TerraformVarsHaproxy"
+HAPROXY_METRICS_CONFIG_KEY = "HAProxyMetricsEndpoints"
+HAPROXY_METRICS_PORT = 8405
 HAPROXY_APP_TIMEOUT = 180  # 3 minutes, managing the application should be fast
 HAPROXY_UNIT_TIMEOUT = (
     1200  # 15 minutes, adding / removing units can take a long time
 )
 HAPROXY_VALID_TLS_MODES = ["termination", "passthrough", "disabled"]
+# Timeouts in milliseconds, tunnel covers the websockets of the MAAS UI
+HAPROXY_DEFAULT_TIMEOUTS = {
+    "connect": 5000,
+    "client": 60000,
+    "server": 90000,
+    "queue": 30000,
+    "http-request": 15000,
+    "http-keep-alive": 10000,
+    "tunnel": 3600000,
+}
+HAPROXY_DEFAULT_HEALTH_CHECK = {"inter": 2000, "rise": 2, "fall": 3}
+# Concurrent requests a MAAS region node is expected to serve per core
+REGION_CONNECTIONS_PER_CORE = 32
+MIN_SERVER_MAXCONN = 100
+MIN_GLOBAL_MAXCONN = 4096
+HAPROXY_COMPRESSION_TYPES = [
+    "application/json",
+    "text/html",
+    "text/css",
+    "text/javascript",
+    "application/javascript",
+]
+# Assets of the MAAS UI have content hashes in their file names
+HAPROXY_DEFAULT_CACHE_RULES = [{"path": "/MAAS/r/assets/", "max_age": 604800}]
 
 
 def validate_cert_file(filepath: str) -> None:
@@ -137,6 +165,203 @@ def haproxy_questions() -> dict[str, questions.PromptQuestion]:
     }
 
 
+def get_haproxy_tuning(
+    region_nodes: int, region_cores: int, overrides: dict[str, Any]
+) -> dict[str, Any]:
+    """Derive the HAProxy limits and timeouts for the MAAS region backends.
+
+    Every region backend accepts REGION_CONNECTIONS_PER_CORE connections per
+    core of the smallest region node, the global limit leaves room for the
+    same number of queued connections.
+
+    nbthread is not derived: the haproxy charm has no option for it, and
+    HAProxy starts one thread per CPU core it may run on by default, which
+    already follows the cores of the HAProxy node.
+
+    :param region_nodes: number of MAAS region nodes
+    :param region_cores: CPU cores of the smallest MAAS region node
+    :param overrides: the haproxy tuning section of the manifest
+    """
+    server_maxconn = int(
+        overrides.get("server_maxconn")
+        or max(MIN_SERVER_MAXCONN, REGION_CONNECTIONS_PER_CORE * region_cores)
+    )
+    global_maxconn = int(
+        overrides.get("global_maxconn")
+        or max(MIN_GLOBAL_MAXCONN, 2 * server_maxconn * max(1, region_nodes))
+    )
+    return {
+        "global_maxconn": global_maxconn,
+        "server_maxconn": server_maxconn,
+        "balance": overrides.get("balance", "leastconn"),
+        "timeouts": HAPROXY_DEFAULT_TIMEOUTS | overrides.get("timeouts", {}),
+        "health_check": HAPROXY_DEFAULT_HEALTH_CHECK
+        | overrides.get("health_check", {}),
+    }
+
+
+def get_caching_options(caching: dict[str, Any]) -> list[str]:
+    """Get the HAProxy options for compression and client side caching.
+
+    Responses of the compression types are gzipped. Responses to requests
+    for paths starting with the path of a cache rule get a Cache-Control
+    header, so that browsers do not request them again for max_age seconds.
+
+    :param caching: the haproxy caching section of the manifest
+    """
+    if not caching.get("enabled", False):
+        return []
+    compression_types = caching.get(
+        "compression_types", HAPROXY_COMPRESSION_TYPES
+    )
+    options = [
+        "compression algo gzip",
+        f"compression type {' '.join(compression_types)}",
+        "http-request set-var(txn.path) path",
+    ]
+    for rule in caching.get("rules", HAPROXY_DEFAULT_CACHE_RULES):
+        options.append(
+            "http-response set-header Cache-Control "
+            f'"public, max-age={int(rule["max_age"])}" '
+            f"if {{ var(txn.path) -m beg {rule['path']} }}"
+        )
+    return options
+
+
+def get_rate_limit_options(limits: dict[str, Any], http: bool) -> list[str]:
+    """Get the HAProxy options limiting the load of a single client.
+
+    Clients are tracked by source IP in a stick table of the service.
+    Requests above requests_per_10s are answered with 429, connections
+    above connections are rejected. Request rates need HTTP mode.
+
+    :param limits: a service of the haproxy rate_limits manifest section
+    :param http: whether the service runs in HTTP mode
+    """
+    requests = int(limits.get("requests_per_10s", 0)) if http else 0
+    connections = int(limits.get("connections", 0))
+    if not requests and not connections:
+        return []
+    counters = ["conn_cur", *(["http_req_rate(10s)"] if requests else [])]
+    options = [
+        f"stick-table type ip size {int(limits.get('table_size', 100000))} "
+        f"expire 60s store {','.join(counters)}",
+        "tcp-request connection track-sc0 src",
+    ]
+    if connections:
+        options.append(
+            "tcp-request connection reject "
+            f"if {{ sc_conn_cur(0) gt {connections} }}"
+        )
+    if requests:
+        options.append(
+            "http-request deny deny_status 429 "
+            f"if {{ sc_http_req_rate(0) gt {requests} }}"
+        )
+    return options
+
+
+def get_haproxy_services(
+    tls_mode: str,
+    cidrs: list[str],
+    tuning: dict[str, Any],
+    caching: dict[str, Any] | None = None,
+    rate_limits: dict[str, Any] | None = None,
+) -> list[dict[str, Any]]:
+    """Get the HAProxy services for the MAAS region backends.
+
+    :param tls_mode: one of HAPROXY_VALID_TLS_MODES
+    :param cidrs: management CIDRs allowed to reach the agent service
+    :param tuning: limits and timeouts from get_haproxy_tuning
+    :param caching: the haproxy caching section of the manifest
+    :param rate_limits: the haproxy rate_limits section of the manifest
+    """
+    rate_limits = rate_limits or {}
+    health_check = "check inter {inter} rise {rise} fall {fall}".format(
+        **tuning["health_check"]
+    )
+    server_options = (
+        f"maxconn {tuning['server_maxconn']} cookie S{{i}} {health_check}"
+    )
+    service_options = [f"balance {tuning['balance']}", "cookie SRVNAME insert"]
+    # Keep client connections open and share idle region connections
+    http_options = [
+        "option http-keep-alive",
+        "http-reuse safe",
+        *get_caching_options(caching or {}),
+    ]
+
+    if tls_mode == "disabled":
+        return [
+            {
+                "service_name": "haproxy_service",
+                "service_host": "0.0.0.0",
+                "service_port": 80,
+                "service_options": [
+                    *service_options,
+                    *get_rate_limit_options(
+                        rate_limits.get("api", {}), http=True
+                    ),
+                    *http_options,
+                ],
+                "server_options": server_options,
+            }
+        ]
+
+    haproxy_service: dict[str, Any] = {
+        "service_name": "haproxy_service",
+        "service_host": "0.0.0.0",
+        "service_port": 443,
+        "service_options": [
+            *service_options,
+            "http-request redirect scheme https unless { ssl_fc }",
+            *get_rate_limit_options(
+                rate_limits.get("api", {}), http=tls_mode != "passthrough"
+            ),
+            *(["mode tcp"] if tls_mode == "passthrough" else http_options),
+        ],
+        "server_options": server_options,
+    }
+    if tls_mode == "termination":
+        haproxy_service["crts"] = ["DEFAULT"]
+    agent_service = {
+        "service_name": "agent_service",
+        "service_host": "0.0.0.0",
+        "service_port": 80,
+        "service_options": [
+            *service_options,
+            f"acl is-internal src {' '.join(cidrs)}",
+            "http-request deny if !is-internal",
+            *get_rate_limit_options(rate_limits.get("agent", {}), http=True),
+            *http_options,
+        ],
+        "server_options": server_options,
+    }
+    return [haproxy_service, agent_service]
+
+
+def get_metrics_service(cidrs: list[str], port: int) -> dict[str, Any]:
+    """Get the HAProxy service exposing the Prometheus metrics.
+
+    The metrics are served on /metrics and the statistics page on /stats,
+    both only to the management CIDRs.
+    """
+    return {
+        "service_name": "metrics_service",
+        "service_host": "0.0.0.0",
+        "service_port": port,
+        "service_options": [
+            "mode http",
+            f"acl is-management src {' '.join(cidrs)}",
+            "http-request deny if !is-management",
+            "http-request use-service prometheus-exporter if { path /metrics }",
+            "stats enable",
+            "stats uri /stats",
+            "stats refresh 10s",
+        ],
+    }
+
+
 class DeployHAProxyApplicationStep(DeployMachineApplicationStep):
     """Deploy HAProxy application using Terraform"""
 
@@ -229,11 +454,31 @@ class DeployHAProxyApplicationStep(DeployMachineApplicationStep):
             self.client, self._HAPROXY_CONFIG
         )
 
+        try:
+            validate_virtual_ip(variables.get("virtual_ip", ""))
+        except ValueError as e:
+            raise TerraformException(f"Invalid virtual_ip: {e}")
+        tuning = self.get_tuning(
+            self.get_manifest_overrides(variables, "tuning")
+        )
+        caching = self.get_manifest_overrides(variables, "caching")
+        rate_limits = self.get_manifest_overrides(variables, "rate_limits")
+        metrics = self.get_manifest_overrides(variables, "metrics")
+        variables["charm_haproxy_tuning"] = {
+            "global_maxconn": str(tuning["global_maxconn"]),
+            "default_timeouts": ", ".join(
+                f"{name} {value}" for name, value in tuning["timeouts"].items()
+            ),
+        }
+        variables["haproxy_services_yaml"] = self.get_services_yaml(
+            variables["tls_mode"],
+            tuning,
+            caching,
+            rate_limits,
+            metrics,
+        )
         if variables["tls_mode"] != "disabled":
             variables["haproxy_port"] = 443
-            variables["haproxy_services_yaml"] = self.get_tls_services_yaml(
-                variables["tls_mode"]
-            )
             if not variables["ssl_cert"] or not variables["ssl_key"]:
                 raise TerraformException(
                     "Both ssl_cert and ssl_key must be provided when enabling TLS"
@@ -250,6 +495,10 @@ class DeployHAProxyApplicationStep(DeployMachineApplicationStep):
         variables.pop("ssl_cert", "")
         variables.pop("ssl_key", "")
         variables.pop("ssl_cacert", "")
+        variables.pop("tuning", {})
+        variables.pop("caching", {})
+        variables.pop("rate_limits", {})
+        variables.pop("metrics", {})
 
         if get_architecture() == "arm64":
             variables["arch"] = "arm64"
@@ -257,6 +506,50 @@ class DeployHAProxyApplicationStep(DeployMachineApplicationStep):
         LOG.debug(f"extra tfvars: {variables}")
         return variables
 
+    def run(self, status: Status | None = None) -> Result:
+        result = super().run(status)
+        if result.result_type == ResultType.COMPLETED:
+            self.record_metrics_endpoints()
+        return result
+
+    def record_metrics_endpoints(self) -> None:
+        """Record the metrics endpoints of the HAProxy nodes in clusterd"""
+        answers = questions.load_answers(self.client, self._HAPROXY_CONFIG)
+        metrics = answers.get("metrics", {})
+        endpoints = []
+        if metrics.get("enabled", True):
+            port = int(metrics.get("port", HAPROXY_METRICS_PORT))
+            endpoints = [
+                f"http://{node['name']}:{port}/metrics"
+                for node in self.client.cluster.list_nodes_by_role("haproxy")
+            ]
+        LOG.debug(f"HAProxy metrics endpoints: {endpoints}")
+        update_config(
+            self.client, HAPROXY_METRICS_CONFIG_KEY, {"endpoints": endpoints}
+        )
+
+    def get_manifest_overrides(
+        self, answers: dict[str, Any], section: str
+    ) -> dict[str, Any]:
+        """Get a section of the haproxy manifest config.
+
+        Sections from the manifest are stored with the answers, so that
+        later reapplies without a manifest keep them.
+        """
+        overrides = (self.preseed.get("haproxy") or {}).get(section)
+        if overrides is None:
+            return dict(answers.get(section, {}))
+        if overrides != answers.get(section):
+            answers[section] = overrides
+            questions.write_answers(self.client, self._HAPROXY_CONFIG, answers)
+        return dict(overrides)
+
+    def get_tuning(self, overrides: dict[str, Any]) -> dict[str, Any]:
+        """Get the HAProxy tuning, applying the overrides of the manifest."""
+        _, region_cores = get_role_host_resources(self.client, "region")
+        region_nodes = len(self.client.cluster.list_nodes_by_role("region"))
+        return get_haproxy_tuning(region_nodes, region_cores, overrides)
+
     def get_management_cidrs(self) -> list[str]:
         """Retrieve the Management CIDRs shared by hosts"""
         answers: dict[str, dict[str, str]] = questions.load_answers(
@@ -264,36 +557,46 @@ class DeployHAProxyApplicationStep(DeployMachineApplicationStep):
         )
         return answers["bootstrap"]["management_cidr"].split(",")
 
-    def get_tls_services_yaml(self, tls_mode: str) -> str:
-        """Get the HAProxy services.yaml for TLS, inserting the VIP for the frontend bind"""
+    def get_services_yaml(
+        self,
+        tls_mode: str,
+        tuning: dict[str, Any],
+        caching: dict[str, Any],
+        rate_limits: dict[str, Any],
+        metrics: dict[str, Any],
+    ) -> str:
+        """Get the HAProxy services.yaml for the MAAS region backends"""
         cidrs = self.get_management_cidrs()
-        services: str = (
-            """- service_name: haproxy_service
-  service_host: 0.0.0.0
-  service_port: 443
-  service_options:
-    - balance leastconn
-    - cookie SRVNAME insert
-    - http-request redirect scheme https unless { ssl_fc }"""
-            + ("\n    - mode tcp" if tls_mode == "passthrough" else "")
-            + """
-  server_options: maxconn 100 cookie S{i} check"""
-            + ("\n  crts: [DEFAULT]" if tls_mode == "termination" else "")
-            + """
-- service_name: agent_service
-  service_host: 0.0.0.0
-  service_port: 80
-  service_options:
-    - balance leastconn
-    - cookie SRVNAME insert
-    - acl is-internal src """
-            + " ".join(cidrs)
-            + """
-    - http-request deny if !is-internal
-  server_options: maxconn 100 cookie S{i} check
-"""
+        services = get_haproxy_services(
+            tls_mode, cidrs, tuning, caching, rate_limits
         )
-        return services
+        if metrics.get("enabled", True):
+            services.append(
+                get_metrics_service(
+                    cidrs, int(metrics.get("port", HAPROXY_METRICS_PORT))
+                )
+            )
+        return str(yaml.safe_dump(services, sort_keys=False))
+
+
+class ReapplyHAProxyTerraformPlanStep(DeployHAProxyApplicationStep):
+    """Reapply HAProxy Terraform plan"""
+
+    def __init__(
+        self,
+        client: Client,
+        manifest: Manifest,
+        jhelper: JujuHelper,
+        model: str,
+    ):
+        super().__init__(client, manifest, jhelper, model, refresh=True)
+        self.name = "Reapply HAProxy Terraform plan"
+        self.description = "Reapplying HAProxy Terraform plan"
+
+    def is_skip(self, status: Status | None = None) -> Result:
+        if not self.client.cluster.list_nodes_by_role("haproxy"):
+            return Result(ResultType.SKIPPED)
+        return super().is_skip(status)
 
 
 class AddHAProxyUnitsStep(AddMachineUnitsStep):
@@ -16,6 +16,7 @@
 import datetime
 import logging
 from pathlib import Path
+import re
 import shutil
 import tarfile
 import tempfile
@@ -23,20 +24,38 @@ import tempfile
 import click
 from rich.console import Console
 from snaphelpers import Snap
-from sunbeam.commands.juju import WriteCharmLogStep, WriteJujuStatusStep
-from sunbeam.jobs.common import (
-    run_plan,
-    run_preflight_checks,
-)
+from sunbeam.commands.juju import WriteJujuStatusStep
+from sunbeam.jobs.common import run_preflight_checks
 from sunbeam.jobs.deployment import Deployment
 from sunbeam.jobs.juju import JujuHelper
 
+from anvil.commands.diagnostics import performance_collect_steps
+from anvil.commands.juju import DEBUG_LOG_LEVELS, WriteCharmLogStep
 from anvil.jobs.checks import DaemonGroupCheck
+from anvil.jobs.common import run_plan
 
 LOG = logging.getLogger(__name__)
 console = Console()
 snap = Snap()
 
+DEFAULT_MAX_LOG_SIZE_MB = 100
+SINCE_UNITS = {"m": "minutes", "h": "hours", "d": "days"}
+
+
+def validate_since(
+    ctx: click.core.Context, param: click.core.Option, value: str | None
+) -> datetime.timedelta | None:
+    if value is None:
+        return None
+    match = re.fullmatch(r"(\d+)([mhd])", value)
+    if match is None:
+        raise click.BadParameter(
+            "--since must be a number followed by m, h or d, e.g. 6h", ctx
+        )
+    return datetime.timedelta(
+        **{SINCE_UNITS[match.group(2)]: int(match.group(1))}
+    )
+
 
 @click.group(
     invoke_without_command=True,
@@ -44,10 +63,61 @@ snap = Snap()
     \b
     Inspect the MAAS Anvil cluster.
     maas-anvil inspect
+    \b
+    Only capture warnings of the last 6 hours from PostgreSQL and HAProxy.
+    maas-anvil inspect --since 6h --level WARNING --app postgresql --app haproxy
+    \b
+    Also collect performance diagnostics of the cluster services.
+    maas-anvil inspect --performance
     """,
 )
+@click.option(
+    "--since",
+    callback=validate_since,
+    help=(
+        "Only capture debug-log records of the given period, "
+        "e.g. 30m, 6h or 2d."
+    ),
+)
+@click.option(
+    "--level",
+    type=click.Choice(DEBUG_LOG_LEVELS, case_sensitive=False),
+    help="Minimum severity of the captured debug-log records.",
+)
+@click.option(
+    "--app",
+    "apps",
+    multiple=True,
+    help=(
+        "Only capture debug-log records of the given application. Use "
+        "multiple --app flags to capture more than one application."
+    ),
+)
+@click.option(
+    "--max-log-size",
+    type=click.IntRange(min=0),
+    default=DEFAULT_MAX_LOG_SIZE_MB,
+    show_default=True,
+    help="Maximum size of the captured debug-log in MiB, 0 for no limit.",
+)
+@click.option(
+    "--performance",
+    is_flag=True,
+    default=False,
+    help=(
+        "Collect PostgreSQL, HAProxy, keepalived and MAAS region "
+        "performance diagnostics."
+    ),
+)
 @click.pass_context
-def inspect(ctx: click.Context) -> None:
+def inspect(
+    ctx: click.Context,
+    since: datetime.timedelta | None,
+    level: str | None,
+    apps: tuple[str, ...],
+    max_log_size: int,
+    performance: bool,
+) -> None:
     """Inspects the cluster and reports any issues it finds. A tarball of
     logs and traces is created.
     You can attach this tarball to an issue filed in the MAAS Anvil Github
@@ -82,10 +152,24 @@ def inspect(ctx: click.Context) -> None:
                     jhelper, deployment.infrastructure_model, status_file
                 ),
                 WriteCharmLogStep(
-                    jhelper, deployment.infrastructure_model, debug_file
+                    deployment.infrastructure_model,
+                    debug_file,
+                    since=since,
+                    level=level,
+                    apps=list(apps),
+                    max_bytes=max_log_size * 1024 * 1024,
                 ),
             ]
         )
+        if performance:
+            plan.extend(
+                performance_collect_steps(
+                    deployment.get_client(),
+                    jhelper,
+                    deployment.infrastructure_model,
+                    Path(tmpdirname) / "performance",
+                )
+            )
 
         run_plan(plan, console)
 
@@ -13,19 +13,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+import json
 import logging
 from os import environ
 import os.path
+from pathlib import Path
+import re
 import subprocess
+import tempfile
+import time
+from typing import Any
 
 from rich.status import Status
+from sunbeam.clusterd.client import Client
 from sunbeam.commands.juju import (
+    JujuStepHelper,
     RemoveJujuMachineStep as SunbeamRemoveJujuMachineStep,
 )
 from sunbeam.jobs.common import BaseStep, Result, ResultType
-from sunbeam.jobs.juju import CONTROLLER_MODEL
+from sunbeam.jobs.juju import CONTROLLER_MODEL, ControllerNotFoundException
 
 LOG = logging.getLogger(__name__)
+DEBUG_LOG_LEVELS = ["TRACE", "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+# Lines are printed as "<entity>: <date> <time> <level> <module> <message>"
+# when debug-log is invoked with --date.
+DEBUG_LOG_TIMESTAMP_RE = re.compile(
+    rb"^\S+: (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})"
+)
+# Juju needs an odd number of controllers to keep a quorum
+CONTROLLER_HA_NODES = 3
+CONTROLLER_HA_TIMEOUT = 1800  # seconds
+CONTROLLER_HA_POLL_INTERVAL = 10  # seconds
 
 
 class JujuAddSSHKeyStep(BaseStep):
@@ -136,3 +155,337 @@ class RemoveJujuMachineStep(SunbeamRemoveJujuMachineStep):
             return Result(ResultType.FAILED, str(e))
 
         return Result(ResultType.COMPLETED)
+
+
+class WriteCharmLogStep(BaseStep, JujuStepHelper):
+    """Write the debug-log of a model to a file, optionally filtered."""
+
+    def __init__(
+        self,
+        model: str,
+        file_path: Path,
+        since: datetime.timedelta | None = None,
+        level: str | None = None,
+        apps: list[str] | None = None,
+        max_bytes: int = 0,
+    ):
+        super().__init__("Get charm logs", "Capturing debug-log from model")
+        self.model = model
+        self.file_path = file_path
+        self.since = since
+        self.level = level
+        self.apps = apps or []
+        self.max_bytes = max_bytes
+
+    def _get_debug_log_cmd(self) -> list[str]:
+        """Build the debug-log command, pushing filters to the controller."""
+        cmd = [
+            self._get_juju_binary(),
+            "debug-log",
+            "-m",
+            self.model,
+            "--replay",
+            "--no-tail",
+            "--date",
+            "--utc",
+        ]
+        if self.level:
+            cmd.extend(["--level", self.level])
+        for app in self.apps:
+            cmd.extend(["--include", app])
+        return cmd
+
+    def run(self, status: Status | None = None) -> Result:
+        # Juju does not offer a start time filter on the CLI, so the time
+        # window is applied while streaming. Records older than the window
+        # are dropped and the stream is cut once the byte cap is reached.
+        cutoff = None
+        if self.since:
+            cutoff = (
+                datetime.datetime.now(datetime.timezone.utc).replace(
+                    tzinfo=None
+                )
+                - self.since
+            )
+        cmd = self._get_debug_log_cmd()
+        LOG.debug(f'Running command {" ".join(cmd)}')
+        written = 0
+        truncated = False
+        keep = cutoff is None
+        # stderr goes to a file, a pipe only read after stdout reached EOF
+        # would block debug-log once it is full
+        with (
+            open(self.file_path, "wb") as f,
+            tempfile.TemporaryFile() as stderr_file,
+            subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=stderr_file
+            ) as process,
+        ):
+            assert process.stdout is not None
+            for line in process.stdout:
+                if not keep:
+                    # Continuation lines of multi-line records carry no
+                    # timestamp and follow the decision of their record.
+                    match = DEBUG_LOG_TIMESTAMP_RE.match(line)
+                    if match:
+                        timestamp = datetime.datetime.strptime(
+                            match.group(1).decode(), "%Y-%m-%d %H:%M:%S"
+                        )
+                        # Records are replayed in order, so once inside
+                        # the window every following line is kept.
+                        keep = timestamp >= cutoff
+                    if not keep:
+                        continue
+                if self.max_bytes and written + len(line) > self.max_bytes:
+                    truncated = True
+                    process.terminate()
+                    break
+                f.write(line)
+                written += len(line)
+            if truncated:
+                f.write(
+                    f"# debug-log truncated at {self.max_bytes} bytes\n".encode()
+                )
+            process.wait()
+            stderr_file.seek(0)
+            stderr = stderr_file.read()
+
+        if not truncated and process.returncode != 0:
+            LOG.warning(stderr)
+            return Result(
+                ResultType.FAILED,
+                f"juju debug-log failed: {stderr.decode('utf-8', errors='ignore')}",
+            )
+        LOG.debug(f"Wrote {written} bytes of debug-log to {self.file_path}")
+        return Result(ResultType.COMPLETED)
+
+
+class EnableControllerHAStep(BaseStep, JujuStepHelper):
+    """Add controller machines on the database nodes of the cluster.
+
+    Nothing is done until there are enough database nodes to host
+    CONTROLLER_HA_NODES controllers. Only controllers on database nodes of
+    the cluster count, so after a node is removed its controller is
+    replaced.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        controller: str,
+        scale_args: list[str] | None = None,
+    ):
+        super().__init__(
+            "Enable controller HA",
+            "Enabling high availability of the Juju controller",
+        )
+        self.client = client
+        self.controller = controller
+        self.scale_args = scale_args or []
+        self.placement: list[str] = []
+
+    def _get_database_machines(self) -> list[str]:
+        return [
+            str(node["machineid"])
+            for node in self.client.cluster.list_nodes_by_role("database")
+            if node.get("machineid", -1) >= 0
+        ]
+
+    def _get_controller_machines(self) -> dict[str, Any]:
+        controller = self.get_controller(self.controller)
+        # The controller of a removed node is listed until Juju removed it
+        database_machines = self._get_database_machines()
+        return {
+            machine: info
+            for machine, info in controller.get(
+                "controller-machines", {}
+            ).items()
+            if machine in database_machines
+        }
+
+    def is_skip(self, status: Status | None = None) -> Result:
+        try:
+            machines = self._get_controller_machines()
+        except ControllerNotFoundException as e:
+            LOG.debug(e)
+            return Result(
+                ResultType.FAILED, f"Controller {self.controller} not found"
+            )
+        if len(machines) >= CONTROLLER_HA_NODES:
+            return Result(ResultType.SKIPPED)
+
+        candidates = [
+            machine
+            for machine in self._get_database_machines()
+            if machine not in machines
+        ]
+        missing = CONTROLLER_HA_NODES - len(machines)
+        if len(candidates) < missing:
+            message = (
+                f"Controller HA needs {CONTROLLER_HA_NODES} database nodes, "
+                f"{len(machines) + len(candidates)} available"
+            )
+            LOG.debug(message)
+            return Result(ResultType.SKIPPED, message)
+        self.placement = candidates[:missing]
+        return Result(ResultType.COMPLETED)
+
+    def run(self, status: Status | None = None) -> Result:
+        cmd = [
+            self._get_juju_binary(),
+            "enable-ha",
+            "-c",
+            self.controller,
+            "-n",
+            str(CONTROLLER_HA_NODES),
+            "--to",
+            ",".join(self.placement),
+            *self.scale_args,
+        ]
+        try:
+            LOG.debug(f'Running command {" ".join(cmd)}')
+            process = subprocess.run(
+                cmd, capture_output=True, text=True, check=True
+            )
+            LOG.debug(
+                f"Command finished. stdout={process.stdout}, stderr={process.stderr}"
+            )
+        except subprocess.CalledProcessError as e:
+            LOG.exception("Error enabling controller HA")
+            LOG.warning(e.stderr)
+            return Result(ResultType.FAILED, str(e))
+
+        deadline = time.monotonic() + CONTROLLER_HA_TIMEOUT
+        while True:
+            try:
+                machines = self._get_controller_machines()
+            except ControllerNotFoundException as e:
+                LOG.debug(e)
+                machines = {}
+            pending = [
+                machine
+                for machine, info in machines.items()
+                if info.get("ha-status") != "ha-enabled"
+            ]
+            if len(machines) >= CONTROLLER_HA_NODES and not pending:
+                return Result(ResultType.COMPLETED)
+            if time.monotonic() > deadline:
+                return Result(
+                    ResultType.FAILED,
+                    "Timed out waiting for the controller machines "
+                    f"{', '.join(pending or self.placement)}",
+                )
+            self.update_status(
+                status,
+                f"waiting for {len(pending)} controller machine(s)",
+            )
+            time.sleep(CONTROLLER_HA_POLL_INTERVAL)
+
+
+def _format_config_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+
+class ConfigureJujuStep(BaseStep, JujuStepHelper):
+    """Apply the model and controller config of the manifest.
+
+    The 'controller' section of the deployment config holds the model-config
+    of the model the applications are deployed in, under 'model_config', and
+    the controller-config under 'controller_config'. Only the keys whose
+    value differs from the current one are set.
+    """
+
+    def __init__(
+        self, deployment_config: dict[str, Any], controller: str, model: str
+    ):
+        super().__init__(
+            "Configure Juju", "Configuring Juju model and controller"
+        )
+        section = deployment_config.get("controller") or {}
+        self.model_config = dict(section.get("model_config") or {})
+        self.controller_config = dict(section.get("controller_config") or {})
+        self.controller = controller
+        self.model = model
+        self.model_changes: dict[str, str] = {}
+        self.controller_changes: dict[str, str] = {}
+
+    def _juju(self, *args: str) -> str:
+        cmd = [self._get_juju_binary(), *args]
+        LOG.debug(f"Running command {' '.join(cmd)}")
+        process = subprocess.run(
+            cmd, capture_output=True, text=True, check=True
+        )
+        return process.stdout
+
+    def _get_changes(
+        self, wanted: dict[str, Any], current: dict[str, Any]
+    ) -> dict[str, str]:
+        changes = {}
+        for key, value in wanted.items():
+            value = _format_config_value(value)
+            if key not in current or value != _format_config_value(
+                current[key]
+            ):
+                changes[key] = value
+        return changes
+
+    def is_skip(self, status: Status | None = None) -> Result:
+        if not self.model_config and not self.controller_config:
+            return Result(ResultType.SKIPPED)
+        try:
+            if self.model_config:
+                output = json.loads(
+                    self._juju(
+                        "model-config", "-m", self.model, "--format", "json"
+                    )
+                )
+                current = {
+                    key: item.get("Value") for key, item in output.items()
+                }
+                self.model_changes = self._get_changes(
+                    self.model_config, current
+                )
+            if self.controller_config:
+                current = json.loads(
+                    self._juju(
+                        "controller-config",
+                        "-c",
+                        self.controller,
+                        "--format",
+                        "json",
+                    )
+                )
+                self.controller_changes = self._get_changes(
+                    self.controller_config, current
+                )
+        except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
+            LOG.debug(e, exc_info=True)
+            return Result(ResultType.FAILED, "Unable to read Juju config")
+        if not self.model_changes and not self.controller_changes:
+            return Result(ResultType.SKIPPED)
+        return Result(ResultType.COMPLETED)
+
+    def run(self, status: Status | None = None) -> Result:
+        try:
+            if self.model_changes:
+                self._juju(
+                    "model-config",
+                    "-m",
+                    self.model,
+                    *(f"{k}={v}" for k, v in self.model_changes.items()),
+                )
+            if self.controller_changes:
+                self._juju(
+                    "controller-config",
+                    "-c",
+                    self.controller,
+                    *(f"{k}={v}" for k, v in self.controller_changes.items()),
+                )
+        except subprocess.CalledProcessError as e:
+            LOG.warning(e.stderr)
+            return Result(
+                ResultType.FAILED, f"Unable to configure Juju: {e.stderr}"
+            )
+        return Result(ResultType.COMPLETED)
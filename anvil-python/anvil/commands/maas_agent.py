@@ -25,7 +25,10 @@ from sunbeam.jobs.steps import (
 )
 
 from anvil.jobs.manifest import Manifest
-from anvil.jobs.steps import RemoveMachineUnitStep
+from anvil.jobs.steps import (
+    ConfigureBootResourcesStorageStep,
+    RemoveMachineUnitStep,
+)
 from anvil.utils import get_architecture
 
 APPLICATION = "maas-agent"
@@ -130,6 +133,7 @@ def maas_agent_install_steps(
         TerraformInitStep(manifest.get_tfhelper("maas-agent-plan")),
         DeployMAASAgentApplicationStep(client, manifest, jhelper, model),
         AddMAASAgentUnitsStep(client, fqdn, jhelper, model),
+        ConfigureBootResourcesStorageStep(manifest, APPLICATION, model),
     ]
 
 
@@ -34,7 +34,10 @@ from sunbeam.jobs.steps import (
 
 from anvil.commands.haproxy import HAPROXY_CONFIG_KEY, tls_questions
 from anvil.jobs.manifest import Manifest
-from anvil.jobs.steps import RemoveMachineUnitStep
+from anvil.jobs.steps import (
+    ConfigureBootResourcesStorageStep,
+    RemoveMachineUnitStep,
+)
 from anvil.utils import get_architecture
 
 LOG = logging.getLogger(__name__)
@@ -228,6 +231,7 @@ def maas_region_install_steps(
             accept_defaults=accept_defaults,
         ),
         AddMAASRegionUnitsStep(client, fqdn, jhelper, model),
+        ConfigureBootResourcesStorageStep(manifest, APPLICATION, model),
     ]
 
 
@@ -0,0 +1,54 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import click
+from snaphelpers import Snap
+
+from anvil.jobs.metrics import (
+    FORMAT_PROMETHEUS,
+    METRICS_FORMATS,
+    get_state_dir,
+    load,
+)
+from anvil.utils import FormatEpilogCommand
+
+
+@click.command(
+    cls=FormatEpilogCommand,
+    epilog="""
+    \b
+    Show the metrics in the Prometheus text format.
+    maas-anvil metrics
+    \b
+    Show the metrics in the OpenMetrics text format.
+    maas-anvil metrics --format openmetrics
+    """,
+)
+@click.option(
+    "-f",
+    "--format",
+    type=click.Choice(METRICS_FORMATS),
+    default=FORMAT_PROMETHEUS,
+    help="Output format of the metrics.",
+)
+def metrics(format: str) -> None:
+    """Shows the metrics of the maas-anvil commands run on this node.
+    The durations of commands, steps, Terraform plans, Juju waits and
+    clusterd calls are recorded, as well as the failed commands and steps.
+    The metrics are also written to the anvil.prom file of the node-exporter
+    textfile collector directory set by the metrics.textfile-dir snap option.
+    """
+    registry = load(get_state_dir(Snap()))
+    click.echo(registry.render(format), nl=False)
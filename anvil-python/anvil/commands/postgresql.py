@@ -18,18 +18,24 @@ from typing import Any, List
 
 from rich.status import Status
 from sunbeam.clusterd.client import Client
-from sunbeam.commands.terraform import TerraformInitStep
+from sunbeam.clusterd.service import ConfigItemNotFoundException
+from sunbeam.commands.terraform import TerraformException, TerraformInitStep
 from sunbeam.jobs import questions
-from sunbeam.jobs.common import BaseStep, Result, ResultType
+from sunbeam.jobs.common import BaseStep, Result, ResultType, read_config
 from sunbeam.jobs.juju import JujuHelper
 from sunbeam.jobs.steps import (
     AddMachineUnitsStep,
     DeployMachineApplicationStep,
 )
 
+from anvil.jobs.inventory import JUJU_STORAGE_DIR
 from anvil.jobs.manifest import Manifest
-from anvil.jobs.steps import RemoveMachineUnitStep
-from anvil.utils import get_architecture
+from anvil.jobs.steps import (
+    RemoveMachineUnitStep,
+    get_host_inventories,
+    get_role_host_resources,
+)
+from anvil.utils import get_architecture, parse_storage_size
 
 LOG = logging.getLogger(__name__)
 APPLICATION = "postgresql"
@@ -41,6 +47,31 @@ POSTGRESQL_APP_TIMEOUT = (
 POSTGRESQL_UNIT_TIMEOUT = (
     1200  # 15 minutes, adding / removing units can take a long time
 )
+POSTGRESQL_PROFILES = ["default", "auto", "oltp-small", "oltp-large"]
+# Matches the max_connections_per_region default of the postgresql plan
+MAX_CONNECTIONS_PER_REGION = 50
+# Database nodes with at least 32 GB of RAM get the oltp-large profile
+AUTO_PROFILE_LARGE_RAM_KB = 32 * 1024 * 1024
+# Share of the RAM for shared_buffers and upper bounds for work_mem and
+# maintenance_work_mem in KB
+PROFILE_SETTINGS: dict[str, dict[str, Any]] = {
+    "oltp-small": {
+        "shared_buffers": 0.15,
+        "max_work_mem": 64 * 1024,
+        "max_maintenance_work_mem": 512 * 1024,
+    },
+    "oltp-large": {
+        "shared_buffers": 0.25,
+        "max_work_mem": 256 * 1024,
+        "max_maintenance_work_mem": 2 * 1024 * 1024,
+    },
+}
+MIN_WORK_MEM_KB = 4 * 1024
+# Juju storage of the PostgreSQL 16 charm for the keys of the manifest
+POSTGRESQL_STORAGE = {"pgdata": "data", "wal": "logs"}
+DISK_TYPES = ["nvme", "ssd", "hdd"]
+# Storage pools of the manual cloud which outlive a reboot, tmpfs does not
+STORAGE_POOLS = ["rootfs", "loop"]
 
 
 def postgresql_install_steps(
@@ -94,6 +125,11 @@ def postgresql_questions() -> dict[str, questions.PromptQuestion]:
             default_value="default",
             validation_function=validate_max_connections,
         ),
+        "profile": questions.PromptQuestion(
+            f"Tuning profile for the database server: {POSTGRESQL_PROFILES}",
+            default_value="default",
+            validation_function=validate_profile,
+        ),
     }
 
 
@@ -111,6 +147,225 @@ def validate_max_connections(value: str) -> str | ValueError:
         )
 
 
+def validate_profile(value: str) -> None:
+    if value not in POSTGRESQL_PROFILES:
+        raise ValueError(f"Profile must be one of {POSTGRESQL_PROFILES}")
+
+
+def get_max_connections(
+    max_connections: str,
+    region_nodes: int,
+    connections_per_region: int = MAX_CONNECTIONS_PER_REGION,
+) -> int:
+    """Return the max_connections the postgresql plan configures."""
+    if max_connections == "default":
+        return 100
+    if max_connections == "dynamic":
+        return max(100, 10 + connections_per_region * region_nodes)
+    return int(max_connections)
+
+
+def get_max_connections_per_region(
+    client: Client, answers: dict[str, Any]
+) -> int:
+    """Return the max_connections_per_region the postgresql plan uses.
+
+    The variable is taken from the answers, then from the tfvars the plan
+    was last applied with, and defaults to the one of the plan.
+    """
+    if "max_connections_per_region" in answers:
+        return int(answers["max_connections_per_region"])
+    try:
+        tfvars = read_config(client, CONFIG_KEY)
+    except ConfigItemNotFoundException:
+        tfvars = {}
+    return int(
+        tfvars.get("max_connections_per_region", MAX_CONNECTIONS_PER_REGION)
+    )
+
+
+def get_postgresql_tuning(
+    profile: str, memory_kb: int, cores: int, max_connections: int
+) -> dict[str, str]:
+    """Derive the PostgreSQL charm memory settings for a tuning profile.
+
+    shared_buffers gets a share of the RAM depending on the profile,
+    maintenance_work_mem 5% of it. The remaining RAM is split over three
+    sorts per connection and the parallel workers of a query.
+
+    :param profile: one of POSTGRESQL_PROFILES
+    :param memory_kb: RAM of the smallest database node in KB
+    :param cores: CPU cores of the smallest database node
+    :param max_connections: maximum number of connections to the server
+    :return: charm config, empty for the default profile
+    """
+    if profile == "default" or memory_kb <= 0:
+        return {}
+    if profile == "auto":
+        profile = (
+            "oltp-large"
+            if memory_kb >= AUTO_PROFILE_LARGE_RAM_KB
+            else "oltp-small"
+        )
+    settings = PROFILE_SETTINGS[profile]
+
+    shared_buffers_kb = int(memory_kb * settings["shared_buffers"])
+    parallel_workers = max(1, cores // 2)
+    work_mem_kb = (memory_kb - shared_buffers_kb) // (
+        max_connections * 3 * parallel_workers
+    )
+    work_mem_kb = min(
+        max(work_mem_kb, MIN_WORK_MEM_KB), settings["max_work_mem"]
+    )
+    maintenance_work_mem_kb = min(
+        memory_kb // 20, settings["max_maintenance_work_mem"]
+    )
+    return {
+        # shared_buffers is configured in pages of 8 KB
+        "memory_shared_buffers": str(shared_buffers_kb // 8),
+        "memory_work_mem": str(work_mem_kb),
+        "memory_maintenance_work_mem": str(maintenance_work_mem_kb),
+    }
+
+
+def get_storage_directives(storage: dict[str, Any]) -> dict[str, str]:
+    """Return the Juju storage directives for the postgres storage section.
+
+    :param storage: storage section of the manifest, per POSTGRESQL_STORAGE
+                    key the Juju storage pool, size and optional disk_type
+    :raises ValueError: if the section is invalid
+    """
+    directives = {}
+    for key, options in storage.items():
+        if key not in POSTGRESQL_STORAGE:
+            raise ValueError(
+                f"Storage must be one of {list(POSTGRESQL_STORAGE)}, not {key}"
+            )
+        if not options.get("pool") or not options.get("size"):
+            raise ValueError(f"Storage {key} needs a pool and a size")
+        if options["pool"] not in STORAGE_POOLS:
+            raise ValueError(
+                f"Storage pool of {key} must be one of {STORAGE_POOLS}, the "
+                "manual cloud has no pool that targets a disk"
+            )
+        parse_storage_size(options["size"])
+        disk_type = options.get("disk_type")
+        if disk_type and disk_type not in DISK_TYPES:
+            raise ValueError(f"Disk type must be one of {DISK_TYPES}")
+        directives[POSTGRESQL_STORAGE[key]] = (
+            f"{options['pool']},{options['size']}"
+        )
+    return directives
+
+
+def check_storage_fits(
+    storage: dict[str, Any], inventories: list[dict[str, Any]]
+) -> None:
+    """Check that the database nodes can hold the postgres storage.
+
+    The storage pools of the manual cloud cannot target a device: rootfs
+    directories and loop device files are created on the filesystem of
+    JUJU_STORAGE_DIR. So the filesystem recorded for it on every database
+    node needs to be of the disk_type, if one is given, and to have room
+    for all the requested storage. The free space is the one recorded when
+    the node joined.
+
+    :param storage: valid storage section of the manifest
+    :param inventories: inventories of the database nodes
+    :raises ValueError: if the storage does not fit
+    """
+    total_size = sum(
+        parse_storage_size(options["size"]) for options in storage.values()
+    )
+    for inventory in inventories:
+        filesystem = inventory.get("juju_storage")
+        if not filesystem:
+            raise ValueError(
+                f"No filesystem of {JUJU_STORAGE_DIR} recorded for database "
+                f"node {inventory['name']}"
+            )
+        for key, options in storage.items():
+            disk_type = options.get("disk_type")
+            if disk_type and filesystem["type"] != disk_type:
+                raise ValueError(
+                    f"{key} is on {filesystem['disk'] or 'an unknown disk'} "
+                    f"({filesystem['type'] or 'unknown type'}), not on a "
+                    f"{disk_type} disk, on database node {inventory['name']}"
+                )
+        if filesystem["free"] // (1024 * 1024) < total_size:
+            raise ValueError(
+                f"{filesystem['path']} has {filesystem['free'] // 1024**3}G "
+                f"free for {total_size // 1024}G of storage on database node "
+                f"{inventory['name']}"
+            )
+
+
+def get_deployed_storage_directives(client: Client) -> dict[str, str] | None:
+    """Return the storage directives the postgresql plan was applied with.
+
+    :return: None if the plan was not applied yet
+    """
+    try:
+        tfvars = read_config(client, CONFIG_KEY)
+    except ConfigItemNotFoundException:
+        return None
+    return dict(tfvars.get("storage_directives") or {})
+
+
+def get_postgresql_tfvars(client: Client) -> dict[str, Any]:
+    """Return the tfvars of the postgresql plan from the stored answers."""
+    variables: dict[str, Any] = questions.load_answers(
+        client, POSTGRESQL_CONFIG_KEY
+    )
+    variables["maas_region_nodes"] = len(
+        client.cluster.list_nodes_by_role("region")
+    )
+    # Size the tuning for the connections the plan allows
+    variables["max_connections_per_region"] = get_max_connections_per_region(
+        client, variables
+    )
+    memory_kb, cores = get_role_host_resources(client, "database")
+    variables["charm_postgresql_tuning"] = get_postgresql_tuning(
+        variables.pop("profile", "default"),
+        memory_kb,
+        cores,
+        get_max_connections(
+            variables.get("max_connections", "default"),
+            variables["maas_region_nodes"],
+            variables["max_connections_per_region"],
+        ),
+    )
+    storage = variables.pop("storage", {})
+    try:
+        directives = get_storage_directives(storage)
+    except ValueError as e:
+        raise TerraformException(f"Invalid PostgreSQL storage: {e}")
+    # The plan ignores changes of the storage, Juju only applies it when
+    # the application is deployed
+    deployed = get_deployed_storage_directives(client)
+    if deployed is not None:
+        if directives != deployed:
+            raise TerraformException(
+                "PostgreSQL storage can only be set when PostgreSQL is "
+                f"first deployed, it was deployed with {deployed or 'none'}"
+            )
+    else:
+        inventories = get_host_inventories(client)
+        database_inventories = [
+            {"name": node["name"], **inventories[node["name"]]}
+            for node in client.cluster.list_nodes_by_role("database")
+            if node["name"] in inventories
+        ]
+        try:
+            check_storage_fits(storage, database_inventories)
+        except ValueError as e:
+            raise TerraformException(f"Invalid PostgreSQL storage: {e}")
+    variables["storage_directives"] = directives
+    if get_architecture() == "arm64":
+        variables["arch"] = "arm64"
+    return variables
+
+
 class DeployPostgreSQLApplicationStep(DeployMachineApplicationStep):
     """Deploy PostgreSQL application using Terraform"""
 
@@ -149,9 +404,11 @@ class DeployPostgreSQLApplicationStep(DeployMachineApplicationStep):
     def prompt(self, console: questions.Console | None = None) -> None:
         variables = questions.load_answers(self.client, self._CONFIG)
         variables.setdefault("max_connections", "default")
+        variables.setdefault("profile", "default")
 
         # Set defaults
         self.preseed.setdefault("max_connections", "default")
+        self.preseed.setdefault("profile", "default")
 
         postgresql_config_bank = questions.QuestionBank(
             questions=postgresql_questions(),
@@ -162,20 +419,17 @@ class DeployPostgreSQLApplicationStep(DeployMachineApplicationStep):
         )
         max_connections = postgresql_config_bank.max_connections.ask()
         variables["max_connections"] = max_connections
+        variables["profile"] = postgresql_config_bank.profile.ask()
+        # Juju only applies storage when the application is deployed
+        storage = (self.preseed.get("postgres") or {}).get("storage")
+        if storage is not None:
+            variables["storage"] = storage
 
         LOG.debug(variables)
         questions.write_answers(self.client, self._CONFIG, variables)
 
     def extra_tfvars(self) -> dict[str, Any]:
-        variables: dict[str, Any] = questions.load_answers(
-            self.client, self._CONFIG
-        )
-        variables["maas_region_nodes"] = len(
-            self.client.cluster.list_nodes_by_role("region")
-        )
-        if get_architecture() == "arm64":
-            variables["arch"] = "arm64"
-        return variables
+        return get_postgresql_tfvars(self.client)
 
     def has_prompts(self) -> bool:
         """Returns true if the step has prompts that it can ask the user.
@@ -223,15 +477,7 @@ class ReapplyPostgreSQLTerraformPlanStep(DeployMachineApplicationStep):
         return POSTGRESQL_APP_TIMEOUT
 
     def extra_tfvars(self) -> dict[str, Any]:
-        variables: dict[str, Any] = questions.load_answers(
-            self.client, self._CONFIG
-        )
-        variables["maas_region_nodes"] = len(
-            self.client.cluster.list_nodes_by_role("region")
-        )
-        if get_architecture() == "arm64":
-            variables["arch"] = "arm64"
-        return variables
+        return get_postgresql_tfvars(self.client)
 
     def is_skip(self, status: Status | None = None) -> Result:
         variables: dict[str, Any] = questions.load_answers(
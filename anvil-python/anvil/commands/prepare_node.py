@@ -13,8 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import shlex
+
 import click
 from rich.console import Console
+import yaml
 
 from anvil.utils import FormatEpilogCommand
 
@@ -23,6 +26,9 @@ console = Console()
 
 JUJU_CHANNEL = "3.6/stable"
 SUPPORTED_RELEASE = "noble"
+# Default user of the Ubuntu images deployed by MAAS
+CLOUD_INIT_USER = "ubuntu"
+CLOUD_INIT_SCRIPT = "/var/tmp/maas-anvil-prepare-node.sh"
 
 PREPARE_NODE_TEMPLATE = f"""#!/bin/bash
 [ $(lsb_release -sc) != '{SUPPORTED_RELEASE}' ] && \
@@ -59,6 +65,14 @@ dpkg -s openssh-server &> /dev/null || {{
 # of the Juju controller to the local machine via SSH.
 sudo snap connect maas-anvil:ssh-keys
 
+# Connect snap to the hardware-observe interface to allow
+# recording the disks and NICs of the node when it joins.
+sudo snap connect maas-anvil:hardware-observe
+
+# Connect snap to the juju-storage interface to allow
+# benchmarking the disk mounted for the Juju storage.
+sudo snap connect maas-anvil:juju-storage
+
 # Add $USER to the snap_daemon group supporting interaction
 # with the MAAS Anvil clustering daemon for cluster operations.
 sudo usermod --append --groups snap_daemon $USER
@@ -84,6 +98,57 @@ sudo snap connect maas-anvil:dot-config-anvil
 """
 
 
+class _UserDataDumper(yaml.SafeDumper):
+    """Dump multi-line strings as literal blocks, to keep scripts readable."""
+
+    def represent_str(self, data: str) -> yaml.ScalarNode:
+        if "\n" in data:
+            return self.represent_scalar(
+                "tag:yaml.org,2002:str", data, style="|"
+            )
+        return super().represent_str(data)
+
+
+_UserDataDumper.add_representer(str, _UserDataDumper.represent_str)
+
+
+def generate_user_data(token: str, roles: list[str], channel: str) -> str:
+    """Return cloud-init user data preparing the node and joining it.
+
+    The node is prepared and joined as CLOUD_INIT_USER, in login shells so
+    that the join runs with the snap_daemon group added by the preparation.
+
+    :param token: join token generated for the node with 'cluster add'
+    :param roles: roles the node joins the cluster with
+    :param channel: channel of the maas-anvil snap the node installs
+    """
+    join = ["maas-anvil", "cluster", "join", "--accept-defaults"]
+    join += ["--token", token]
+    for role in roles:
+        join += ["--role", role]
+    user_data = {
+        "write_files": [
+            {
+                "path": CLOUD_INIT_SCRIPT,
+                "permissions": "0755",
+                "content": PREPARE_NODE_TEMPLATE,
+            }
+        ],
+        "runcmd": [
+            ["snap", "install", "maas-anvil", "--channel", channel],
+            ["su", "-", CLOUD_INIT_USER, "-c", CLOUD_INIT_SCRIPT],
+            ["su", "-", CLOUD_INIT_USER, "-c", shlex.join(join)],
+        ],
+    }
+    return "#cloud-config\n" + yaml.dump(
+        user_data,
+        Dumper=_UserDataDumper,
+        default_flow_style=None,
+        sort_keys=False,
+        width=1000,
+    )
+
+
 @click.command(
     cls=FormatEpilogCommand,
     epilog="""
@@ -18,14 +18,15 @@ from pathlib import Path
 
 import click
 from rich.console import Console
-from sunbeam.jobs.common import (
-    run_plan,
-)
 from sunbeam.jobs.juju import JujuHelper
 import yaml
 
+from anvil.commands.juju import ConfigureJujuStep
 from anvil.commands.upgrades.inter_channel import ChannelUpgradeCoordinator
 from anvil.commands.upgrades.intra_channel import LatestInChannelCoordinator
+from anvil.jobs.bindings import AddJujuSpacesStep
+from anvil.jobs.common import run_plan
+from anvil.jobs.juju import CONTROLLER
 from anvil.jobs.manifest import AddManifestStep, Manifest
 from anvil.provider.local.deployment import LocalDeployment
 from anvil.utils import FormatEpilogCommand
@@ -125,6 +126,14 @@ def refresh(
         )
     )
     upgrade_plan = coordinator.get_plan()  # type:ignore [attr-defined]
-    run_plan(upgrade_plan, console)
+    spaces_step = AddJujuSpacesStep(
+        manifest.deployment_config, deployment.infrastructure_model
+    )
+    juju_step = ConfigureJujuStep(
+        manifest.deployment_config,
+        CONTROLLER,
+        deployment.infrastructure_model,
+    )
+    run_plan([spaces_step, juju_step, *upgrade_plan], console)
 
     click.echo("Refresh complete.")
@@ -0,0 +1,433 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from dataclasses import dataclass, field
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import subprocess
+import time
+from typing import Any, Callable
+import urllib.parse
+import urllib.request
+
+import click
+from rich.console import Console, Group
+from rich.live import Live
+from rich.table import Table
+from sunbeam.clusterd.client import Client
+from sunbeam.clusterd.service import ConfigItemNotFoundException
+from sunbeam.commands.juju import JujuStepHelper
+from sunbeam.jobs.common import ResultType, read_config, run_preflight_checks
+from sunbeam.jobs.juju import JujuHelper
+
+from anvil.commands.clusterd import ClusterListNodeStep
+from anvil.commands.diagnostics import CollectRegionProcessesStep
+from anvil.commands.haproxy import HAPROXY_METRICS_CONFIG_KEY
+from anvil.jobs.checks import DaemonGroupCheck, VerifyBootstrappedCheck
+from anvil.provider.local.deployment import LocalDeployment
+from anvil.utils import FormatEpilogCommand
+
+LOG = logging.getLogger(__name__)
+console = Console()
+
+DEFAULT_INTERVAL = 5
+# juju exec is too heavy to run on every refresh, the region CPU usage is
+# read at most once per interval
+REGION_CPU_INTERVAL = 60
+HTTP_TIMEOUT = 2
+PROMETHEUS_SAMPLE = re.compile(
+    r"^(?P<name>[a-zA-Z_:][\w:]*)(?:\{(?P<labels>.*)\})?\s+(?P<value>\S+)"
+)
+PROMETHEUS_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+HAPROXY_BACKEND_METRICS = {
+    "haproxy_backend_current_sessions": "sessions",
+    "haproxy_backend_current_queue": "queue",
+    "haproxy_backend_max_queue": "max_queue",
+}
+POSTGRESQL_APPLICATION = "postgresql"
+# Port of the postgres_exporter run by the postgresql charm
+POSTGRESQL_EXPORTER_PORT = 9187
+# The replication lag metric was renamed in postgres_exporter 0.13
+PG_REPLICATION_LAG_METRICS = (
+    "pg_replication_lag_seconds",
+    "pg_replication_lag",
+)
+REGION_CPU_SCRIPT = "head -1 /proc/stat; nproc"
+WORKLOAD_STATUS_COLORS = {
+    "active": "green",
+    "maintenance": "yellow",
+    "waiting": "yellow",
+    "blocked": "red",
+    "error": "red",
+}
+
+
+def parse_prometheus_text(
+    text: str,
+) -> list[tuple[str, dict[str, str], float]]:
+    """Return the samples of metrics in the Prometheus text format"""
+    samples = []
+    for line in text.splitlines():
+        match = PROMETHEUS_SAMPLE.match(line)
+        if line.startswith("#") or match is None:
+            continue
+        try:
+            value = float(match.group("value"))
+        except ValueError:
+            continue
+        labels = dict(PROMETHEUS_LABEL.findall(match.group("labels") or ""))
+        samples.append((match.group("name"), labels, value))
+    return samples
+
+
+def get_haproxy_backends(
+    samples: list[tuple[str, dict[str, str], float]],
+) -> dict[str, dict[str, float]]:
+    """Return the sessions and queue of every HAProxy backend"""
+    backends: dict[str, dict[str, float]] = {}
+    for name, labels, value in samples:
+        if name in HAPROXY_BACKEND_METRICS and "proxy" in labels:
+            backend = backends.setdefault(labels["proxy"], {})
+            backend[HAPROXY_BACKEND_METRICS[name]] = value
+    return backends
+
+
+def get_postgresql_stats(
+    samples: list[tuple[str, dict[str, str], float]],
+) -> dict[str, Any]:
+    """Return the connections and replication delay of a PostgreSQL exporter"""
+    stats: dict[str, Any] = {"connections": 0}
+    for name, labels, value in samples:
+        if name == "pg_stat_database_numbackends":
+            stats["connections"] += int(value)
+        elif name == "pg_settings_max_connections":
+            stats["max_connections"] = int(value)
+        elif name == "pg_replication_is_replica":
+            stats["in_recovery"] = bool(value)
+        elif name in PG_REPLICATION_LAG_METRICS:
+            stats["replay_delay"] = value
+    return stats
+
+
+def get_cpu_percent(previous: list[int], current: list[int]) -> float | None:
+    """Return the CPU usage between two readings of the /proc/stat cpu line"""
+    # The idle and iowait times are the 4th and 5th fields
+    total = sum(current) - sum(previous)
+    idle = sum(current[3:5]) - sum(previous[3:5])
+    if total <= 0:
+        return None
+    return 100 * (total - idle) / total
+
+
+@dataclass
+class Snapshot:
+    """Performance data of the cluster at a point in time."""
+
+    nodes: dict[str, Any] = field(default_factory=dict)
+    units: dict[str, list[tuple[str, str]]] = field(default_factory=dict)
+    haproxy: dict[str, dict[str, dict[str, float]]] = field(
+        default_factory=dict
+    )
+    postgresql: dict[str, dict[str, Any]] = field(default_factory=dict)
+    region_cpu: dict[str, tuple[float | None, int]] = field(
+        default_factory=dict
+    )
+    errors: list[str] = field(default_factory=list)
+
+
+class ClusterMonitor(JujuStepHelper):
+    """Poll the cluster topology, Juju status and service metrics."""
+
+    def __init__(self, client: Client, jhelper: JujuHelper, model: str):
+        self.client = client
+        self.jhelper = jhelper
+        self.model = model
+        self.region = CollectRegionProcessesStep(
+            jhelper, model, Path(os.devnull)
+        )
+        self.region_cpu: dict[str, list[int]] = {}
+        self.region_cpu_usage: dict[str, tuple[float | None, int]] = {}
+        self.region_cpu_time: float | None = None
+
+    def juju(self, *args: str) -> dict[str, Any]:
+        process = subprocess.run(
+            [
+                self._get_juju_binary(),
+                *args,
+                "-m",
+                self.model,
+                "--format",
+                "json",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return dict(json.loads(process.stdout))
+
+    def get_units(
+        self, status: dict[str, Any]
+    ) -> dict[str, list[tuple[str, str]]]:
+        """Return the units and their workload status per Juju machine"""
+        units: dict[str, list[tuple[str, str]]] = {}
+        for application in status.get("applications", {}).values():
+            for name, unit in (application.get("units") or {}).items():
+                machine_units = units.setdefault(unit.get("machine"), [])
+                machine_units.append(
+                    (name, unit["workload-status"].get("current", "unknown"))
+                )
+                for sub_name, sub in (unit.get("subordinates") or {}).items():
+                    machine_units.append(
+                        (
+                            sub_name,
+                            sub["workload-status"].get("current", "unknown"),
+                        )
+                    )
+        return units
+
+    def get_haproxy(self) -> dict[str, dict[str, dict[str, float]]]:
+        """Return the backends per HAProxy metrics endpoint"""
+        try:
+            endpoints = read_config(
+                self.client, HAPROXY_METRICS_CONFIG_KEY
+            ).get("endpoints", [])
+        except ConfigItemNotFoundException:
+            return {}
+        haproxy = {}
+        for endpoint in endpoints:
+            with urllib.request.urlopen(endpoint, timeout=HTTP_TIMEOUT) as r:
+                samples = parse_prometheus_text(r.read().decode())
+            haproxy[endpoint] = get_haproxy_backends(samples)
+        return haproxy
+
+    def get_postgresql(
+        self, status: dict[str, Any]
+    ) -> dict[str, dict[str, Any]]:
+        """Return the connections and replication delay per unit"""
+        application = status.get("applications", {}).get(
+            POSTGRESQL_APPLICATION, {}
+        )
+        postgresql = {}
+        for unit, unit_status in (application.get("units") or {}).items():
+            endpoint = (
+                f"http://{unit_status['public-address']}:"
+                f"{POSTGRESQL_EXPORTER_PORT}/metrics"
+            )
+            with urllib.request.urlopen(endpoint, timeout=HTTP_TIMEOUT) as r:
+                samples = parse_prometheus_text(r.read().decode())
+            postgresql[unit] = get_postgresql_stats(samples)
+        return postgresql
+
+    def get_region_cpu(self) -> dict[str, tuple[float | None, int]]:
+        """Return the CPU usage since the last reading and cores per unit"""
+        now = time.monotonic()
+        if (
+            self.region_cpu_time is not None
+            and now - self.region_cpu_time < REGION_CPU_INTERVAL
+        ):
+            return self.region_cpu_usage
+        self.region_cpu_time = now
+        region_cpu = {}
+        for unit, result in self.region.exec(REGION_CPU_SCRIPT).items():
+            stat, cores = result.get("stdout", "").splitlines()[:2]
+            current = [int(value) for value in stat.split()[1:]]
+            previous = self.region_cpu.get(unit)
+            self.region_cpu[unit] = current
+            region_cpu[unit] = (
+                get_cpu_percent(previous, current) if previous else None,
+                int(cores),
+            )
+        self.region_cpu_usage = region_cpu
+        return region_cpu
+
+    def collect(
+        self, snapshot: Snapshot, name: str, get: Callable[[], Any]
+    ) -> Any:
+        """Return the data read by get, or None and record the error"""
+        try:
+            return get()
+        except (
+            OSError,
+            ValueError,
+            KeyError,
+            IndexError,
+            subprocess.CalledProcessError,
+        ) as e:
+            LOG.debug(e, exc_info=True)
+            snapshot.errors.append(f"{name} unavailable: {e}")
+            return None
+
+    def poll(self) -> Snapshot:
+        snapshot = Snapshot()
+        result = ClusterListNodeStep(self.client).run()
+        if result.result_type == ResultType.COMPLETED:
+            snapshot.nodes = result.message
+        status = self.collect(
+            snapshot, "Juju status", lambda: self.juju("status")
+        )
+        sources = {
+            "units": ("Juju status", lambda: self.get_units(status)),
+            "haproxy": ("HAProxy metrics", self.get_haproxy),
+            "postgresql": (
+                "PostgreSQL metrics",
+                lambda: self.get_postgresql(status),
+            ),
+            "region_cpu": ("MAAS region CPU", self.get_region_cpu),
+        }
+        for attribute, (name, get) in sources.items():
+            if status is None and attribute in ("units", "postgresql"):
+                continue
+            value = self.collect(snapshot, name, get)
+            if value is not None:
+                setattr(snapshot, attribute, value)
+        return snapshot
+
+
+def _format_status(status: str) -> str:
+    color = WORKLOAD_STATUS_COLORS.get(status)
+    return f"[{color}]{status}[/{color}]" if color else status
+
+
+def _format_seconds(value: float | None) -> str:
+    return "-" if value is None else f"{value:.1f}s"
+
+
+def render(snapshot: Snapshot) -> Group:
+    """Return the tables showing a snapshot of the cluster"""
+    nodes = Table(title="Nodes", title_justify="left", expand=True)
+    nodes.add_column("Node")
+    nodes.add_column("Status", justify="center")
+    nodes.add_column("Roles")
+    nodes.add_column("Units")
+    for name, node in sorted(snapshot.nodes.items()):
+        units = snapshot.units.get(str(node.get("machineid")), [])
+        nodes.add_row(
+            name,
+            (
+                "[green]up[/green]"
+                if node.get("status") == "ONLINE"
+                else "[red]down[/red]"
+            ),
+            ", ".join(node.get("roles", [])),
+            "\n".join(
+                f"{unit} {_format_status(status)}" for unit, status in units
+            ),
+        )
+
+    haproxy = Table(title="HAProxy backends", title_justify="left")
+    haproxy.add_column("Node")
+    haproxy.add_column("Backend")
+    haproxy.add_column("Sessions", justify="right")
+    haproxy.add_column("Queue", justify="right")
+    haproxy.add_column("Max queue", justify="right")
+    for endpoint, backends in sorted(snapshot.haproxy.items()):
+        for backend, values in sorted(backends.items()):
+            queue = values.get("queue", 0)
+            haproxy.add_row(
+                urllib.parse.urlparse(endpoint).hostname or endpoint,
+                backend,
+                f"{values.get('sessions', 0):.0f}",
+                f"[red]{queue:.0f}[/red]" if queue else "0",
+                f"{values.get('max_queue', 0):.0f}",
+            )
+
+    postgresql = Table(title="PostgreSQL", title_justify="left")
+    postgresql.add_column("Unit")
+    postgresql.add_column("Role")
+    postgresql.add_column("Connections", justify="right")
+    postgresql.add_column("Replication lag", justify="right")
+    for unit, stats in sorted(snapshot.postgresql.items()):
+        connections = stats.get("connections", 0)
+        max_connections = stats.get("max_connections") or 0
+        usage = f"{connections}/{max_connections}"
+        if max_connections and connections >= 0.9 * max_connections:
+            usage = f"[red]{usage}[/red]"
+        postgresql.add_row(
+            unit,
+            "replica" if stats.get("in_recovery") else "primary",
+            usage,
+            (
+                _format_seconds(stats.get("replay_delay"))
+                if stats.get("in_recovery")
+                else "-"
+            ),
+        )
+
+    region = Table(
+        title=f"MAAS region CPU (every {REGION_CPU_INTERVAL}s)",
+        title_justify="left",
+    )
+    region.add_column("Unit")
+    region.add_column("CPU", justify="right")
+    region.add_column("Cores", justify="right")
+    for unit, (cpu, cores) in sorted(snapshot.region_cpu.items()):
+        region.add_row(unit, "-" if cpu is None else f"{cpu:.0f}%", str(cores))
+
+    return Group(
+        nodes,
+        haproxy,
+        postgresql,
+        region,
+        *(f"[yellow]{error}[/yellow]" for error in snapshot.errors),
+    )
+
+
+@click.command(
+    cls=FormatEpilogCommand,
+    epilog="""
+    \b
+    Watch the performance of the cluster, refreshed every 5 seconds.
+    maas-anvil top
+    \b
+    Refresh the view every 30 seconds.
+    maas-anvil top --interval 30
+    """,
+)
+@click.option(
+    "-i",
+    "--interval",
+    type=click.IntRange(min=1),
+    default=DEFAULT_INTERVAL,
+    show_default=True,
+    help="Seconds between two refreshes of the view.",
+)
+@click.pass_context
+def top(ctx: click.Context, interval: int) -> None:
+    """Shows a live view of the performance of the cluster.
+    Shows the units and their status per node, the sessions and queue of
+    every HAProxy backend, the PostgreSQL connections and replication delay
+    and the CPU usage of the MAAS region nodes, read at most once a minute.
+    Press Ctrl+C to exit.
+    """
+    deployment: LocalDeployment = ctx.obj
+    client = deployment.get_client()
+    run_preflight_checks(
+        [DaemonGroupCheck(), VerifyBootstrappedCheck(client)], console
+    )
+    jhelper = JujuHelper(deployment.get_connected_controller())
+    monitor = ClusterMonitor(client, jhelper, deployment.infrastructure_model)
+
+    with console.status("Collecting cluster performance data"):
+        snapshot = monitor.poll()
+    try:
+        with Live(render(snapshot), console=console, screen=True) as live:
+            while True:
+                time.sleep(interval)
+                live.update(render(monitor.poll()))
+    except KeyboardInterrupt:
+        pass
@@ -23,7 +23,6 @@ from sunbeam.jobs.common import (
     BaseStep,
     Result,
     ResultType,
-    run_plan,
 )
 from sunbeam.jobs.deployment import Deployment
 from sunbeam.jobs.juju import JujuHelper, run_sync
@@ -35,6 +34,7 @@ from anvil.commands.postgresql import postgresql_upgrade_steps
 from anvil.commands.upgrades.base import (
     UpgradePlugins,
 )
+from anvil.jobs.common import run_plan
 from anvil.jobs.manifest import Manifest
 
 LOG = logging.getLogger(__name__)
@@ -24,7 +24,6 @@ from sunbeam.jobs.common import (
     FORMAT_VALUE,
     FORMAT_YAML,
     ResultType,
-    run_plan,
     run_preflight_checks,
 )
 from sunbeam.jobs.juju import JujuHelper
@@ -32,6 +31,7 @@ import yaml
 
 from anvil.commands.maas_region import MAASCreateAdminStep, MAASGetAPIKeyStep
 from anvil.jobs.checks import VerifyBootstrappedCheck
+from anvil.jobs.common import run_plan
 from anvil.provider.local.deployment import LocalDeployment
 from anvil.utils import FormatEpilogCommand
 
@@ -26,6 +26,20 @@ DEFAULT_CONFIG = {
     "juju.cloud.name": "maas",
     "daemon.group": "snap_daemon",
     "daemon.debug": False,
+    "logs.max-size": 10,
+    "logs.rotate-hours": 24,
+    "logs.max-files": 10,
+    "logs.retention-days": 30,
+    "disk.max-fsync-latency": 10,
+    "disk.min-random-iops": 1000,
+    "disk.enforce": False,
+    # Empty to write to the metrics state directory of the user
+    "metrics.textfile-dir": "",
+    # Empty to only write the traces to the log directory
+    "tracing.otlp-endpoint": "",
+    # Empty to bind the throughput listener to the address of the default
+    # route
+    "network.listen-address": "",
 }
 
 OPTION_KEYS = set(k.split(".")[0] for k in DEFAULT_CONFIG.keys())
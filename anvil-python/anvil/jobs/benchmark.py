@@ -0,0 +1,193 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from dataclasses import dataclass
+import logging
+import mmap
+import os
+from pathlib import Path
+import random
+import statistics
+import time
+from typing import Any
+
+from snaphelpers import Snap, SnapCtlError
+
+from anvil.jobs.inventory import JUJU_STORAGE_DIR
+
+LOG = logging.getLogger(__name__)
+# PostgreSQL reads and writes pages of 8 KB
+BLOCK_SIZE = 8 * 1024
+FILE_SIZE = 64 * 1024 * 1024
+FSYNC_SAMPLES = 200
+PHASE_SECONDS = 2.0
+BENCHMARK_FILE = ".anvil-disk-benchmark"
+
+
+@dataclass
+class DiskThresholds:
+    """Limits of the disk benchmark, read from the 'disk' snap options.
+
+    The 99th percentile of the fsync latency must stay below
+    max_fsync_latency ms, random reads and writes of 8 KB pages above
+    min_random_iops. With enforce the check fails instead of warning.
+    """
+
+    max_fsync_latency: float = 10.0
+    min_random_iops: int = 1000
+    enforce: bool = False
+
+    @classmethod
+    def from_options(cls, options: dict[str, Any]) -> "DiskThresholds":
+        defaults = cls()
+        enforce = options.get("enforce", defaults.enforce)
+        return cls(
+            max_fsync_latency=float(
+                options.get("max-fsync-latency", defaults.max_fsync_latency)
+            ),
+            min_random_iops=int(
+                options.get("min-random-iops", defaults.min_random_iops)
+            ),
+            enforce=str(enforce).lower() == "true",
+        )
+
+
+def load_thresholds(snap: Snap) -> DiskThresholds:
+    """Read the thresholds, falling back to defaults for unset options."""
+    try:
+        options = snap.config.get_options("disk").as_dict().get("disk", {})
+    except (SnapCtlError, KeyError):
+        options = {}
+    return DiskThresholds.from_options(options)
+
+
+def get_benchmark_directory(snap: Snap, storage: bool | None = None) -> Path:
+    """Return a directory on the filesystem the PostgreSQL data lands on.
+
+    With Juju storage configured for PostgreSQL, the data lands on the
+    filesystem of JUJU_STORAGE_DIR, otherwise on the one of the snap common
+    directory. When it is not known whether storage is configured, e.g. on
+    a node that did not join yet, a disk mounted at JUJU_STORAGE_DIR is
+    taken to be meant for it.
+    """
+    if storage is None:
+        storage = os.path.ismount(JUJU_STORAGE_DIR)
+    if storage and JUJU_STORAGE_DIR.is_dir():
+        return JUJU_STORAGE_DIR
+    return Path(snap.paths.common)
+
+
+@dataclass
+class DiskBenchmark:
+    """fsync latencies in ms and IOPS of random 8 KB reads and writes."""
+
+    path: str
+    fsync_p50: float
+    fsync_p99: float
+    read_iops: float
+    write_iops: float
+    direct_io: bool
+
+    def violations(self, thresholds: DiskThresholds) -> list[str]:
+        """Return a message for every threshold the results do not meet."""
+        messages = []
+        if self.fsync_p99 > thresholds.max_fsync_latency:
+            messages.append(
+                f"fsync latency of {self.fsync_p99:.1f} ms exceeds "
+                f"{thresholds.max_fsync_latency} ms"
+            )
+        for name, iops in (
+            ("read", self.read_iops),
+            ("write", self.write_iops),
+        ):
+            if iops < thresholds.min_random_iops:
+                messages.append(
+                    f"random {name} rate of {iops:.0f} IOPS is below "
+                    f"{thresholds.min_random_iops} IOPS"
+                )
+        return messages
+
+
+def _open(path: Path) -> tuple[int, bool]:
+    """Open the file bypassing the page cache, where supported."""
+    flags = os.O_RDWR | os.O_CREAT
+    try:
+        return os.open(path, flags | os.O_DIRECT, 0o600), True
+    except OSError:
+        # tmpfs and some overlay filesystems do not support O_DIRECT
+        LOG.debug(f"O_DIRECT not supported for {path}")
+        return os.open(path, flags, 0o600), False
+
+
+def _measure_fsync(fd: int, buffer: mmap.mmap) -> list[float]:
+    """Append a page and wait for it to be durable, like a WAL commit."""
+    latencies = []
+    started = time.perf_counter()
+    for i in range(FSYNC_SAMPLES):
+        before = time.perf_counter()
+        os.pwritev(fd, [buffer], i * BLOCK_SIZE)
+        os.fdatasync(fd)
+        latencies.append((time.perf_counter() - before) * 1000)
+        if time.perf_counter() - started > PHASE_SECONDS:
+            break
+    return latencies
+
+
+def _measure_random(fd: int, buffer: mmap.mmap, write: bool) -> float:
+    """Return the IOPS of random page reads or writes."""
+    blocks = FILE_SIZE // BLOCK_SIZE
+    operations = 0
+    started = time.perf_counter()
+    while (elapsed := time.perf_counter() - started) < PHASE_SECONDS:
+        offset = random.randrange(blocks) * BLOCK_SIZE
+        if write:
+            os.pwritev(fd, [buffer], offset)
+        else:
+            os.preadv(fd, [buffer], offset)
+        operations += 1
+    if write:
+        os.fdatasync(fd)
+    return operations / elapsed
+
+
+def run_benchmark(directory: Path) -> DiskBenchmark:
+    """Benchmark the filesystem of a directory with a temporary file.
+
+    The file is filled first, so reads hit the disk and not sparse extents.
+    """
+    path = directory / BENCHMARK_FILE
+    fd, direct_io = _open(path)
+    # O_DIRECT needs page aligned buffers, which anonymous maps are
+    buffer = mmap.mmap(-1, BLOCK_SIZE)
+    buffer.write(b"\xa5" * BLOCK_SIZE)
+    try:
+        latencies = _measure_fsync(fd, buffer)
+        for offset in range(0, FILE_SIZE, BLOCK_SIZE * 128):
+            os.pwritev(fd, [buffer] * 128, offset)
+        os.fsync(fd)
+        read_iops = _measure_random(fd, buffer, write=False)
+        write_iops = _measure_random(fd, buffer, write=True)
+    finally:
+        os.close(fd)
+        buffer.close()
+        path.unlink(missing_ok=True)
+    return DiskBenchmark(
+        path=str(directory),
+        fsync_p50=statistics.median(latencies),
+        fsync_p99=sorted(latencies)[int(0.99 * (len(latencies) - 1))],
+        read_iops=read_iops,
+        write_iops=write_iops,
+        direct_io=direct_io,
+    )
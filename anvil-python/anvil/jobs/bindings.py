@@ -0,0 +1,145 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ipaddress
+import json
+import logging
+import re
+import subprocess
+from typing import Any
+
+from rich.status import Status
+from sunbeam.commands.juju import JujuStepHelper
+from sunbeam.jobs.common import BaseStep, Result, ResultType
+
+LOG = logging.getLogger(__name__)
+# Applications whose endpoints can be bound, by Terraform plan
+BINDINGS_TFPLANS = {
+    "maas-region-plan": "maas-region",
+    "maas-agent-plan": "maas-agent",
+    "haproxy-plan": "haproxy",
+    "postgresql-plan": "postgresql",
+}
+# Key binding all endpoints that are not listed
+DEFAULT_BINDING = "default"
+
+
+def _parse_cidr(value: str) -> ipaddress.IPv4Network | ipaddress.IPv6Network:
+    return ipaddress.ip_network(value, strict=False)
+
+
+def is_cidr(value: str) -> bool:
+    try:
+        _parse_cidr(value)
+    except ValueError:
+        return False
+    return "/" in value
+
+
+def get_space_name(target: str) -> str:
+    """Return the Juju space of a binding target, a space name or a CIDR.
+
+    A space is created for every CIDR, named after it, e.g. anvil-10-20-0-0-24
+    """
+    if not is_cidr(target):
+        return target
+    network = _parse_cidr(target)
+    name = f"anvil-{network.network_address}-{network.prefixlen}"
+    return re.sub(r"[.:-]+", "-", name)
+
+
+def get_bindings(deployment_config: dict[str, Any]) -> dict[str, Any]:
+    return dict(deployment_config.get("bindings") or {})
+
+
+def get_endpoint_bindings(
+    deployment_config: dict[str, Any], application: str
+) -> list[dict[str, str]]:
+    """Return the endpoint_bindings tfvar of an application.
+
+    :param deployment_config: deployment section of the manifest, its
+                              bindings section maps the endpoints of an
+                              application to a space or a CIDR
+    """
+    bindings = get_bindings(deployment_config).get(application) or {}
+    endpoint_bindings = []
+    for endpoint, target in bindings.items():
+        binding = {"space": get_space_name(str(target))}
+        if endpoint != DEFAULT_BINDING:
+            binding["endpoint"] = endpoint
+        endpoint_bindings.append(binding)
+    return endpoint_bindings
+
+
+class AddJujuSpacesStep(BaseStep, JujuStepHelper):
+    """Create the Juju spaces for the CIDRs used in the bindings."""
+
+    def __init__(self, deployment_config: dict[str, Any], model: str):
+        super().__init__("Add Juju spaces", "Adding Juju spaces")
+        self.model = model
+        self.cidrs = sorted(
+            {
+                str(target)
+                for bindings in get_bindings(deployment_config).values()
+                for target in (bindings or {}).values()
+                if is_cidr(str(target))
+            }
+        )
+        self.missing: list[str] = []
+
+    def _juju(self, *args: str) -> str:
+        cmd = [self._get_juju_binary(), *args]
+        LOG.debug(f"Running command {' '.join(cmd)}")
+        process = subprocess.run(
+            cmd, capture_output=True, text=True, check=True
+        )
+        return process.stdout
+
+    def is_skip(self, status: Status | None = None) -> Result:
+        if not self.cidrs:
+            return Result(ResultType.SKIPPED)
+        try:
+            output = json.loads(
+                self._juju("spaces", "-m", self.model, "--format", "json")
+            )
+        except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
+            LOG.debug(e, exc_info=True)
+            return Result(ResultType.FAILED, "Unable to list Juju spaces")
+        spaces = {space["name"] for space in output.get("spaces", [])}
+        self.missing = [
+            cidr for cidr in self.cidrs if get_space_name(cidr) not in spaces
+        ]
+        if not self.missing:
+            return Result(ResultType.SKIPPED)
+        return Result(ResultType.COMPLETED)
+
+    def run(self, status: Status | None = None) -> Result:
+        for cidr in self.missing:
+            try:
+                self._juju(
+                    "add-space",
+                    "-m",
+                    self.model,
+                    get_space_name(cidr),
+                    str(_parse_cidr(cidr)),
+                )
+            except subprocess.CalledProcessError as e:
+                LOG.warning(e.stderr)
+                return Result(
+                    ResultType.FAILED,
+                    f"Unable to add a Juju space for {cidr}, the subnet must "
+                    "be configured on a node and not be in another space",
+                )
+        return Result(ResultType.COMPLETED)
@@ -14,8 +14,10 @@
 # limitations under the License.
 
 import logging
+from pathlib import Path
 
 from sunbeam.jobs.checks import (
+    Check,
     DaemonGroupCheck as SunbeamDaemonGroupCheck,
     SystemRequirementsCheck as SunbeamSystemRequirementsCheck,
     VerifyBootstrappedCheck as SunbeamVerifyBootstrappedCheck,
@@ -25,7 +27,9 @@ from sunbeam.jobs.common import (
     get_host_total_ram,
 )
 
+from anvil.jobs.benchmark import DiskBenchmark, DiskThresholds, run_benchmark
 from anvil.jobs.common import RAM_4_GB_IN_KB
+from anvil.jobs.network import check_peer, get_join_addresses
 
 LOG = logging.getLogger(__name__)
 
@@ -61,3 +65,71 @@ class VerifyBootstrappedCheck(SunbeamVerifyBootstrappedCheck):
         if not ret:
             self.message: str = self.message.replace("sunbeam", "anvil")
         return ret
+
+
+class NetworkPerformanceCheck(Check):
+    """Check the RTT, jitter and throughput to the cluster members.
+
+    The members are the ones named in the join token. The throughput is
+    measured against the throughput-listener daemon of their snap.
+    """
+
+    def __init__(self, token: str):
+        super().__init__(
+            "Check network performance",
+            "Checking network performance to the cluster members",
+        )
+        self.token = token
+
+    def run(self) -> bool:
+        warnings = []
+        for address in get_join_addresses(self.token):
+            warnings.extend(check_peer(address).warnings)
+        if warnings:
+            self.message = "WARNING: " + "; ".join(warnings)
+            LOG.warning(self.message)
+
+        return True
+
+
+class DiskPerformanceCheck(Check):
+    """Benchmark the fsync latency and random I/O of a database node.
+
+    The benchmark runs in a directory on the filesystem that will hold the
+    PostgreSQL data. The results are kept to be recorded in clusterd.
+    """
+
+    def __init__(self, directory: Path, thresholds: DiskThresholds):
+        super().__init__(
+            "Check disk performance",
+            f"Benchmarking the disk of {directory} for the database",
+        )
+        self.directory = directory
+        self.thresholds = thresholds
+        self.result: DiskBenchmark | None = None
+
+    def run(self) -> bool:
+        try:
+            self.result = run_benchmark(self.directory)
+        except OSError as e:
+            LOG.debug("Disk benchmark failed", exc_info=True)
+            self.message = (
+                f"WARNING: Failed to benchmark the disk of {self.directory}: "
+                f"{e}"
+            )
+            LOG.warning(self.message)
+            return True
+        LOG.debug(f"Disk benchmark: {self.result}")
+
+        violations = self.result.violations(self.thresholds)
+        if violations:
+            self.message = (
+                f"Disk of {self.directory} is too slow for the database: "
+                + "; ".join(violations)
+            )
+            if self.thresholds.enforce:
+                return False
+            self.message = f"WARNING: {self.message}"
+            LOG.warning(self.message)
+
+        return True
@@ -14,9 +14,13 @@
 # limitations under the License.
 
 import enum
-from typing import Any
+from typing import Any, Iterable
 
 import click
+from rich.console import Console
+from sunbeam.jobs.common import BaseStep, run_plan as sunbeam_run_plan
+
+from anvil.jobs import metrics, tracing
 
 RAM_4_GB_IN_KB = 4 * 1000 * 1000
 
@@ -78,3 +82,17 @@ def validate_roles(
         return [Role[role.upper()] for role in value]
     except KeyError as e:
         raise click.BadParameter(str(e))
+
+
+def run_plan(plan: Iterable[BaseStep], console: Console) -> dict[str, Any]:
+    """Run the steps of the plan, recording their metrics and spans.
+
+    :param plan: the steps to run
+    :param console: the console to report the progress on
+    :return: the results of the steps by step class name
+    """
+    steps = [
+        tracing.trace_step(metrics.instrument_step(step)) for step in plan
+    ]
+    with tracing.span("plan", "plan", steps=len(steps)):
+        return sunbeam_run_plan(steps, console)  # type: ignore[no-any-return]
@@ -0,0 +1,174 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from pathlib import Path
+import platform
+import re
+from typing import Any
+
+from sunbeam.jobs.common import get_host_total_cores, get_host_total_ram
+
+from anvil.utils import get_architecture
+
+SYS_PATH = Path("/sys")
+SECTOR_SIZE = 512
+# Block devices which are not backed by a disk
+VIRTUAL_BLOCK_DEVICES = re.compile(r"^(loop|ram|zram|dm-|md|sr|nbd)")
+# Directory the rootfs and loop storage of the manual cloud are created in
+JUJU_STORAGE_DIR = Path("/var/lib/juju/storage")
+
+
+def _read(path: Path) -> str | None:
+    """Return the stripped content of a sysfs file, None if unreadable"""
+    try:
+        return path.read_text().strip()
+    except OSError:
+        # Some attributes, like the speed of a link that is down, fail to read
+        return None
+
+
+def _read_int(path: Path) -> int | None:
+    value = _read(path)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def get_numa_nodes(sys_path: Path = SYS_PATH) -> list[dict[str, Any]]:
+    """Return the CPUs and memory in KB of every NUMA node"""
+    nodes = []
+    node_dir = sys_path / "devices" / "system" / "node"
+    for node in sorted(node_dir.glob("node[0-9]*")):
+        meminfo = _read(node / "meminfo") or ""
+        memory = re.search(r"MemTotal:\s+(\d+) kB", meminfo)
+        nodes.append(
+            {
+                "node": int(node.name.removeprefix("node")),
+                "cpus": _read(node / "cpulist"),
+                "memory": int(memory.group(1)) if memory else None,
+            }
+        )
+    return nodes
+
+
+def _get_disk_type(name: str, block: Path) -> str:
+    if name.startswith("nvme"):
+        return "nvme"
+    if _read(block / "queue" / "rotational") == "1":
+        return "hdd"
+    return "ssd"
+
+
+def get_disks(sys_path: Path = SYS_PATH) -> list[dict[str, Any]]:
+    """Return the type, size in bytes and model of every disk"""
+    disks = []
+    for block in sorted((sys_path / "block").glob("*")):
+        if VIRTUAL_BLOCK_DEVICES.match(block.name):
+            continue
+        sectors = _read_int(block / "size")
+        disks.append(
+            {
+                "name": block.name,
+                "type": _get_disk_type(block.name, block),
+                "size": sectors * SECTOR_SIZE if sectors else None,
+                "model": _read(block / "device" / "model"),
+            }
+        )
+    return disks
+
+
+def _get_backing_disk(block: Path) -> str | None:
+    """Return the disk a partition, device mapper or md device is on"""
+    while (
+        VIRTUAL_BLOCK_DEVICES.match(block.name)
+        or (block / "partition").exists()
+    ):
+        if (block / "partition").exists():
+            block = block.parent
+            continue
+        slaves = sorted((block / "slaves").glob("*"))
+        if not slaves:
+            return None
+        block = slaves[0].resolve()
+    return block.name
+
+
+def get_filesystem(
+    path: Path, sys_path: Path = SYS_PATH
+) -> dict[str, Any] | None:
+    """Return the disk, its type and the size and free bytes of the
+    filesystem a path is on, or would be on once created.
+    """
+    while not path.exists():
+        if path == path.parent:
+            return None
+        path = path.parent
+    stat = os.statvfs(path)
+    device = os.stat(path).st_dev
+    block = (
+        sys_path / "dev" / "block" / f"{os.major(device)}:{os.minor(device)}"
+    )
+    disk = _get_backing_disk(block.resolve()) if block.exists() else None
+    return {
+        "path": str(path),
+        "disk": disk,
+        "type": _get_disk_type(disk, sys_path / "block" / disk)
+        if disk
+        else None,
+        "size": stat.f_blocks * stat.f_frsize,
+        "free": stat.f_bavail * stat.f_frsize,
+    }
+
+
+def get_nics(sys_path: Path = SYS_PATH) -> list[dict[str, Any]]:
+    """Return the speed in Mbit/s, MTU and state of every physical NIC"""
+    nics = []
+    for nic in sorted((sys_path / "class" / "net").glob("*")):
+        # Bridges, bonds, VLANs and other software devices have no device
+        if not (nic / "device").exists():
+            continue
+        speed = _read_int(nic / "speed")
+        nics.append(
+            {
+                "name": nic.name,
+                "mac": _read(nic / "address"),
+                "speed": speed if speed and speed > 0 else None,
+                "mtu": _read_int(nic / "mtu"),
+                "state": _read(nic / "operstate"),
+            }
+        )
+    return nics
+
+
+def collect_inventory(sys_path: Path = SYS_PATH) -> dict[str, Any]:
+    """Return the hardware inventory of the local node.
+
+    Memory is in KB, disk and filesystem sizes in bytes and NIC speeds in
+    Mbit/s. Values that cannot be read, e.g. when the hardware-observe
+    interface of the snap is not connected, are left out or None.
+    juju_storage is the filesystem Juju storage of the node lands on.
+    """
+    return {
+        "architecture": get_architecture(),
+        "machine": platform.machine(),
+        "cores": get_host_total_cores(),
+        "memory": get_host_total_ram(),
+        "numa": get_numa_nodes(sys_path),
+        "disks": get_disks(sys_path),
+        "juju_storage": get_filesystem(JUJU_STORAGE_DIR, sys_path),
+        "nics": get_nics(sys_path),
+    }
@@ -17,6 +17,7 @@ import copy
 from dataclasses import InitVar, asdict
 import logging
 from pathlib import Path
+import random
 import shutil
 from typing import Any, Dict, List
 
@@ -48,7 +49,10 @@ from sunbeam.jobs.manifest import (
 )
 import yaml
 
+from anvil.jobs.bindings import BINDINGS_TFPLANS, get_endpoint_bindings
+from anvil.jobs.metrics import instrument_terraform
 from anvil.jobs.plugin import PluginManager
+from anvil.jobs.tracing import trace_terraform
 from anvil.utils import get_architecture
 from anvil.versions import (
     MANIFEST_ATTRIBUTES_TFVAR_MAP,
@@ -301,12 +305,15 @@ class Manifest:
         shutil.copytree(src, dst, dirs_exist_ok=True)
         env = {}
         if self.deployment.juju_controller and self.deployment.juju_account:
+            # The provider prefers the first address, so shuffle them to
+            # spread the load over the controllers when HA is enabled
+            endpoints = self.deployment.juju_controller.api_endpoints
             env.update(
                 dict(
                     JUJU_USERNAME=self.deployment.juju_account.user,
                     JUJU_PASSWORD=self.deployment.juju_account.password,
                     JUJU_CONTROLLER_ADDRESSES=",".join(
-                        self.deployment.juju_controller.api_endpoints
+                        random.sample(endpoints, len(endpoints))
                     ),
                     JUJU_CA_CERT=self.deployment.juju_controller.ca_cert,
                 )
@@ -319,6 +326,8 @@ class Manifest:
             env=env,
             clusterd_address=self.deployment.get_clusterd_http_address(),
         )
+        instrument_terraform(self.tf_helpers[tfplan], tfplan)
+        trace_terraform(self.tf_helpers[tfplan], tfplan)
 
         return self.tf_helpers[tfplan]
 
@@ -437,6 +446,12 @@ class Manifest:
                     if charm_attribute_:
                         tfvars[tfvar_name] = charm_attribute_
 
+        # handle tfvars for the bindings section of the deployment
+        if tfplan in BINDINGS_TFPLANS and not charms:
+            tfvars["endpoint_bindings"] = get_endpoint_bindings(
+                self.deployment_config, BINDINGS_TFPLANS[tfplan]
+            )
+
         return tfvars
 
     def _get_tfvar_names(
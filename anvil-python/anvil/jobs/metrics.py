@@ -0,0 +1,421 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import contextlib
+import fcntl
+import functools
+import inspect
+import json
+import logging
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import Any, Callable, Iterator, TypeVar
+
+from snaphelpers import Snap, SnapCtlError
+from sunbeam.commands.terraform import TerraformHelper
+from sunbeam.jobs.common import BaseStep, Result, ResultType
+
+LOG = logging.getLogger(__name__)
+FORMAT_PROMETHEUS = "prometheus"
+FORMAT_OPENMETRICS = "openmetrics"
+METRICS_FORMATS = [FORMAT_PROMETHEUS, FORMAT_OPENMETRICS]
+STATE_FILE = "anvil-metrics.json"
+TEXTFILE = "anvil.prom"
+# Buckets in seconds, from quick steps to joins of large clusters
+DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+TERRAFORM_OPERATIONS = ("init", "apply", "destroy")
+
+LabelKey = tuple[tuple[str, str], ...]
+MetricT = TypeVar("MetricT", "Counter", "Histogram")
+
+
+def _label_key(labels: dict[str, str]) -> LabelKey:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: LabelKey, **extra: str) -> str:
+    labels = [*key, *extra.items()]
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+        + "}"
+    )
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic counter, persisted across invocations."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: dict[LabelKey, float] = {}
+
+    def new(self) -> "Counter":
+        return Counter(self.name, self.documentation)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def merge(self, state: list[Any]) -> None:
+        for labels, value in state:
+            self.inc(value, **labels)
+
+    def dump(self) -> list[Any]:
+        return [[dict(key), value] for key, value in self.values.items()]
+
+    def family_name(self, openmetrics: bool) -> str:
+        # OpenMetrics drops the _total suffix from the counter family name
+        return self.name if openmetrics else f"{self.name}_total"
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self.values.items()):
+            yield (
+                f"{self.name}_total{_format_labels(key)} "
+                f"{_format_value(value)}"
+            )
+
+
+class Histogram:
+    """Histogram with fixed buckets, persisted across invocations."""
+
+    type = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, buckets: tuple[float, ...]
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # Per label set: observations per bucket, and their sum
+        self.values: dict[LabelKey, tuple[list[int], float]] = {}
+
+    def new(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, self.buckets)
+
+    def _get(self, key: LabelKey) -> tuple[list[int], float]:
+        return self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _label_key(labels)
+        counts, total = self._get(key)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.values[key] = (counts, total + value)
+
+    def merge(self, state: list[Any]) -> None:
+        for labels, counts, total in state:
+            key = _label_key(labels)
+            current, current_total = self._get(key)
+            if len(counts) != len(current):
+                LOG.debug(f"Ignoring {self.name} recorded with other buckets")
+                continue
+            self.values[key] = (
+                [a + b for a, b in zip(current, counts)],
+                current_total + total,
+            )
+
+    def dump(self) -> list[Any]:
+        return [
+            [dict(key), counts, total]
+            for key, (counts, total) in self.values.items()
+        ]
+
+    def family_name(self, openmetrics: bool) -> str:
+        return self.name
+
+    def samples(self) -> Iterator[str]:
+        bounds = [*map(_format_value, self.buckets), "+Inf"]
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket{_format_labels(key, le=bound)} "
+                    f"{cumulative}"
+                )
+            yield (
+                f"{self.name}_sum{_format_labels(key)} {_format_value(total)}"
+            )
+            yield f"{self.name}_count{_format_labels(key)} {cumulative}"
+
+
+class Registry:
+    """Metrics of anvil operations.
+
+    An invocation only holds the observations it made itself, they are added
+    to the totals of the earlier invocations on the node when flushed.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: dict[str, Counter | Histogram] = {}
+
+    def register(self, metric: MetricT) -> MetricT:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def new(self) -> "Registry":
+        """Return a registry of the same metrics without observations"""
+        registry = Registry()
+        for metric in self.metrics.values():
+            registry.register(metric.new())
+        return registry
+
+    def merge(self, state: dict[str, list[Any]]) -> None:
+        for name, values in state.items():
+            if name in self.metrics:
+                self.metrics[name].merge(values)
+
+    def dump(self) -> dict[str, list[Any]]:
+        return {
+            name: metric.dump()
+            for name, metric in self.metrics.items()
+            if metric.values
+        }
+
+    def clear(self) -> None:
+        for metric in self.metrics.values():
+            metric.values.clear()
+
+    def render(self, format: str = FORMAT_PROMETHEUS) -> str:
+        """Render the metrics in the Prometheus or OpenMetrics text format"""
+        openmetrics = format == FORMAT_OPENMETRICS
+        lines = []
+        for metric in self.metrics.values():
+            if not metric.values:
+                continue
+            family = metric.family_name(openmetrics)
+            lines.append(f"# HELP {family} {metric.documentation}")
+            lines.append(f"# TYPE {family} {metric.type}")
+            lines.extend(metric.samples())
+        if openmetrics:
+            lines.append("# EOF")
+        return "".join(f"{line}\n" for line in lines)
+
+
+REGISTRY = Registry()
+COMMAND_DURATION = REGISTRY.register(
+    Histogram(
+        "anvil_command_duration_seconds",
+        "Duration of maas-anvil commands",
+        DURATION_BUCKETS,
+    )
+)
+COMMAND_FAILURES = REGISTRY.register(
+    Counter("anvil_command_failures", "Failed maas-anvil commands")
+)
+STEP_DURATION = REGISTRY.register(
+    Histogram(
+        "anvil_step_duration_seconds",
+        "Duration of the steps run by maas-anvil commands",
+        DURATION_BUCKETS,
+    )
+)
+STEP_FAILURES = REGISTRY.register(
+    Counter("anvil_step_failures", "Failed steps of maas-anvil commands")
+)
+TERRAFORM_DURATION = REGISTRY.register(
+    Histogram(
+        "anvil_terraform_duration_seconds",
+        "Duration of Terraform operations per plan",
+        DURATION_BUCKETS,
+    )
+)
+JUJU_WAIT_DURATION = REGISTRY.register(
+    Histogram(
+        "anvil_juju_wait_duration_seconds",
+        "Time spent waiting for Juju applications and units",
+        DURATION_BUCKETS,
+    )
+)
+CLUSTERD_LATENCY = REGISTRY.register(
+    Histogram(
+        "anvil_clusterd_request_duration_seconds",
+        "Latency of clusterd calls",
+        LATENCY_BUCKETS,
+    )
+)
+
+
+@contextlib.contextmanager
+def timer(histogram: Histogram, **labels: str) -> Iterator[None]:
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        histogram.observe(time.monotonic() - start, **labels)
+
+
+def _timed(
+    func: Callable[..., Any], histogram: Histogram, **labels: str
+) -> Any:
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            with timer(histogram, **labels):
+                return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with timer(histogram, **labels):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _instrument_methods(
+    obj: Any,
+    histogram: Histogram,
+    select: Callable[[str], bool],
+    label: str = "call",
+) -> None:
+    """Time the selected methods of an object, once per object"""
+    if obj is None or getattr(obj, "_anvil_instrumented", False):
+        return
+    for name in dir(type(obj)):
+        method = getattr(obj, name, None)
+        if select(name) and callable(method):
+            setattr(obj, name, _timed(method, histogram, **{label: name}))
+    obj._anvil_instrumented = True
+
+
+def instrument_terraform(tfhelper: TerraformHelper, plan: str) -> None:
+    """Time the init, apply and destroy operations of a Terraform plan"""
+    for operation in TERRAFORM_OPERATIONS:
+        setattr(
+            tfhelper,
+            operation,
+            _timed(
+                getattr(tfhelper, operation),
+                TERRAFORM_DURATION,
+                plan=plan,
+                operation=operation,
+            ),
+        )
+
+
+def instrument_step(step: BaseStep) -> BaseStep:
+    """Record the duration and failures of a step.
+
+    The Juju waits and clusterd calls the step makes through its 'jhelper'
+    and 'client' attributes are timed as well.
+    """
+    name = type(step).__name__
+    run = step.run
+
+    def timed_run(*args: Any, **kwargs: Any) -> Result:
+        try:
+            with timer(STEP_DURATION, step=name):
+                result = run(*args, **kwargs)
+        except Exception:
+            STEP_FAILURES.inc(step=name)
+            raise
+        if result.result_type == ResultType.FAILED:
+            STEP_FAILURES.inc(step=name)
+        return result
+
+    step.run = timed_run  # type: ignore[method-assign]
+    _instrument_methods(
+        getattr(step, "jhelper", None),
+        JUJU_WAIT_DURATION,
+        lambda method: method.startswith("wait_"),
+    )
+    client = getattr(step, "client", None)
+    _instrument_methods(
+        getattr(client, "cluster", None),
+        CLUSTERD_LATENCY,
+        lambda method: not method.startswith("_"),
+    )
+    return step
+
+
+def get_state_dir(snap: Snap) -> Path:
+    return snap.paths.user_common / "metrics"
+
+
+def get_textfile_dir(snap: Snap) -> Path:
+    """Return the node-exporter textfile collector directory to write to"""
+    try:
+        options = snap.config.get_options("metrics").as_dict()
+        textfile_dir = options.get("metrics", {}).get("textfile-dir")
+    except (SnapCtlError, KeyError):
+        textfile_dir = None
+    return Path(textfile_dir) if textfile_dir else get_state_dir(snap)
+
+
+def _write_atomic(path: Path, content: str) -> None:
+    """Replace the file so readers never see a partial file"""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def _read_state(path: Path) -> dict[str, list[Any]]:
+    try:
+        return dict(json.loads(path.read_text()))
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        LOG.warning(f"Discarding corrupt metrics state {path}")
+        return {}
+
+
+def load(state_dir: Path) -> Registry:
+    """Return the totals of all invocations flushed so far"""
+    registry = REGISTRY.new()
+    registry.merge(_read_state(state_dir / STATE_FILE))
+    return registry
+
+
+def flush(state_dir: Path, textfile_dir: Path) -> None:
+    """Add the metrics of this invocation to the totals and export them.
+
+    The totals are kept in a state file in state_dir and written to the
+    node-exporter textfile collector directory textfile_dir.
+    """
+    state_dir.mkdir(parents=True, exist_ok=True)
+    textfile_dir.mkdir(parents=True, exist_ok=True)
+    state_file = state_dir / STATE_FILE
+    # Concurrent invocations must not lose each other's observations
+    with open(state_dir / f".{STATE_FILE}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        REGISTRY.merge(_read_state(state_file))
+        _write_atomic(state_file, json.dumps(REGISTRY.dump()))
+        _write_atomic(textfile_dir / TEXTFILE, REGISTRY.render())
+    REGISTRY.clear()
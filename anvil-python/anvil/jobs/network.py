@@ -0,0 +1,232 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import binascii
+from dataclasses import dataclass, field
+import itertools
+import json
+import logging
+import socket
+import socketserver
+import statistics
+import struct
+import time
+
+from snaphelpers import Snap, SnapCtlError
+from sunbeam import utils
+
+LOG = logging.getLogger(__name__)
+# Port of the clusterd daemon, used to measure the RTT of cluster members
+CLUSTERD_PORT = 7000
+# Port of the throughput listener, which the throughput-listener daemon of
+# the snap runs on the management address of every node
+THROUGHPUT_PORT = 7410
+LATENCY_SAMPLES = 20
+CONNECT_TIMEOUT = 2.0
+THROUGHPUT_SECONDS = 3.0
+CHUNK_SIZE = 128 * 1024
+# Idle connections are dropped, so they do not keep a listener thread
+LISTENER_TIMEOUT = 10.0
+# dqlite and synchronous replication wait for a round trip on every commit
+MAX_RTT_MS = 5.0
+# Variations beyond this trigger raft elections and replication lag spikes
+MAX_JITTER_MS = 2.0
+# Boot images of about 1.5 GB are synced between region nodes and to agents
+MIN_THROUGHPUT_MBPS = 1000.0
+
+
+@dataclass
+class NetworkResult:
+    """RTT and jitter in ms and throughput in Mbit/s to a peer."""
+
+    peer: str
+    rtt: float | None = None
+    jitter: float | None = None
+    lost: int = 0
+    throughput: float | None = None
+    warnings: list[str] = field(default_factory=list)
+
+
+def parse_address(address: str, default_port: int) -> tuple[str, int]:
+    """Split 'host[:port]', with IPv6 hosts in brackets."""
+    if address.startswith("["):
+        host, _, port = address[1:].partition("]")
+        return host, int(port[1:]) if port.startswith(":") else default_port
+    if address.count(":") == 1:
+        host, _, port = address.partition(":")
+        return host, int(port)
+    return address, default_port
+
+
+def get_join_addresses(token: str) -> list[str]:
+    """Return the addresses of the cluster members a join token names."""
+    try:
+        decoded = json.loads(base64.b64decode(token))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        LOG.debug("Failed to decode join token", exc_info=True)
+        return []
+    return list(decoded.get("join_addresses") or [])
+
+
+def measure_latency(
+    host: str, port: int, samples: int = LATENCY_SAMPLES
+) -> tuple[float | None, float | None, int]:
+    """Measure the RTT with TCP handshakes, as ICMP needs raw sockets.
+
+    :return: median RTT and jitter in ms, the mean difference between
+             consecutive samples as in RFC 3550, and the failed samples
+    """
+    rtts = []
+    lost = 0
+    for _ in range(samples):
+        started = time.perf_counter()
+        try:
+            with socket.create_connection((host, port), CONNECT_TIMEOUT):
+                rtts.append((time.perf_counter() - started) * 1000)
+        except OSError:
+            lost += 1
+            if not rtts and lost >= 3:
+                break
+    if not rtts:
+        return None, None, lost
+    jitter = (
+        statistics.fmean(abs(b - a) for a, b in itertools.pairwise(rtts))
+        if len(rtts) > 1
+        else 0.0
+    )
+    return statistics.median(rtts), jitter, lost
+
+
+def measure_throughput(
+    host: str, port: int, duration: float = THROUGHPUT_SECONDS
+) -> float | None:
+    """Send data to a throughput listener for a while.
+
+    :return: Mbit/s the listener received, None if no listener answers
+    """
+    chunk = b"\0" * CHUNK_SIZE
+    try:
+        with socket.create_connection((host, port), CONNECT_TIMEOUT) as sock:
+            started = time.perf_counter()
+            while time.perf_counter() - started < duration:
+                sock.sendall(chunk)
+            sock.shutdown(socket.SHUT_WR)
+            # The listener answers with the bytes it received
+            received = struct.unpack("!Q", sock.recv(8))[0]
+            elapsed = time.perf_counter() - started
+    except (OSError, struct.error):
+        LOG.debug(f"No throughput listener at {host}:{port}", exc_info=True)
+        return None
+    return received * 8 / elapsed / 1_000_000
+
+
+class ThroughputHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        self.request.settimeout(LISTENER_TIMEOUT)
+        received = 0
+        try:
+            while data := self.request.recv(CHUNK_SIZE):
+                received += len(data)
+        except OSError:
+            LOG.debug(f"Dropped idle connection from {self.client_address}")
+            return
+        try:
+            self.request.sendall(struct.pack("!Q", received))
+        except OSError:
+            # Latency samples close the connection right away
+            return
+        LOG.debug(f"Received {received} bytes from {self.client_address}")
+
+
+class ThroughputServer(socketserver.ThreadingTCPServer):
+    """Receive the data of measure_throughput and report how much arrived."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+    # The latency samples open connections in quick succession
+    request_queue_size = 128
+
+    def __init__(self, host: str, port: int = THROUGHPUT_PORT):
+        if ":" in host:
+            self.address_family = socket.AF_INET6
+        super().__init__((host, port), ThroughputHandler)
+
+
+def check_peer(
+    address: str, throughput_port: int = THROUGHPUT_PORT
+) -> NetworkResult:
+    """Measure the network to a peer and compare it with the thresholds.
+
+    The RTT is measured against the given address, clusterd by default, the
+    throughput against a listener on the same host.
+    """
+    host, port = parse_address(address, CLUSTERD_PORT)
+    result = NetworkResult(address)
+    result.rtt, result.jitter, result.lost = measure_latency(host, port)
+    if result.rtt is None:
+        result.warnings.append(f"{address} is not reachable")
+        return result
+    result.throughput = measure_throughput(host, throughput_port)
+
+    if result.rtt > MAX_RTT_MS:
+        result.warnings.append(
+            f"RTT to {address} of {result.rtt:.1f} ms exceeds {MAX_RTT_MS} ms,"
+            " slowing down dqlite and PostgreSQL commits"
+        )
+    if result.jitter is not None and result.jitter > MAX_JITTER_MS:
+        result.warnings.append(
+            f"Jitter to {address} of {result.jitter:.1f} ms exceeds "
+            f"{MAX_JITTER_MS} ms, delaying PostgreSQL replication"
+        )
+    if result.lost:
+        result.warnings.append(
+            f"{result.lost} of {LATENCY_SAMPLES} connections to {address} "
+            "failed"
+        )
+    if (
+        result.throughput is not None
+        and result.throughput < MIN_THROUGHPUT_MBPS
+    ):
+        result.warnings.append(
+            f"Throughput to {address} of {result.throughput:.0f} Mbit/s is "
+            f"below {MIN_THROUGHPUT_MBPS:.0f} Mbit/s, slowing down image sync"
+        )
+    return result
+
+
+def load_listen_address(snap: Snap) -> str | None:
+    """Return the address set in the 'network' snap options"""
+    try:
+        options = snap.config.get_options("network").as_dict()
+    except (SnapCtlError, KeyError):
+        return None
+    return options.get("network", {}).get("listen-address") or None
+
+
+def main() -> None:
+    """Run a throughput listener until the process is stopped.
+
+    The listener binds to the address of the default route, which clusterd
+    is bootstrapped on, unless the 'network.listen-address' snap option
+    names another one. It never listens on all interfaces.
+    """
+    logging.basicConfig(level=logging.INFO)
+    host = load_listen_address(Snap()) or utils.get_local_ip_by_default_route()
+    with ThroughputServer(host) as server:
+        LOG.info(
+            f"Receiving throughput measurements on {host}:{THROUGHPUT_PORT}"
+        )
+        server.serve_forever()
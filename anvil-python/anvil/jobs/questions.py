@@ -14,7 +14,10 @@
 # limitations under the License.
 
 
+from typing import Any
+
 from sunbeam.jobs.questions import QuestionBank
+import yaml
 
 
 def show_questions(
@@ -49,3 +52,9 @@ def show_questions(
         lines.append(f'{outer_indent}{comment}{indent}{key}: "{default}"')
 
     return lines
+
+
+def show_mapping(values: dict[str, Any], key: str) -> list[str]:
+    """Return a mapping of a preseed section as list."""
+    content = yaml.safe_dump({key: values}, sort_keys=False)
+    return [f"{' ' * 4}{line}" for line in content.splitlines()]
@@ -13,18 +13,233 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from dataclasses import asdict
+import json
 import logging
+import shlex
 import subprocess
+import threading
+import time
+from typing import List
 
 from rich.status import Status
+from sunbeam.clusterd.client import Client
+from sunbeam.clusterd.service import ConfigItemNotFoundException
 from sunbeam.commands.juju import JujuStepHelper
-from sunbeam.jobs.common import Result, ResultType
+from sunbeam.jobs.common import (
+    BaseStep,
+    Result,
+    ResultType,
+    read_config,
+    update_config,
+)
 from sunbeam.jobs.juju import CONTROLLER_MODEL
 from sunbeam.jobs.steps import (
     RemoveMachineUnitStep as SunbeamRemoveMachineUnitStep,
 )
 
+from anvil.jobs.benchmark import DiskBenchmark
+from anvil.jobs.inventory import collect_inventory
+from anvil.jobs.manifest import Manifest
+from anvil.utils import parse_storage_size
+
 LOG = logging.getLogger(__name__)
+HOST_RESOURCES_CONFIG_KEY = "HostResources"
+JOIN_LOCK_CONFIG_KEY = "JoinLock"
+# The holder refreshes the lock while it joins, a lock not refreshed for
+# longer than the expiry was left behind by a join that did not finish
+JOIN_LOCK_EXPIRY = 900
+JOIN_LOCK_REFRESH_INTERVAL = 60
+JOIN_LOCK_POLL_INTERVAL = 30
+# Time given to concurrent joins taking the lock to overwrite each other
+JOIN_LOCK_SETTLE_TIME = 5
+# Boot resources of the MAAS snap, image storage of the region and the boot
+# images an agent serves to the machines it deploys
+BOOT_RESOURCES_DIRS = {
+    "maas-region": "/var/snap/maas/common/maas/image-storage",
+    "maas-agent": "/var/snap/maas/common/maas/boot-resources",
+}
+BOOT_RESOURCES_SCRIPT = """
+set -e
+source={source}
+target={target}
+mountpoint -q "$target" && exit 0
+mkdir -p "$source" "$target"
+free=$(df --output=avail -m "$source" | tail -1)
+if [ "$free" -lt {size} ]; then
+    echo "$source has ${{free}}M free, {size}M are needed" >&2
+    exit 1
+fi
+trap 'snap start maas' EXIT
+snap stop maas
+cp -a "$target/." "$source/"
+mount --bind "$source" "$target"
+grep -qs " $target " /etc/fstab || echo "$source $target none bind 0 0" >> /etc/fstab
+"""
+# Time a unit may take to copy its boot resources, which can be many GB
+BOOT_RESOURCES_TIMEOUT = "1h"
+
+
+def get_role_host_resources(client: Client, role: str) -> tuple[int, int]:
+    """Return the RAM in KB and cores of the smallest node with a role.
+
+    :return: (0, 0) if no resources were recorded for nodes with the role
+    """
+    try:
+        hosts = read_config(client, HOST_RESOURCES_CONFIG_KEY)
+    except ConfigItemNotFoundException:
+        return 0, 0
+    nodes = {node["name"] for node in client.cluster.list_nodes_by_role(role)}
+    resources = [host for name, host in hosts.items() if name in nodes]
+    if not resources:
+        return 0, 0
+    return (
+        min(host["memory"] for host in resources),
+        min(host["cores"] for host in resources),
+    )
+
+
+def get_host_inventories(client: Client) -> dict[str, dict]:
+    """Return the hardware inventory recorded for every node, by name."""
+    try:
+        return dict(read_config(client, HOST_RESOURCES_CONFIG_KEY))
+    except ConfigItemNotFoundException:
+        return {}
+
+
+class RecordHostResourcesStep(BaseStep):
+    """Record the hardware inventory of the local node in clusterd.
+
+    The inventory is recorded when a node bootstraps or joins the cluster,
+    so sizing decisions can be made without reaching the node. Database
+    nodes also record the results of their disk benchmark.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        fqdn: str,
+        disk_benchmark: DiskBenchmark | None = None,
+    ):
+        super().__init__(
+            "Record node resources",
+            "Recording node resources",
+        )
+        self.client = client
+        self.fqdn = fqdn
+        self.disk_benchmark = disk_benchmark
+
+    def run(self, status: Status | None = None) -> Result:
+        try:
+            hosts = read_config(self.client, HOST_RESOURCES_CONFIG_KEY)
+        except ConfigItemNotFoundException:
+            hosts = {}
+        hosts[self.fqdn] = collect_inventory()
+        if self.disk_benchmark:
+            hosts[self.fqdn]["disk_benchmark"] = asdict(self.disk_benchmark)
+        LOG.debug(f"Node {self.fqdn} inventory: {hosts[self.fqdn]}")
+        update_config(self.client, HOST_RESOURCES_CONFIG_KEY, hosts)
+        return Result(ResultType.COMPLETED)
+
+
+def _read_join_lock(client: Client) -> dict:
+    try:
+        return dict(read_config(client, JOIN_LOCK_CONFIG_KEY))
+    except ConfigItemNotFoundException:
+        return {}
+
+
+class JoinLock:
+    """Lock in clusterd serializing the joins of nodes.
+
+    Joins update the Terraform variables and host resources kept in
+    clusterd, so nodes joining at the same time, e.g. when deployed with
+    the same cloud-init user data, would overwrite each other's changes.
+    clusterd has no compare-and-swap, so the lock is taken by writing it and
+    reading it back once concurrent writers have settled. While it is held,
+    a thread refreshes it, so that it only expires when the join died.
+    """
+
+    def __init__(self, client: Client, fqdn: str):
+        self.client = client
+        self.fqdn = fqdn
+        self._stop = threading.Event()
+        self._refresher: threading.Thread | None = None
+
+    def _write(self) -> None:
+        lock = {"name": self.fqdn, "time": time.time()}
+        update_config(self.client, JOIN_LOCK_CONFIG_KEY, lock)
+
+    def _is_held(self) -> bool:
+        return _read_join_lock(self.client).get("name") == self.fqdn
+
+    def _refresh(self) -> None:
+        while not self._stop.wait(JOIN_LOCK_REFRESH_INTERVAL):
+            try:
+                if self._is_held():
+                    self._write()
+            except Exception:
+                # The next refresh is well within the expiry
+                LOG.debug("Failed to refresh the join lock", exc_info=True)
+
+    def acquire(self, status: Status | None = None) -> None:
+        """Wait until no other node holds the lock and take it."""
+        while True:
+            lock = _read_join_lock(self.client)
+            holder = lock.get("name")
+            if (
+                holder
+                and holder != self.fqdn
+                and time.time() - lock.get("time", 0) < JOIN_LOCK_EXPIRY
+            ):
+                if status:
+                    status.update(f"Waiting for {holder} to finish joining")
+                time.sleep(JOIN_LOCK_POLL_INTERVAL)
+                continue
+            self._write()
+            time.sleep(JOIN_LOCK_SETTLE_TIME)
+            if self._is_held():
+                break
+        LOG.debug(f"Node {self.fqdn} took the join lock")
+        self._stop.clear()
+        self._refresher = threading.Thread(target=self._refresh, daemon=True)
+        self._refresher.start()
+
+    def release(self) -> None:
+        """Stop refreshing the lock and release it if it is held."""
+        self._stop.set()
+        if self._refresher:
+            self._refresher.join()
+            self._refresher = None
+        if self._is_held():
+            update_config(self.client, JOIN_LOCK_CONFIG_KEY, {})
+
+
+class AcquireJoinLockStep(BaseStep):
+    """Wait until no other node is joining and take the join lock."""
+
+    def __init__(self, lock: JoinLock):
+        super().__init__(
+            "Acquire join lock",
+            "Waiting for other nodes to finish joining",
+        )
+        self.lock = lock
+
+    def run(self, status: Status | None = None) -> Result:
+        self.lock.acquire(status)
+        return Result(ResultType.COMPLETED)
+
+
+class ReleaseJoinLockStep(BaseStep):
+    """Release the join lock if the local node holds it."""
+
+    def __init__(self, lock: JoinLock):
+        super().__init__("Release join lock", "Releasing join lock")
+        self.lock = lock
+
+    def run(self, status: Status | None = None) -> Result:
+        self.lock.release()
+        return Result(ResultType.COMPLETED)
 
 
 class RemoveMachineUnitStep(SunbeamRemoveMachineUnitStep, JujuStepHelper):
@@ -65,3 +280,112 @@ class RemoveMachineUnitStep(SunbeamRemoveMachineUnitStep, JujuStepHelper):
             return Result(ResultType.FAILED, str(e))
 
         return Result(ResultType.COMPLETED)
+
+
+class ConfigureBootResourcesStorageStep(BaseStep, JujuStepHelper):
+    """Bind mount a directory over the boot resources of the MAAS units.
+
+    The directory is taken from the boot_resources section of the
+    application in the manifest, e.g. a mount point of a dedicated disk.
+    The existing boot resources are copied over once, units where the
+    directory is already mounted are left untouched. With a size, units
+    where the directory has less space free fail instead.
+
+    MAAS is stopped on a unit while its boot resources are copied, so the
+    units are configured one at a time.
+    """
+
+    def __init__(self, manifest: Manifest, application: str, model: str):
+        super().__init__(
+            "Configure boot resources storage",
+            "Configuring boot resources storage",
+        )
+        self.application = application
+        self.model = model
+        section = manifest.deployment_config.get(application) or {}
+        boot_resources = section.get("boot_resources") or {}
+        self.path = boot_resources.get("path")
+        self.size = boot_resources.get("size")
+
+    def is_skip(self, status: Status | None = None) -> Result:
+        if not self.path:
+            return Result(ResultType.SKIPPED)
+        # The path ends up in /etc/fstab, which separates fields by spaces
+        if not self.path.startswith("/") or any(
+            char.isspace() for char in self.path
+        ):
+            return Result(
+                ResultType.FAILED,
+                f"Boot resources path {self.path!r} must be absolute and "
+                "without spaces",
+            )
+        if self.size:
+            try:
+                parse_storage_size(self.size)
+            except ValueError as e:
+                return Result(ResultType.FAILED, f"Boot resources: {e}")
+        return Result(ResultType.COMPLETED)
+
+    def _get_units(self) -> List[str]:
+        cmd = [
+            self._get_juju_binary(),
+            "status",
+            "-m",
+            self.model,
+            "--format",
+            "json",
+            self.application,
+        ]
+        LOG.debug(f"Running command {' '.join(cmd)}")
+        process = subprocess.run(
+            cmd, capture_output=True, text=True, check=True
+        )
+        applications = json.loads(process.stdout).get("applications", {})
+        units = applications.get(self.application, {}).get("units", {})
+        return sorted(units)
+
+    def _configure_unit(self, unit: str, script: str) -> dict:
+        cmd = [
+            self._get_juju_binary(),
+            "exec",
+            "-m",
+            self.model,
+            "--format",
+            "json",
+            "--wait",
+            BOOT_RESOURCES_TIMEOUT,
+            "--unit",
+            unit,
+            "--",
+            "bash",
+            "-c",
+            script,
+        ]
+        LOG.debug(f"Running command {' '.join(cmd[:-1])} <script>")
+        process = subprocess.run(
+            cmd, capture_output=True, text=True, check=True
+        )
+        result = json.loads(process.stdout).get(unit, {})
+        return result.get("results", result)
+
+    def run(self, status: Status | None = None) -> Result:
+        script = BOOT_RESOURCES_SCRIPT.format(
+            source=shlex.quote(str(self.path)),
+            target=BOOT_RESOURCES_DIRS[self.application],
+            size=parse_storage_size(self.size) if self.size else 0,
+        )
+        try:
+            for unit in self._get_units():
+                if status:
+                    status.update(f"Configuring boot resources of {unit}")
+                result = self._configure_unit(unit, script)
+                if result.get("return-code", 0) != 0:
+                    LOG.warning(result.get("stderr", ""))
+                    return Result(
+                        ResultType.FAILED,
+                        f"Failed to mount {self.path} on {unit}",
+                    )
+        except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
+            LOG.exception("Error configuring boot resources storage")
+            return Result(ResultType.FAILED, str(e))
+        return Result(ResultType.COMPLETED)
@@ -0,0 +1,293 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import contextvars
+from dataclasses import dataclass, field
+import functools
+import inspect
+import json
+import logging
+import os
+from pathlib import Path
+import secrets
+import threading
+import time
+from typing import Any, Callable, Iterator
+import urllib.request
+
+from snaphelpers import Snap, SnapCtlError
+from sunbeam.commands.terraform import TerraformHelper
+from sunbeam.jobs.common import BaseStep, Result, ResultType
+
+from anvil.jobs.metrics import TERRAFORM_OPERATIONS
+
+LOG = logging.getLogger(__name__)
+SERVICE_NAME = "maas-anvil"
+STEP_METHODS = ("is_skip", "prompt", "run")
+OTLP_TIMEOUT = 5
+# OTLP span status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar(
+    "anvil_current_span", default=None
+)
+
+
+@dataclass
+class Span:
+    name: str
+    category: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start: int
+    end: int = 0
+    thread: int = 0
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+
+
+class Tracer:
+    """Spans of the current invocation.
+
+    A span is recorded per command, plan, step method and external call, so
+    an invocation can be viewed as a timeline.
+    """
+
+    def __init__(self) -> None:
+        self.trace_id = secrets.token_hex(16)
+        self.spans: list[Span] = []
+
+    @contextlib.contextmanager
+    def span(
+        self, name: str, category: str, **attributes: Any
+    ) -> Iterator[Span]:
+        parent = _current_span.get()
+        span = Span(
+            name=name,
+            category=category,
+            trace_id=self.trace_id,
+            span_id=secrets.token_hex(8),
+            parent_id=parent.span_id if parent else None,
+            start=time.time_ns(),
+            thread=threading.get_native_id(),
+            attributes=attributes,
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                span.error = f"Exited with {e.code}"
+            raise
+        except Exception as e:
+            span.error = str(e) or type(e).__name__
+            raise
+        finally:
+            span.end = time.time_ns()
+            _current_span.reset(token)
+            self.spans.append(span)
+
+    def to_chrome_trace(self) -> dict[str, Any]:
+        """Return the spans in the Chrome trace event format"""
+        pid = os.getpid()
+        return {
+            "displayTimeUnit": "ms",
+            "traceEvents": [
+                {
+                    "name": span.name,
+                    "cat": span.category,
+                    "ph": "X",
+                    "ts": span.start / 1000,
+                    "dur": (span.end - span.start) / 1000,
+                    "pid": pid,
+                    "tid": span.thread,
+                    "args": {
+                        **span.attributes,
+                        **({"error": span.error} if span.error else {}),
+                    },
+                }
+                for span in sorted(self.spans, key=lambda span: span.start)
+            ],
+        }
+
+    def to_otlp(self) -> dict[str, Any]:
+        """Return the spans in the OTLP/JSON trace format"""
+
+        def attributes(values: dict[str, Any]) -> list[dict[str, Any]]:
+            return [
+                {"key": key, "value": {"stringValue": str(value)}}
+                for key, value in values.items()
+            ]
+
+        spans = []
+        for span in self.spans:
+            otlp_span = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,  # internal
+                "startTimeUnixNano": str(span.start),
+                "endTimeUnixNano": str(span.end),
+                "attributes": attributes(
+                    {"anvil.category": span.category, **span.attributes}
+                ),
+                "status": (
+                    {"code": STATUS_ERROR, "message": span.error}
+                    if span.error
+                    else {"code": STATUS_OK}
+                ),
+            }
+            if span.parent_id:
+                otlp_span["parentSpanId"] = span.parent_id
+            spans.append(otlp_span)
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": attributes(
+                            {"service.name": SERVICE_NAME}
+                        )
+                    },
+                    "scopeSpans": [
+                        {"scope": {"name": __name__}, "spans": spans}
+                    ],
+                }
+            ]
+        }
+
+    def write_chrome_trace(self, path: Path) -> None:
+        with path.open("w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def export_otlp(self, endpoint: str) -> None:
+        """Send the spans to an OTLP/HTTP collector"""
+        request = urllib.request.Request(
+            f"{endpoint.rstrip('/')}/v1/traces",
+            data=json.dumps(self.to_otlp()).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=OTLP_TIMEOUT):
+            pass
+
+
+TRACER = Tracer()
+span = TRACER.span
+
+
+def _set_status(span: Span, result: Any) -> None:
+    if isinstance(result, Result) and result.result_type == ResultType.FAILED:
+        span.error = result.message or "Failed"
+
+
+def traced(
+    func: Callable[..., Any], name: str, category: str, **attributes: Any
+) -> Any:
+    """Record a span for every call of the function"""
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name, category, **attributes):
+                return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with span(name, category, **attributes) as current:
+            result = func(*args, **kwargs)
+            _set_status(current, result)
+            return result
+
+    return wrapper
+
+
+def _trace_methods(
+    obj: Any, category: str, select: Callable[[Any], bool]
+) -> None:
+    """Trace the public methods of an object, once per object"""
+    if obj is None or getattr(obj, "_anvil_traced", False):
+        return
+    for name in dir(type(obj)):
+        method = getattr(obj, name, None)
+        if not name.startswith("_") and callable(method) and select(method):
+            setattr(obj, name, traced(method, f"{category} {name}", category))
+    obj._anvil_traced = True
+
+
+def trace_step(step: BaseStep) -> BaseStep:
+    """Record spans for the is_skip, prompt and run methods of a step.
+
+    The Juju RPCs and clusterd calls the step makes through its 'jhelper'
+    and 'client' attributes get their own spans.
+    """
+    name = type(step).__name__
+    for method in STEP_METHODS:
+        if hasattr(step, method):
+            setattr(
+                step,
+                method,
+                traced(getattr(step, method), f"{name}.{method}", "step"),
+            )
+    _trace_methods(
+        getattr(step, "jhelper", None), "juju", inspect.iscoroutinefunction
+    )
+    _trace_methods(
+        getattr(getattr(step, "client", None), "cluster", None),
+        "clusterd",
+        lambda _: True,
+    )
+    return step
+
+
+def trace_terraform(tfhelper: TerraformHelper, plan: str) -> None:
+    """Record spans for the init, apply and destroy runs of a plan"""
+    for operation in TERRAFORM_OPERATIONS:
+        setattr(
+            tfhelper,
+            operation,
+            traced(
+                getattr(tfhelper, operation),
+                f"terraform {operation} {plan}",
+                "terraform",
+                plan=plan,
+            ),
+        )
+
+
+def load_otlp_endpoint(snap: Snap) -> str | None:
+    """Return the OTLP/HTTP collector set in the 'tracing' snap options"""
+    try:
+        options = snap.config.get_options("tracing").as_dict()
+    except (SnapCtlError, KeyError):
+        return None
+    return options.get("tracing", {}).get("otlp-endpoint") or None
+
+
+def export(trace_file: Path, otlp_endpoint: str | None) -> None:
+    """Write the Chrome trace and send the spans to the OTLP collector"""
+    try:
+        TRACER.write_chrome_trace(trace_file)
+    except OSError as e:
+        LOG.debug(f"Failed to write trace to {trace_file}: {e}")
+    if otlp_endpoint:
+        try:
+            TRACER.export_otlp(otlp_endpoint)
+        except OSError as e:
+            LOG.debug(f"Failed to export trace to {otlp_endpoint}: {e}")
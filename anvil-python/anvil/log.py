@@ -0,0 +1,190 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from dataclasses import dataclass
+import datetime
+import gzip
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+from pathlib import Path
+import shutil
+import time
+from typing import Any
+
+from snaphelpers import Snap, SnapCtlError
+from sunbeam import log
+
+LOG = logging.getLogger(__name__)
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+ASCTIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+ASCTIME_LENGTH = 19
+
+
+@dataclass
+class LogConfig:
+    """Rotation and retention settings, read from the 'logs' snap options.
+
+    The log file is rotated once it exceeds max_size MiB or holds records
+    older than rotate_hours. At most max_files rotated and failed invocation
+    logs are kept, none of them older than retention_days.
+    """
+
+    max_size: int = 10
+    rotate_hours: int = 24
+    max_files: int = 10
+    retention_days: int = 30
+
+    @classmethod
+    def from_options(cls, options: dict[str, Any]) -> "LogConfig":
+        values = {}
+        for field, default in vars(cls()).items():
+            option = field.replace("_", "-")
+            try:
+                values[field] = int(options.get(option, default))
+            except (TypeError, ValueError):
+                LOG.warning(
+                    f"Invalid value {options[option]!r} for logs.{option}, "
+                    f"using {default}"
+                )
+                values[field] = default
+        return cls(**values)
+
+
+def load_config(snap: Snap) -> LogConfig:
+    """Read the log settings, falling back to defaults for unset options."""
+    try:
+        options = snap.config.get_options("logs").as_dict().get("logs", {})
+    except (SnapCtlError, KeyError):
+        options = {}
+    return LogConfig.from_options(options)
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+class CompressedRotatingFileHandler(RotatingFileHandler):
+    """Rotate the log file on size or age and gzip the rotated files."""
+
+    def __init__(self, filename: Path, config: LogConfig):
+        super().__init__(
+            filename,
+            maxBytes=config.max_size * 1024 * 1024,
+            backupCount=config.max_files,
+            delay=True,
+        )
+        self.rotate_seconds = config.rotate_hours * 3600
+        self.namer = lambda name: f"{name}.gz"
+        self.rotator = _gzip_rotator
+        self.started_at = self._read_start_time()
+
+    def _read_start_time(self) -> float | None:
+        """Return the time of the first record in the current log file."""
+        try:
+            with open(self.baseFilename) as f:
+                first_line = f.read(ASCTIME_LENGTH)
+            started = datetime.datetime.strptime(first_line, ASCTIME_FORMAT)
+        except (OSError, ValueError):
+            return None
+        return started.timestamp()
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.started_at is None:
+            self.started_at = record.created
+        elif (
+            self.rotate_seconds
+            and record.created - self.started_at >= self.rotate_seconds
+        ):
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self.started_at = None
+
+
+class InvocationLog:
+    """Debug log of a single invocation, only kept when it fails."""
+
+    def __init__(self, logs_dir: Path, prefix: str):
+        self.path = log.prepare_logfile(logs_dir, prefix)
+        self.handler = logging.FileHandler(self.path, delay=True)
+        self.handler.setLevel(logging.DEBUG)
+        self.handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    def close(self, keep: bool) -> None:
+        if keep:
+            LOG.warning(f"Debug log of this run written to {self.path}")
+        logging.getLogger().removeHandler(self.handler)
+        self.handler.close()
+        if not keep:
+            self.path.unlink(missing_ok=True)
+
+
+def _prune_logs(logs_dir: Path, prefix: str, config: LogConfig) -> None:
+    """Remove invocation logs and traces beyond the configured retention."""
+    cutoff = time.time() - config.retention_days * 86400
+    # Failed invocation logs and the traces of invocations
+    for pattern in (f"{prefix}-*.log", f"{prefix}-*.trace.json"):
+        files = sorted(
+            logs_dir.glob(pattern),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True,
+        )
+        for index, path in enumerate(files):
+            if index >= config.max_files or path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+    for path in logs_dir.glob(f"{prefix}.log.*.gz"):
+        if path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
+
+
+def setup_root_logging(
+    logs_dir: Path, prefix: str, config: LogConfig
+) -> InvocationLog:
+    """Log to a rotated file and to a per invocation debug file.
+
+    The rotated log file '<prefix>.log' keeps INFO records of every
+    invocation. The debug records of the current invocation are written to
+    their own file, which is discarded when the invocation succeeds.
+
+    :param logs_dir: directory the log files are written to
+    :param prefix: prefix of the log file names
+    :param config: rotation and retention settings
+    :return: the debug log of the current invocation
+    """
+    logs_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        _prune_logs(logs_dir, prefix, config)
+    except OSError as e:
+        # Concurrent invocations may prune the same files
+        LOG.debug(f"Failed to prune logs: {e}")
+
+    log.setup_root_logging()
+    logger = logging.getLogger()
+
+    rotating_handler = CompressedRotatingFileHandler(
+        logs_dir / f"{prefix}.log", config
+    )
+    rotating_handler.setLevel(logging.INFO)
+    rotating_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(rotating_handler)
+
+    invocation_log = InvocationLog(logs_dir, prefix)
+    logger.addHandler(invocation_log.handler)
+    return invocation_log
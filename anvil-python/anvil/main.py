@@ -13,25 +13,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import logging
+import sys
+import time
 
 import click
 from snaphelpers import Snap
-from sunbeam import log
 from sunbeam.commands import (
     configure as configure_cmds,
 )
 
+from anvil import log
 from anvil.commands import (
+    capacity as capacity_cmds,
+    check as check_cmds,
     inspect as inspect_cmds,
     manifest as manifest_commands,
+    metrics as metrics_cmds,
     prepare_node as prepare_node_cmds,
     refresh as refresh_cmds,
+    top as top_cmds,
 )
 from anvil.commands.utils import create_admin, get_api_key, juju_login
+from anvil.jobs import metrics, tracing
+from anvil.jobs.plugin import PluginManager
 from anvil.provider.local.commands import LocalProvider
 from anvil.provider.local.deployment import LocalDeployment
 from anvil.utils import CatchGroup, FormatCommandGroupsGroup
 
+LOG = logging.getLogger(__name__)
+
 # Update the help options to allow -h in addition to --help for
 # triggering the help for various commands
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
@@ -71,12 +82,63 @@ def manifest(ctx: click.Context) -> None:
     """
 
 
+@click.group("check", context_settings=CONTEXT_SETTINGS, cls=CatchGroup)
+@click.pass_context
+def check(ctx: click.Context) -> None:
+    """Checks the performance of the node."""
+
+
+@click.group("enable", context_settings=CONTEXT_SETTINGS, cls=CatchGroup)
+@click.pass_context
+def enable(ctx: click.Context) -> None:
+    """Enables plugins."""
+
+
+@click.group("disable", context_settings=CONTEXT_SETTINGS, cls=CatchGroup)
+@click.pass_context
+def disable(ctx: click.Context) -> None:
+    """Disables plugins."""
+
+
+def _get_command_name(group: click.Group, args: list[str]) -> str:
+    """Return the name of the (sub)command the arguments invoke"""
+    names = []
+    command: click.Command = group
+    for arg in args:
+        if arg.startswith("-"):
+            continue
+        if not isinstance(command, click.Group) or arg not in command.commands:
+            break
+        command = command.commands[arg]
+        names.append(arg)
+    return " ".join(names)
+
+
+def _record_command(
+    snap: Snap, command: str, duration: float, failed: bool
+) -> None:
+    if command:
+        metrics.COMMAND_DURATION.observe(duration, command=command)
+        if failed:
+            metrics.COMMAND_FAILURES.inc(command=command)
+    try:
+        metrics.flush(
+            metrics.get_state_dir(snap), metrics.get_textfile_dir(snap)
+        )
+    except OSError as e:
+        LOG.debug(f"Failed to write metrics: {e}")
+
+
 def main() -> None:
     snap = Snap()
-    logfile = log.prepare_logfile(snap.paths.user_common / "logs", "anvil")
-    log.setup_root_logging(logfile)
+    invocation_log = log.setup_root_logging(
+        snap.paths.user_common / "logs", "anvil", log.load_config(snap)
+    )
     cli.add_command(prepare_node_cmds.prepare_node_script)
+    cli.add_command(capacity_cmds.plan_capacity)
     cli.add_command(inspect_cmds.inspect)
+    cli.add_command(metrics_cmds.metrics)
+    cli.add_command(top_cmds.top)
     cli.add_command(refresh_cmds.refresh)
 
     # Cluster management
@@ -90,12 +152,37 @@ def main() -> None:
     manifest.add_command(manifest_commands.show)
     manifest.add_command(manifest_commands.generate)
 
+    # Performance checks
+    cli.add_command(check)
+    check.add_command(check_cmds.network)
+
     # Miscellania
     cli.add_command(juju_login)
     cli.add_command(create_admin)
     cli.add_command(get_api_key)
 
-    cli(obj=deployment)
+    # Plugins, registered after all groups and commands are registered
+    cli.add_command(enable)
+    cli.add_command(disable)
+    PluginManager.register(deployment, cli)
+
+    command = _get_command_name(cli, sys.argv[1:])
+    started = time.monotonic()
+    failed = True
+    try:
+        with tracing.span(f"maas-anvil {command}".strip(), "command"):
+            cli(obj=deployment)
+    except SystemExit as e:
+        failed = e.code not in (None, 0)
+        raise
+    finally:
+        _record_command(snap, command, time.monotonic() - started, failed)
+        if command:
+            tracing.export(
+                invocation_log.path.with_suffix(".trace.json"),
+                tracing.load_otlp_endpoint(snap),
+            )
+        invocation_log.close(keep=failed)
 
 
 if __name__ == "__main__":
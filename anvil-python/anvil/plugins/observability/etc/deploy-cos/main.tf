@@ -0,0 +1,128 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+terraform {
+
+  required_providers {
+    juju = {
+      source  = "juju/juju"
+      version = "= 0.15.1"
+    }
+  }
+
+}
+
+provider "juju" {}
+
+data "juju_model" "machine_model" {
+  name = var.machine_model
+}
+
+# Grafana Agent is a subordinate charm, a unit is co-located with every unit
+# of the applications it is integrated with.
+resource "juju_application" "grafana-agent" {
+  name  = "grafana-agent"
+  model = data.juju_model.machine_model.name
+  units = 0 # subordinate charm
+
+  charm {
+    name     = "grafana-agent"
+    channel  = var.charm_grafana_agent_channel
+    revision = var.charm_grafana_agent_revision
+    base     = "ubuntu@24.04"
+  }
+
+  config = var.charm_grafana_agent_config
+}
+
+# Charms supporting cos-agent hand their metrics, logs and dashboards over to
+# Grafana Agent.
+resource "juju_integration" "grafana-agent-cos-agent" {
+  for_each = toset(var.cos_agent_applications)
+
+  model = data.juju_model.machine_model.name
+
+  application {
+    name     = juju_application.grafana-agent.name
+    endpoint = "cos-agent"
+  }
+
+  application {
+    name     = each.value
+    endpoint = "cos-agent"
+  }
+}
+
+# Other charms only get the metrics and logs of their machines collected.
+resource "juju_integration" "grafana-agent-juju-info" {
+  for_each = toset(var.juju_info_applications)
+
+  model = data.juju_model.machine_model.name
+
+  application {
+    name     = juju_application.grafana-agent.name
+    endpoint = "juju-info"
+  }
+
+  application {
+    name     = each.value
+    endpoint = "juju-info"
+  }
+}
+
+resource "juju_integration" "grafana-agent-prometheus" {
+  count = var.prometheus_offer_url != null ? 1 : 0
+
+  model = data.juju_model.machine_model.name
+
+  application {
+    name     = juju_application.grafana-agent.name
+    endpoint = "send-remote-write"
+  }
+
+  application {
+    offer_url = var.prometheus_offer_url
+  }
+}
+
+resource "juju_integration" "grafana-agent-loki" {
+  count = var.loki_offer_url != null ? 1 : 0
+
+  model = data.juju_model.machine_model.name
+
+  application {
+    name     = juju_application.grafana-agent.name
+    endpoint = "logging-consumer"
+  }
+
+  application {
+    offer_url = var.loki_offer_url
+  }
+}
+
+resource "juju_integration" "grafana-agent-grafana" {
+  count = var.grafana_dashboard_offer_url != null ? 1 : 0
+
+  model = data.juju_model.machine_model.name
+
+  application {
+    name     = juju_application.grafana-agent.name
+    endpoint = "grafana-dashboards-provider"
+  }
+
+  application {
+    offer_url = var.grafana_dashboard_offer_url
+  }
+}
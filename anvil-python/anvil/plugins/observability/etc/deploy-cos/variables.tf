@@ -0,0 +1,67 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+variable "charm_grafana_agent_channel" {
+  description = "Operator channel for Grafana Agent deployment"
+  type        = string
+  default     = "latest/stable"
+}
+
+variable "charm_grafana_agent_revision" {
+  description = "Operator channel revision for Grafana Agent deployment"
+  type        = number
+  default     = null
+}
+
+variable "charm_grafana_agent_config" {
+  description = "Operator config for Grafana Agent deployment"
+  type        = map(string)
+  default     = {}
+}
+
+variable "machine_model" {
+  description = "Model to deploy to"
+  type        = string
+}
+
+variable "cos_agent_applications" {
+  description = "Applications integrated with Grafana Agent over cos-agent"
+  type        = list(string)
+  default     = []
+}
+
+variable "juju_info_applications" {
+  description = "Applications integrated with Grafana Agent over juju-info"
+  type        = list(string)
+  default     = []
+}
+
+variable "prometheus_offer_url" {
+  description = "Offer URL of the COS Prometheus remote write endpoint"
+  type        = string
+  default     = null
+}
+
+variable "loki_offer_url" {
+  description = "Offer URL of the COS Loki logging endpoint"
+  type        = string
+  default     = null
+}
+
+variable "grafana_dashboard_offer_url" {
+  description = "Offer URL of the COS Grafana dashboards endpoint"
+  type        = string
+  default     = null
+}
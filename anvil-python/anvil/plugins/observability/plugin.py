@@ -0,0 +1,250 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from pathlib import Path
+import shutil
+from typing import Any
+
+import click
+from packaging.version import Version
+from rich.console import Console
+from rich.status import Status
+from sunbeam.clusterd.client import Client
+from sunbeam.clusterd.service import ConfigItemNotFoundException
+from sunbeam.commands.terraform import TerraformException, TerraformInitStep
+from sunbeam.jobs.common import (
+    BaseStep,
+    Result,
+    ResultType,
+    read_config,
+)
+from sunbeam.jobs.deployment import Deployment
+from sunbeam.plugins.interface.v1.base import EnableDisablePlugin
+
+from anvil.commands.haproxy import HAPROXY_METRICS_CONFIG_KEY
+from anvil.jobs.common import run_plan
+from anvil.jobs.manifest import Manifest
+
+LOG = logging.getLogger(__name__)
+console = Console()
+
+GRAFANA_AGENT_CHANNEL = "latest/stable"
+OBSERVABILITY_CONFIG_KEY = "TerraformVarsObservabilityPlan"
+DASHBOARDS_DIR = Path(__file__).parent / "etc" / "dashboards"
+COS_OFFERS = (
+    "prometheus_offer_url",
+    "loki_offer_url",
+    "grafana_dashboard_offer_url",
+)
+# Applications observed through Grafana Agent, per node role
+COS_AGENT_APPLICATIONS = {
+    "database": "postgresql",
+    "region": "maas-region",
+    "agent": "maas-agent",
+}
+JUJU_INFO_APPLICATIONS = {"haproxy": "haproxy"}
+
+
+def get_cos_offers(preseed: dict[str, Any]) -> dict[str, str | None]:
+    """Return the COS offer URLs of the 'observability' manifest section"""
+    observability = preseed.get("observability") or {}
+    return {offer: observability.get(offer) or None for offer in COS_OFFERS}
+
+
+def get_deployed_applications(
+    client: Client, applications: dict[str, str]
+) -> list[str]:
+    """Return the applications of the roles at least one node has"""
+    return [
+        application
+        for role, application in applications.items()
+        if client.cluster.list_nodes_by_role(role)
+    ]
+
+
+class DeployGrafanaAgentStep(BaseStep):
+    """Deploy Grafana Agent and integrate it with COS using Terraform."""
+
+    def __init__(self, client: Client, manifest: Manifest, model: str):
+        super().__init__("Deploy Grafana Agent", "Deploying Grafana Agent")
+        self.client = client
+        self.manifest = manifest
+        self.model = model
+
+    def extra_tfvars(self) -> dict[str, Any]:
+        return {
+            "machine_model": self.model,
+            "cos_agent_applications": get_deployed_applications(
+                self.client, COS_AGENT_APPLICATIONS
+            ),
+            "juju_info_applications": get_deployed_applications(
+                self.client, JUJU_INFO_APPLICATIONS
+            ),
+            **get_cos_offers(self.manifest.deployment_config),
+        }
+
+    def run(self, status: Status | None = None) -> Result:
+        try:
+            self.manifest.update_tfvars_and_apply_tf(
+                self.client,
+                tfplan=ObservabilityPlugin.tfplan,
+                tfvar_config=OBSERVABILITY_CONFIG_KEY,
+                override_tfvars=self.extra_tfvars(),
+            )
+        except TerraformException as e:
+            LOG.exception("Error deploying Grafana Agent")
+            return Result(ResultType.FAILED, str(e))
+        return Result(ResultType.COMPLETED)
+
+
+class RemoveGrafanaAgentStep(BaseStep):
+    """Remove Grafana Agent and its integrations using Terraform."""
+
+    def __init__(self, manifest: Manifest):
+        super().__init__("Remove Grafana Agent", "Removing Grafana Agent")
+        self.manifest = manifest
+
+    def run(self, status: Status | None = None) -> Result:
+        try:
+            self.manifest.get_tfhelper(ObservabilityPlugin.tfplan).destroy()
+        except TerraformException as e:
+            LOG.exception("Error removing Grafana Agent")
+            return Result(ResultType.FAILED, str(e))
+        return Result(ResultType.COMPLETED)
+
+
+class ObservabilityPlugin(EnableDisablePlugin):
+    version = Version("0.0.1")
+    tfplan = "cos-plan"
+
+    def __init__(self, deployment: Deployment) -> None:
+        super().__init__("observability", deployment)
+
+    def manifest_defaults(self) -> dict[str, Any]:
+        return {
+            "charms": {"grafana-agent": {"channel": GRAFANA_AGENT_CHANNEL}},
+            "terraform": {
+                self.tfplan: {
+                    "source": Path(__file__).parent / "etc" / "deploy-cos"
+                }
+            },
+        }
+
+    def manifest_attributes_tfvar_map(self) -> dict[str, Any]:
+        return {
+            self.tfplan: {
+                "charms": {
+                    "grafana-agent": {
+                        "channel": "charm_grafana_agent_channel",
+                        "revision": "charm_grafana_agent_revision",
+                        "config": "charm_grafana_agent_config",
+                    }
+                }
+            }
+        }
+
+    def run_enable_plans(self) -> None:
+        manifest = Manifest.load_latest_from_clusterdb(
+            self.deployment, include_defaults=True
+        )
+        if not any(get_cos_offers(manifest.deployment_config).values()):
+            raise click.ClickException(
+                "No COS offer URLs in the 'observability' section of the "
+                "manifest, apply a manifest with at least one of "
+                f"{', '.join(COS_OFFERS)} using 'maas-anvil refresh'"
+            )
+        plan = [
+            TerraformInitStep(manifest.get_tfhelper(self.tfplan)),
+            DeployGrafanaAgentStep(
+                self.deployment.get_client(),
+                manifest,
+                self.deployment.infrastructure_model,
+            ),
+        ]
+        run_plan(plan, console)
+        click.echo("Observability enabled.")
+
+    def post_enable(self) -> None:
+        # The haproxy charm does not support cos-agent, so Grafana Agent
+        # cannot scrape the HAProxy metrics.
+        try:
+            endpoints = read_config(
+                self.deployment.get_client(), HAPROXY_METRICS_CONFIG_KEY
+            ).get("endpoints", [])
+        except ConfigItemNotFoundException:
+            endpoints = []
+        if endpoints:
+            click.echo(
+                "Add the HAProxy metrics endpoints to the scrape targets of "
+                f"the COS Prometheus: {', '.join(endpoints)}"
+            )
+
+    def run_disable_plans(self) -> None:
+        manifest = Manifest.load_latest_from_clusterdb(
+            self.deployment, include_defaults=True
+        )
+        plan = [
+            TerraformInitStep(manifest.get_tfhelper(self.tfplan)),
+            RemoveGrafanaAgentStep(manifest),
+        ]
+        run_plan(plan, console)
+        click.echo("Observability disabled.")
+
+    @click.command()
+    def enable_plugin(self) -> None:
+        """Enable Observability."""
+        super().enable_plugin()
+
+    @click.command()
+    def disable_plugin(self) -> None:
+        """Disable Observability."""
+        super().disable_plugin()
+
+    @click.group()
+    def observability_group(self) -> None:
+        """Manages the observability of the MAAS Anvil cluster."""
+
+    @click.command()
+    @click.option(
+        "--output",
+        "-o",
+        type=click.Path(file_okay=False, path_type=Path),
+        default=Path.cwd,
+        help="Directory to write the dashboards to.",
+    )
+    def dashboards(self, output: Path) -> None:
+        """Writes the Grafana dashboards of MAAS Anvil to a directory."""
+        output.mkdir(parents=True, exist_ok=True)
+        for dashboard in sorted(DASHBOARDS_DIR.glob("*.json")):
+            shutil.copy(dashboard, output)
+            click.echo(output / dashboard.name)
+
+    def commands(self) -> dict[str, list[dict[str, Any]]]:
+        commands: dict[str, list[dict[str, Any]]] = super().commands()
+        commands.update(
+            {
+                "init": [
+                    {
+                        "name": "observability",
+                        "command": self.observability_group,
+                    }
+                ],
+                "init.observability": [
+                    {"name": "dashboards", "command": self.dashboards},
+                ],
+            }
+        )
+        return commands
@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import logging
+import os
 from pathlib import Path
 from typing import List
 
@@ -26,7 +27,6 @@ from sunbeam.commands.bootstrap_state import SetBootstrapped
 from sunbeam.commands.clusterd import (
     ClusterAddJujuUserStep,
     ClusterAddNodeStep,
-    ClusterUpdateJujuControllerStep,
     ClusterUpdateNodeStep,
 )
 from sunbeam.commands.juju import (
@@ -52,9 +52,9 @@ from sunbeam.jobs.common import (
     FORMAT_TABLE,
     FORMAT_VALUE,
     FORMAT_YAML,
+    BaseStep,
     ResultType,
     get_step_message,
-    run_plan,
     run_preflight_checks,
 )
 from sunbeam.jobs.deployment import Deployment
@@ -69,12 +69,19 @@ from anvil.commands.clusterd import (
     ClusterJoinNodeStep,
     ClusterListNodeStep,
     ClusterRemoveNodeStep,
+    ClusterUpdateJujuControllerStep,
 )
 from anvil.commands.haproxy import (
+    ReapplyHAProxyTerraformPlanStep,
     RemoveHAProxyUnitStep,
     haproxy_install_steps,
 )
-from anvil.commands.juju import JujuAddSSHKeyStep, RemoveJujuMachineStep
+from anvil.commands.juju import (
+    ConfigureJujuStep,
+    EnableControllerHAStep,
+    JujuAddSSHKeyStep,
+    RemoveJujuMachineStep,
+)
 from anvil.commands.maas_agent import (
     RemoveMAASAgentUnitStep,
     maas_agent_install_steps,
@@ -88,14 +95,30 @@ from anvil.commands.postgresql import (
     RemovePostgreSQLUnitStep,
     postgresql_install_steps,
 )
-from anvil.jobs.checks import DaemonGroupCheck, SystemRequirementsCheck
+from anvil.commands.prepare_node import generate_user_data
+from anvil.jobs.benchmark import get_benchmark_directory, load_thresholds
+from anvil.jobs.bindings import AddJujuSpacesStep
+from anvil.jobs.checks import (
+    DaemonGroupCheck,
+    DiskPerformanceCheck,
+    NetworkPerformanceCheck,
+    SystemRequirementsCheck,
+)
 from anvil.jobs.common import (
     Role,
     roles_to_str_list,
+    run_plan,
     validate_roles,
 )
 from anvil.jobs.juju import CONTROLLER
 from anvil.jobs.manifest import AddManifestStep, Manifest
+from anvil.jobs.steps import (
+    AcquireJoinLockStep,
+    JoinLock,
+    RecordHostResourcesStep,
+    ReleaseJoinLockStep,
+    get_host_inventories,
+)
 from anvil.provider.local.deployment import LocalDeployment
 from anvil.utils import (
     CatchGroup,
@@ -155,6 +178,7 @@ class LocalProvider(ProviderBase):
         cluster.add_command(join)
         cluster.add_command(list)
         cluster.add_command(remove)
+        cluster.add_command(enable_controller_ha)
         cluster.add_command(refresh_cmds.refresh)
 
     def deployment_type(self) -> tuple[str, type[Deployment]]:
@@ -268,12 +292,20 @@ def bootstrap(
     juju_bootstrap_args = manifest_obj.software_config.juju.bootstrap_args  # type: ignore[union-attr]
     data_location = snap.paths.user_data
 
+    postgres_storage = (
+        manifest_obj.deployment_config.get("postgres") or {}
+    ).get("storage")
+    disk_check = DiskPerformanceCheck(
+        get_benchmark_directory(snap, storage=bool(postgres_storage)),
+        load_thresholds(snap),
+    )
     preflight_checks = [
         SystemRequirementsCheck(),
         JujuSnapCheck(),
         SshKeysConnectedCheck(),
         DaemonGroupCheck(),
         LocalShareCheck(),
+        disk_check,
     ]
     run_preflight_checks(preflight_checks, console)
 
@@ -316,14 +348,23 @@ def bootstrap(
     deployment.reload_juju_credentials()
     jhelper = JujuHelper(deployment.get_connected_controller())
 
-    plan4 = postgresql_install_steps(
-        client,
-        manifest_obj,
-        jhelper,
-        deployment.infrastructure_model,
-        fqdn,
-        accept_defaults,
-        preseed,
+    plan4: List[BaseStep] = [
+        RecordHostResourcesStep(client, fqdn, disk_check.result),
+        AddJujuSpacesStep(preseed, deployment.infrastructure_model),
+        ConfigureJujuStep(
+            preseed, CONTROLLER, deployment.infrastructure_model
+        ),
+    ]
+    plan4.extend(
+        postgresql_install_steps(
+            client,
+            manifest_obj,
+            jhelper,
+            deployment.infrastructure_model,
+            fqdn,
+            accept_defaults,
+            preseed,
+        )
     )
     if is_haproxy_node:
         plan4.extend(
@@ -372,65 +413,187 @@ def bootstrap(
     \b
     Add an additional node to the cluster. Run this command on the bootstrap node.
     maas-anvil cluster add --fqdn infra2.
+    \b
+    Generate user data that prepares and joins nodes when they are deployed.
+    maas-anvil cluster add --fqdn infra2. --fqdn infra3.  \\\
+    \b
+    --cloud-init --channel latest/edge --role region --role agent \\\
+    \b
+    --output user-data
     """,
 )
 @click.option(
     "--fqdn",
+    "fqdns",
     type=str,
-    prompt=True,
-    help="The fully qualified domain name (FQDN) of the joining node.",
+    multiple=True,
+    help=(
+        "The fully qualified domain name (FQDN) of the joining node. Use "
+        "multiple --fqdn flags to add more than one node."
+    ),
 )
 @click.option(
     "-f",
     "--format",
     type=click.Choice([FORMAT_DEFAULT, FORMAT_VALUE, FORMAT_YAML]),
     default=FORMAT_DEFAULT,
-    help="Output format of the join token.",
+    help=(
+        "Output format of the join token. With more than one node, value "
+        "prints the FQDN and the token of a node per line."
+    ),
+)
+@click.option(
+    "--cloud-init",
+    is_flag=True,
+    default=False,
+    help=(
+        "Generates cloud-init user data that prepares the node and joins it "
+        "to the cluster, instead of the join token."
+    ),
+)
+@click.option(
+    "--role",
+    "roles",
+    multiple=True,
+    default=["region"],
+    type=click.Choice(
+        ["region", "agent", "database", "haproxy"], case_sensitive=False
+    ),
+    callback=validate_roles,
+    help=(
+        "Specifies the roles the nodes join with, used with --cloud-init. "
+        "Use multiple --role flags to assign more than one role."
+    ),
+)
+@click.option(
+    "--channel",
+    help=(
+        "Channel of the maas-anvil snap the nodes install, used with "
+        "--cloud-init. Use the channel this node tracks, as shown by "
+        "'snap list maas-anvil'."
+    ),
+)
+@click.option(
+    "-o",
+    "--output",
+    help=(
+        "Directory the user data is written to, as <fqdn>.yaml. Required "
+        "with --cloud-init when adding more than one node."
+    ),
+    type=click.Path(file_okay=False, path_type=Path),
 )
 @click.pass_context
-def add(ctx: click.Context, fqdn: str, format: str) -> None:
+def add(
+    ctx: click.Context,
+    fqdns: tuple[str, ...],
+    format: str,
+    roles: List[Role],
+    cloud_init: bool = False,
+    channel: str | None = None,
+    output: Path | None = None,
+) -> None:
     """Generates a token for a new node to join the cluster.
     Needs to be run on the node where the cluster was bootstrapped.
     """
-    preflight_checks = [DaemonGroupCheck(), VerifyFQDNCheck(fqdn)]
+    if not fqdns:
+        fqdns = (click.prompt("Fqdn", type=str),)
+    if cloud_init and not channel:
+        # The snap cannot read the channel it tracks under strict confinement
+        raise click.UsageError(
+            "--channel is required with --cloud-init, use the channel shown "
+            "by 'snap list maas-anvil'"
+        )
+    if cloud_init and len(fqdns) > 1 and not output:
+        raise click.UsageError(
+            "--output is required with --cloud-init for more than one node"
+        )
+    preflight_checks = [DaemonGroupCheck()]
+    preflight_checks.extend(VerifyFQDNCheck(fqdn) for fqdn in fqdns)
     run_preflight_checks(preflight_checks, console)
-    fqdn = remove_trailing_dot(fqdn)
+    fqdns = tuple(remove_trailing_dot(fqdn) for fqdn in fqdns)
 
     deployment: LocalDeployment = ctx.obj
     client = deployment.get_client()
 
-    plan1 = [
-        JujuLoginStep(deployment.juju_account),
-        ClusterAddNodeStep(client, fqdn),
-        CreateJujuUserStep(fqdn),
-    ]
+    run_plan([JujuLoginStep(deployment.juju_account)], console)
 
-    plan1_results = run_plan(plan1, console)
+    def _add_node(fqdn: str) -> str | None:
+        """Add the node to the cluster and return its join token."""
+        plan1 = [
+            ClusterAddNodeStep(client, fqdn),
+            CreateJujuUserStep(fqdn),
+        ]
+        plan1_results = run_plan(plan1, console)
+
+        user_token = get_step_message(plan1_results, CreateJujuUserStep)
 
-    user_token = get_step_message(plan1_results, CreateJujuUserStep)
+        plan2 = [ClusterAddJujuUserStep(client, fqdn, user_token)]
+        run_plan(plan2, console)
 
-    plan2 = [ClusterAddJujuUserStep(client, fqdn, user_token)]
-    run_plan(plan2, console)
+        # The token is also returned when the node was added before but
+        # has not joined yet
+        add_node_step_result = plan1_results.get("ClusterAddNodeStep")
+        return add_node_step_result.message or None
 
-    def _print_output(token: str) -> None:
-        """Helper for printing formatted output."""
-        if format == FORMAT_DEFAULT:
+    tokens = {}
+    for fqdn in fqdns:
+        token = _add_node(fqdn)
+        if token is None:
+            console.print(f"Node {fqdn} already a member of the MAAS cluster")
+        else:
+            tokens[fqdn] = token
+
+    if cloud_init:
+        for fqdn, token in tokens.items():
+            user_data = generate_user_data(
+                token,
+                roles_to_str_list(roles),
+                channel,  # type: ignore[arg-type]
+            )
+            if not output:
+                click.echo(user_data, nl=False)
+                continue
+            path = output / f"{fqdn}.yaml"
+            try:
+                output.mkdir(mode=0o775, parents=True, exist_ok=True)
+                # The user data holds the join token, also tighten the mode
+                # of a file written before
+                fd = os.open(
+                    path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600
+                )
+                with os.fdopen(fd, "w") as file:
+                    os.fchmod(file.fileno(), 0o600)
+                    file.write(user_data)
+            except OSError as e:
+                LOG.debug(e)
+                raise click.ClickException(
+                    f"Writing the user data failed: {e!s}"
+                )
+            console.print(f"User data for the Node {fqdn} written to {path}")
+        return
+
+    if format == FORMAT_DEFAULT:
+        for fqdn, token in tokens.items():
             console.print(
                 f"Token for the Node {fqdn}: {token}", soft_wrap=True
             )
-        elif format == FORMAT_YAML:
+    elif format == FORMAT_YAML and tokens:
+        if len(fqdns) == 1:
+            (token,) = tokens.values()
             click.echo(yaml.dump({"token": token}))
-        elif format == FORMAT_VALUE:
-            click.echo(token)
-
-    add_node_step_result = plan1_results.get("ClusterAddNodeStep")
-    if add_node_step_result.result_type == ResultType.COMPLETED:
-        _print_output(add_node_step_result.message)
-    elif add_node_step_result.result_type == ResultType.SKIPPED:
-        if add_node_step_result.message:
-            _print_output(add_node_step_result.message)
         else:
-            console.print("Node already a member of the MAAS cluster")
+            click.echo(
+                yaml.dump(
+                    {fqdn: {"token": token} for fqdn, token in tokens.items()}
+                )
+            )
+    elif format == FORMAT_VALUE:
+        if len(fqdns) == 1:
+            for token in tokens.values():
+                click.echo(token)
+        else:
+            for fqdn, token in tokens.items():
+                click.echo(f"{fqdn} {token}")
 
 
 @click.command(
@@ -501,12 +664,20 @@ def join(
         DaemonGroupCheck(),
         LocalShareCheck(),
         TokenCheck(name, token),
+        NetworkPerformanceCheck(token),
     ]
+    snap = Snap()
+    disk_check = None
+    if is_database_node:
+        disk_check = DiskPerformanceCheck(
+            get_benchmark_directory(snap), load_thresholds(snap)
+        )
+        preflight_checks.append(disk_check)
     run_preflight_checks(preflight_checks, console)
 
     controller = CONTROLLER
     deployment: LocalDeployment = ctx.obj
-    data_location = Snap().paths.user_data
+    data_location = snap.paths.user_data
     client = deployment.get_client()
 
     plan1 = [
@@ -533,7 +704,13 @@ def join(
         machine_id = int(machine_id_result)
 
     jhelper = JujuHelper(deployment.get_connected_controller())
-    plan2 = [ClusterUpdateNodeStep(client, name, machine_id=machine_id)]
+    plan2 = [
+        ClusterUpdateNodeStep(client, name, machine_id=machine_id),
+        RecordHostResourcesStep(
+            client, name, disk_check.result if disk_check else None
+        ),
+        AddJujuSpacesStep(preseed, deployment.infrastructure_model),
+    ]
 
     if is_database_node:
         plan2.extend(
@@ -571,10 +748,21 @@ def join(
                 preseed,
             )
         )
-        plan2.append(
-            ReapplyPostgreSQLTerraformPlanStep(
-                client, manifest_obj, jhelper, deployment.infrastructure_model
-            )
+        plan2.extend(
+            [
+                ReapplyPostgreSQLTerraformPlanStep(
+                    client,
+                    manifest_obj,
+                    jhelper,
+                    deployment.infrastructure_model,
+                ),
+                ReapplyHAProxyTerraformPlanStep(
+                    client,
+                    manifest_obj,
+                    jhelper,
+                    deployment.infrastructure_model,
+                ),
+            ]
         )
     if is_agent_node:
         plan2.extend(
@@ -586,8 +774,26 @@ def join(
                 name,
             )
         )
+    if is_database_node:
+        plan2.extend(
+            [
+                EnableControllerHAStep(
+                    client,
+                    controller,
+                    manifest_obj.software_config.juju.scale_args,  # type: ignore[union-attr]
+                ),
+                ClusterUpdateJujuControllerStep(client, controller),
+            ]
+        )
 
-    run_plan(plan2, console)
+    # Nodes deployed together join at the same time, serialize the steps
+    # updating the configuration kept in clusterd
+    join_lock = JoinLock(client, name)
+    run_plan([AcquireJoinLockStep(join_lock)], console)
+    try:
+        run_plan(plan2, console)
+    finally:
+        run_plan([ReleaseJoinLockStep(join_lock)], console)
 
     click.echo(f"Node joined cluster with roles: {pretty_roles}")
 
@@ -645,6 +851,10 @@ def list(ctx: click.Context, format: str) -> None:
             )
         console.print(table)
     elif format == FORMAT_YAML:
+        inventories = get_host_inventories(client)
+        for name, node in nodes.items():
+            if name in inventories:
+                node["inventory"] = inventories[name]
         click.echo(yaml.dump(nodes, sort_keys=True))
 
 
@@ -692,6 +902,9 @@ def remove(ctx: click.Context, fqdn: str) -> None:
         RemoveHAProxyUnitStep(
             client, fqdn, jhelper, deployment.infrastructure_model
         ),
+        ReapplyHAProxyTerraformPlanStep(
+            client, manifest_obj, jhelper, deployment.infrastructure_model
+        ),
         RemovePostgreSQLUnitStep(
             client, fqdn, jhelper, deployment.infrastructure_model
         ),
@@ -700,9 +913,25 @@ def remove(ctx: click.Context, fqdn: str) -> None:
         # so commenting the RemoveJujuUserStep
         # RemoveJujuUserStep(fqdn),
         ClusterRemoveNodeStep(client, fqdn),
+        # Replace the controller the node hosted, on another database node
+        EnableControllerHAStep(
+            client,
+            CONTROLLER,
+            manifest_obj.software_config.juju.scale_args,  # type: ignore[union-attr]
+        ),
+        ClusterUpdateJujuControllerStep(client, CONTROLLER),
     ]
-    run_plan(plan, console)
+    results = run_plan(plan, console)
     click.echo(f"Removed node {fqdn} from the cluster")
+    controller_ha = results["EnableControllerHAStep"]
+    if (
+        controller_ha.result_type == ResultType.SKIPPED
+        and controller_ha.message
+    ):
+        console.print(
+            f"[yellow]WARNING:[/yellow] {controller_ha.message}, the Juju "
+            "controller is not highly available"
+        )
     # Removing machine does not clean up all deployed Juju components. This is
     # deliberate, see https://bugs.launchpad.net/juju/+bug/1851489.
     # Without the workaround mentioned in LP#1851489, it is not possible to
@@ -711,3 +940,45 @@ def remove(ctx: click.Context, fqdn: str) -> None:
         f"Run command 'sudo /sbin/remove-juju-services' on node {fqdn} "
         "to reuse the machine."
     )
+
+
+@click.command(
+    "enable-controller-ha",
+    cls=FormatEpilogCommand,
+    epilog="""
+    \b
+    Spread the Juju controller over three database nodes.
+    maas-anvil cluster enable-controller-ha
+    """,
+)
+@click.pass_context
+def enable_controller_ha(ctx: click.Context) -> None:
+    """Makes the Juju controller highly available.
+    Adds controllers on the database nodes until three are running.
+    """
+    deployment: LocalDeployment = ctx.obj
+    client = deployment.get_client()
+
+    preflight_checks = [DaemonGroupCheck()]
+    run_preflight_checks(preflight_checks, console)
+
+    manifest_obj = Manifest.load_latest_from_clusterdb(
+        deployment, include_defaults=True
+    )
+
+    plan = [
+        JujuLoginStep(deployment.juju_account),
+        EnableControllerHAStep(
+            client,
+            CONTROLLER,
+            manifest_obj.software_config.juju.scale_args,  # type: ignore[union-attr]
+        ),
+        ClusterUpdateJujuControllerStep(client, CONTROLLER),
+    ]
+    results = run_plan(plan, console)
+    if results["EnableControllerHAStep"].result_type == ResultType.SKIPPED:
+        click.echo(
+            "Controller HA needs three database nodes, or is already enabled"
+        )
+    else:
+        click.echo("Juju controller is highly available")
@@ -40,7 +40,7 @@ from anvil.commands.postgresql import (
     POSTGRESQL_CONFIG_KEY,
     postgresql_questions,
 )
-from anvil.jobs.questions import show_questions
+from anvil.jobs.questions import show_mapping, show_questions
 
 LOG = logging.getLogger(__name__)
 LOCAL_TYPE = "local"
@@ -50,8 +50,17 @@ class LocalDeployment(SunbeamLocalDeployment):
     def __init__(self, **data: Any) -> None:
         super().__init__(**data)
 
-    def generate_preseed(self, console: Console) -> str:
-        """Generate preseed for deployment."""
+    def generate_preseed(
+        self,
+        console: Console,
+        planned: dict[str, dict[str, Any]] | None = None,
+    ) -> str:
+        """Generate preseed for deployment.
+
+        :param planned: answers per section, taking precedence over the
+                        answers stored in the cluster
+        """
+        planned = planned or {}
         client = self.get_client()
         preseed_content = ["deployment:"]
         try:
@@ -75,11 +84,13 @@ class LocalDeployment(SunbeamLocalDeployment):
         postgresql_config_bank = QuestionBank(
             questions=postgresql_questions(),
             console=console,
-            previous_answers=variables,
+            previous_answers=variables | planned.get("postgres", {}),
         )
         preseed_content.extend(
             show_questions(postgresql_config_bank, section="postgres")
         )
+        if storage := planned.get("postgres", {}).get("storage"):
+            preseed_content.extend(show_mapping(storage, "storage"))
 
         # HAProxy questions
         try:
@@ -91,11 +102,13 @@ class LocalDeployment(SunbeamLocalDeployment):
         haproxy_config_bank = QuestionBank(
             questions=qs,
             console=console,
-            previous_answers=variables,
+            previous_answers=variables | planned.get("haproxy", {}),
         )
         preseed_content.extend(
             show_questions(haproxy_config_bank, section="haproxy")
         )
+        if tuning := planned.get("haproxy", {}).get("tuning"):
+            preseed_content.extend(show_mapping(tuning, "tuning"))
 
         # MAAS region questions
         try:
@@ -110,6 +123,21 @@ class LocalDeployment(SunbeamLocalDeployment):
         preseed_content.extend(
             show_questions(maas_region_config_bank, section="maas-region")
         )
+        if boot_resources := planned.get("maas-region", {}).get(
+            "boot_resources"
+        ):
+            preseed_content.extend(
+                show_mapping(boot_resources, "boot_resources")
+            )
+
+        # MAAS agent has no questions, only planned settings
+        if boot_resources := planned.get("maas-agent", {}).get(
+            "boot_resources"
+        ):
+            preseed_content.append("  maas-agent:")
+            preseed_content.extend(
+                show_mapping(boot_resources, "boot_resources")
+            )
 
         preseed_content_final = "\n".join(preseed_content)
         return preseed_content_final
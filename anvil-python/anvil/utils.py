@@ -25,6 +25,7 @@ from sunbeam.plugins.interface.v1.base import PluginError
 LOG = logging.getLogger(__name__)
 LOCAL_ACCESS = "local"
 REMOTE_ACCESS = "remote"
+STORAGE_SIZE_UNITS = {"M": 1, "G": 1024, "T": 1024 * 1024}
 
 
 class HasEpilogProtocol(Protocol):
@@ -93,6 +94,7 @@ class FormatCommandGroupsGroup(click.Group):
                 "Prepare, create and manage a cluster",
                 [
                     ("prepare-node-script", None),
+                    ("plan-capacity", None),
                     (
                         "cluster",
                         lambda cmd: cmd.name not in ["list", "refresh"],
@@ -106,6 +108,8 @@ class FormatCommandGroupsGroup(click.Group):
                 [
                     ("manifest", lambda _: True),
                     ("refresh", None),
+                    ("enable", lambda _: True),
+                    ("disable", lambda _: True),
                 ],
             ),
             (
@@ -113,7 +117,11 @@ class FormatCommandGroupsGroup(click.Group):
                 [
                     ("cluster", lambda cmd: cmd.name == "list"),
                     ("inspect", None),
+                    ("metrics", None),
+                    ("top", None),
+                    ("check", lambda _: True),
                     ("juju-login", None),
+                    ("observability", lambda _: True),
                 ],
             ),
         ]
@@ -200,3 +208,14 @@ def get_architecture() -> str:
         return "arm64"
     else:
         return "other"
+
+
+def parse_storage_size(size: str) -> int:
+    """Return the size in MiB of a storage size like '100G'."""
+    value = str(size).strip().upper()
+    try:
+        if value[-1:] in STORAGE_SIZE_UNITS:
+            return int(float(value[:-1]) * STORAGE_SIZE_UNITS[value[-1]])
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Invalid storage size {size!r}, e.g. '100G'")
@@ -0,0 +1,113 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from anvil.commands.diagnostics import (
+    CollectPostgreSQLStatsStep,
+    as_json_query,
+)
+
+ACTIVITY = [
+    {"datname": "maasdb", "state": "active", "query": "SELECT 1"},
+    {"datname": "maasdb", "state": "idle", "query": "LISTEN sys_core"},
+]
+TABLE_SIZES = [
+    {"relname": "maasserver_event", "total_size": 8192},
+    {"relname": "maasserver_node", "total_size": 4096},
+]
+
+
+@pytest.fixture
+def step(tmp_path):
+    return CollectPostgreSQLStatsStep(
+        MagicMock(), "controller", tmp_path / "postgresql.json"
+    )
+
+
+def psql_output(rows: list[dict]) -> str:
+    """Return rows the way psql prints a json_agg result, one per line."""
+    return "[" + ", \n ".join(json.dumps(row) for row in rows) + "]"
+
+
+def test_as_json_query_prints_one_line():
+    query = as_json_query("SELECT 1")
+    assert "jsonb_agg(t)" in query
+    assert query.endswith("::text FROM (SELECT 1) t")
+
+
+def test_parse_sections_rows_on_one_line(step):
+    stdout = "\n".join(
+        [
+            "## activity",
+            json.dumps(ACTIVITY),
+            "## table_sizes",
+            json.dumps(TABLE_SIZES[:1]),
+            "## table_sizes",
+            json.dumps(TABLE_SIZES[1:]),
+        ]
+    )
+    sections = step._parse_sections({"stdout": stdout, "return-code": 0})
+    assert sections == {"activity": ACTIVITY, "table_sizes": TABLE_SIZES}
+
+
+def test_parse_sections_rows_on_several_lines(step):
+    stdout = "\n".join(
+        [
+            "## activity",
+            psql_output(ACTIVITY),
+            "## statements",
+            "[]",
+            "## table_sizes",
+            psql_output(TABLE_SIZES),
+        ]
+    )
+    sections = step._parse_sections({"stdout": stdout, "return-code": 0})
+    assert sections == {
+        "activity": ACTIVITY,
+        "statements": [],
+        "table_sizes": TABLE_SIZES,
+    }
+
+
+def test_parse_sections_records_errors(step):
+    result = {
+        "stdout": "## activity\n[]",
+        "stderr": "psql: error: connection refused",
+        "return-code": 2,
+    }
+    sections = step._parse_sections(result)
+    assert sections == {
+        "activity": [],
+        "errors": "psql: error: connection refused",
+    }
+
+
+def test_run_writes_every_unit(step):
+    stdout = f"## activity\n{psql_output(ACTIVITY)}"
+    results = {
+        "postgresql/0": {"stdout": stdout, "return-code": 0},
+        "postgresql/1": {"stdout": "## activity\n[]", "return-code": 0},
+    }
+    with patch.object(step, "exec", return_value=results):
+        step.run()
+    data = json.loads(step.file_path.read_text())
+    assert data == {
+        "postgresql/0": {"activity": ACTIVITY},
+        "postgresql/1": {"activity": []},
+    }
@@ -0,0 +1,145 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import json
+import socket
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+from anvil.jobs import network
+from anvil.jobs.network import (
+    CLUSTERD_PORT,
+    ThroughputServer,
+    check_peer,
+    get_join_addresses,
+    load_listen_address,
+    measure_latency,
+    measure_throughput,
+    parse_address,
+)
+
+LOOPBACK = "127.0.0.1"
+
+
+@pytest.fixture
+def listener():
+    """Run a throughput listener on a free loopback port."""
+    server = ThroughputServer(LOOPBACK, 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def closed_port():
+    """Return a loopback port nothing listens on."""
+    with socket.socket() as sock:
+        sock.bind((LOOPBACK, 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.parametrize(
+    "address,expected",
+    [
+        ("10.0.0.1", ("10.0.0.1", CLUSTERD_PORT)),
+        ("10.0.0.1:7410", ("10.0.0.1", 7410)),
+        ("infra1", ("infra1", CLUSTERD_PORT)),
+        ("[fd00::1]", ("fd00::1", CLUSTERD_PORT)),
+        ("[fd00::1]:7410", ("fd00::1", 7410)),
+    ],
+)
+def test_parse_address(address, expected):
+    assert parse_address(address, CLUSTERD_PORT) == expected
+
+
+def test_join_addresses():
+    token = base64.b64encode(
+        json.dumps(
+            {"name": "infra2", "join_addresses": ["10.0.0.1:7000"]}
+        ).encode()
+    ).decode()
+    assert get_join_addresses(token) == ["10.0.0.1:7000"]
+
+
+def test_join_addresses_invalid_token():
+    assert get_join_addresses("not a token") == []
+
+
+def test_latency(listener):
+    rtt, jitter, lost = measure_latency(LOOPBACK, listener, samples=5)
+    assert rtt is not None and rtt >= 0
+    assert jitter is not None and jitter >= 0
+    assert lost == 0
+
+
+def test_latency_unreachable(closed_port):
+    assert measure_latency(LOOPBACK, closed_port, samples=5) == (
+        None,
+        None,
+        3,
+    )
+
+
+def test_throughput(listener):
+    throughput = measure_throughput(LOOPBACK, listener, duration=0.2)
+    assert throughput is not None and throughput > 0
+
+
+def test_throughput_without_listener(closed_port):
+    assert measure_throughput(LOOPBACK, closed_port, duration=0.2) is None
+
+
+def test_check_peer(listener, monkeypatch):
+    monkeypatch.setattr(network, "MIN_THROUGHPUT_MBPS", float("inf"))
+    result = check_peer(f"{LOOPBACK}:{listener}", listener)
+    assert result.rtt is not None
+    assert result.throughput is not None
+    assert result.lost == 0
+    assert len(result.warnings) == 1
+    assert "slowing down image sync" in result.warnings[0]
+
+
+def test_check_peer_unreachable(closed_port):
+    result = check_peer(f"{LOOPBACK}:{closed_port}", closed_port)
+    assert result.rtt is None
+    assert result.throughput is None
+    assert result.warnings == [f"{LOOPBACK}:{closed_port} is not reachable"]
+
+
+def test_listener_drops_idle_connections(listener, monkeypatch):
+    monkeypatch.setattr(network, "LISTENER_TIMEOUT", 0.1)
+    with socket.create_connection((LOOPBACK, listener)) as sock:
+        sock.settimeout(5)
+        # The listener closes the connection without reporting a count
+        assert sock.recv(8) == b""
+
+
+@pytest.mark.parametrize(
+    "options,expected",
+    [
+        ({"network": {"listen-address": "10.10.0.11"}}, "10.10.0.11"),
+        ({"network": {"listen-address": ""}}, None),
+        ({}, None),
+    ],
+)
+def test_load_listen_address(options, expected):
+    snap = MagicMock()
+    snap.config.get_options.return_value.as_dict.return_value = options
+    assert load_listen_address(snap) == expected
@@ -0,0 +1,386 @@
+# Copyright (c) 2024 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from pathlib import Path
+import re
+from unittest.mock import MagicMock, patch
+
+import click
+import pytest
+from sunbeam.commands.terraform import TerraformException, TerraformInitStep
+from sunbeam.jobs.common import ResultType
+
+from anvil.jobs import manifest as manifest_module
+from anvil.jobs.manifest import Manifest
+from anvil.plugins.observability import plugin as observability
+from anvil.plugins.observability.plugin import (
+    COS_OFFERS,
+    DASHBOARDS_DIR,
+    OBSERVABILITY_CONFIG_KEY,
+    DeployGrafanaAgentStep,
+    ObservabilityPlugin,
+    get_cos_offers,
+)
+
+MODEL = "controller"
+# Stand-in for a COS deployment offering its endpoints to the model
+COS_MODEL = "local:admin/cos"
+STUB_COS_OFFERS = {
+    "prometheus_offer_url": f"{COS_MODEL}.prometheus-receive-remote-write",
+    "loki_offer_url": f"{COS_MODEL}.loki-logging",
+    "grafana_dashboard_offer_url": f"{COS_MODEL}.grafana-dashboards",
+}
+TFPLAN_DIR = DASHBOARDS_DIR.parent / "deploy-cos"
+SNAP_NAME = "maas-anvil"
+
+
+class StandInTerraformHelper:
+    """Stand-in for Terraform applying the deploy-cos plan.
+
+    The tfvars are written to the plan directory like Terraform reads
+    them, and applying fails like Terraform would on an undeclared or
+    missing required variable.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.applied: list[dict] = []
+
+    def write_tfvars(self, tfvars: dict) -> None:
+        (self.path / "terraform.tfvars.json").write_text(json.dumps(tfvars))
+
+    def apply(self) -> None:
+        tfvars = json.loads((self.path / "terraform.tfvars.json").read_text())
+        variables = get_plan_variables()
+        undeclared = set(tfvars) - set(variables)
+        if undeclared:
+            raise TerraformException(f"Undeclared variables: {undeclared}")
+        missing = {
+            name
+            for name, required in variables.items()
+            if required and name not in tfvars
+        }
+        if missing:
+            raise TerraformException(f"Missing variables: {missing}")
+        self.applied.append(tfvars)
+
+    def destroy(self) -> None:
+        self.applied.clear()
+
+
+class StandInManifest:
+    """Manifest applying the plan through the real tfvars handling."""
+
+    update_tfvars_and_apply_tf = Manifest.update_tfvars_and_apply_tf
+
+    def __init__(self, tfhelper: StandInTerraformHelper):
+        self.deployment_config = {"observability": dict(STUB_COS_OFFERS)}
+        self.tfhelper = tfhelper
+
+    def get_tfhelper(self, tfplan: str) -> StandInTerraformHelper:
+        assert tfplan == ObservabilityPlugin.tfplan
+        return self.tfhelper
+
+    def _get_tfvar_names(self, tfplan: str) -> list[str]:
+        return ["charm_grafana_agent_channel"]
+
+    def _get_tfvars(self, tfplan: str) -> dict:
+        return {"charm_grafana_agent_channel": "latest/stable"}
+
+
+@pytest.fixture
+def client():
+    nodes = {
+        "database": [{"name": "infra1"}],
+        "region": [{"name": "infra1"}, {"name": "infra2"}],
+        "agent": [],
+        "haproxy": [{"name": "infra2"}],
+    }
+    client = MagicMock()
+    client.cluster.list_nodes_by_role.side_effect = nodes.__getitem__
+    return client
+
+
+@pytest.fixture
+def manifest():
+    manifest = MagicMock()
+    manifest.deployment_config = {"observability": dict(STUB_COS_OFFERS)}
+    return manifest
+
+
+@pytest.fixture
+def config_store(monkeypatch):
+    """Stand-in for the clusterd configuration read by the manifest."""
+    store: dict[str, dict] = {}
+
+    def read_config(client, key):
+        if key not in store:
+            raise manifest_module.ConfigItemNotFoundException(key)
+        return dict(store[key])
+
+    def update_config(client, key, value):
+        store[key] = dict(value)
+
+    monkeypatch.setattr(manifest_module, "read_config", read_config)
+    monkeypatch.setattr(manifest_module, "update_config", update_config)
+    return store
+
+
+@pytest.fixture
+def tfhelper(tmp_path):
+    path = tmp_path / "deploy-cos"
+    path.mkdir()
+    return StandInTerraformHelper(path)
+
+
+@pytest.fixture
+def snap_env(tmp_path, monkeypatch):
+    snap = tmp_path / "snap"
+    for name, path in {
+        "SNAP": snap,
+        "SNAP_COMMON": snap / "common",
+        "SNAP_DATA": snap / "data",
+        "SNAP_USER_COMMON": snap / "user-common",
+        "SNAP_USER_DATA": snap / "user-data",
+        "SNAP_REAL_HOME": tmp_path / "home",
+        "SNAP_LIBRARY_PATH": snap / "lib",
+    }.items():
+        path.mkdir(parents=True, exist_ok=True)
+        monkeypatch.setenv(name, str(path))
+    for name, value in {
+        "SNAP_NAME": SNAP_NAME,
+        "SNAP_INSTANCE_NAME": SNAP_NAME,
+        "SNAP_INSTANCE_KEY": "",
+        "SNAP_REVISION": "1",
+        "SNAP_VERSION": "3.6",
+        "SNAP_ARCH": "amd64",
+        "SNAP_COOKIE": "",
+        "SNAP_CONTEXT": "",
+        "SNAP_REEXEC": "",
+        "SNAP_UID": "0",
+        "SNAP_EUID": "0",
+    }.items():
+        monkeypatch.setenv(name, value)
+
+
+@pytest.fixture
+def plugin(client, snap_env):
+    deployment = MagicMock()
+    deployment.get_client.return_value = client
+    deployment.infrastructure_model = MODEL
+    return ObservabilityPlugin(deployment)
+
+
+def get_plan_variables() -> dict[str, bool]:
+    """Return the variables of the plan and whether they are required."""
+    variables = (TFPLAN_DIR / "variables.tf").read_text()
+    return {
+        name: not re.search(r"^\s*default\s*=", body, re.MULTILINE)
+        for name, body in re.findall(
+            r'^variable "(\w+)" \{(.*?)^\}', variables, re.MULTILINE | re.S
+        )
+    }
+
+
+class TestCosOffers:
+    def test_offers_of_the_manifest(self):
+        preseed = {"observability": dict(STUB_COS_OFFERS)}
+        assert get_cos_offers(preseed) == STUB_COS_OFFERS
+
+    def test_unset_offers_are_none(self):
+        preseed = {
+            "observability": {
+                "prometheus_offer_url": STUB_COS_OFFERS[
+                    "prometheus_offer_url"
+                ],
+                "loki_offer_url": "",
+            }
+        }
+        assert get_cos_offers(preseed) == {
+            "prometheus_offer_url": STUB_COS_OFFERS["prometheus_offer_url"],
+            "loki_offer_url": None,
+            "grafana_dashboard_offer_url": None,
+        }
+
+    def test_no_observability_section(self):
+        assert get_cos_offers({}) == dict.fromkeys(COS_OFFERS)
+
+
+class TestDeployGrafanaAgentStep:
+    def test_tfvars(self, client, manifest):
+        step = DeployGrafanaAgentStep(client, manifest, MODEL)
+        assert step.extra_tfvars() == {
+            "machine_model": MODEL,
+            "cos_agent_applications": ["postgresql", "maas-region"],
+            "juju_info_applications": ["haproxy"],
+            **STUB_COS_OFFERS,
+        }
+
+    def test_tfvars_are_plan_variables(self, client, manifest, plugin):
+        step = DeployGrafanaAgentStep(client, manifest, MODEL)
+        charm_tfvars = plugin.manifest_attributes_tfvar_map()[
+            ObservabilityPlugin.tfplan
+        ]["charms"]["grafana-agent"]
+        tfvars = set(step.extra_tfvars()) | set(charm_tfvars.values())
+        assert tfvars <= set(get_plan_variables())
+
+    def test_run_applies_plan(self, client, manifest):
+        step = DeployGrafanaAgentStep(client, manifest, MODEL)
+        result = step.run()
+        assert result.result_type == ResultType.COMPLETED
+        manifest.update_tfvars_and_apply_tf.assert_called_once_with(
+            client,
+            tfplan=ObservabilityPlugin.tfplan,
+            tfvar_config=OBSERVABILITY_CONFIG_KEY,
+            override_tfvars=step.extra_tfvars(),
+        )
+
+    def test_run_applies_plan_to_stand_in(
+        self, client, tfhelper, config_store
+    ):
+        manifest = StandInManifest(tfhelper)
+        step = DeployGrafanaAgentStep(client, manifest, MODEL)
+        assert step.run().result_type == ResultType.COMPLETED
+
+        applied = tfhelper.applied[-1]
+        assert applied == {
+            "charm_grafana_agent_channel": "latest/stable",
+            **step.extra_tfvars(),
+        }
+        assert config_store[OBSERVABILITY_CONFIG_KEY] == applied
+
+    def test_rerun_keeps_recorded_tfvars(self, client, tfhelper, config_store):
+        config_store[OBSERVABILITY_CONFIG_KEY] = {
+            "charm_grafana_agent_channel": "latest/edge",
+            "charm_grafana_agent_config": {"log_level": "debug"},
+            "juju_info_applications": [],
+        }
+        manifest = StandInManifest(tfhelper)
+        step = DeployGrafanaAgentStep(client, manifest, MODEL)
+        assert step.run().result_type == ResultType.COMPLETED
+
+        applied = tfhelper.applied[-1]
+        # The manifest resets the charm channel, settings made outside of
+        # it are kept and the applications follow the cluster
+        assert applied["charm_grafana_agent_channel"] == "latest/stable"
+        assert applied["charm_grafana_agent_config"] == {"log_level": "debug"}
+        assert applied["juju_info_applications"] == ["haproxy"]
+
+    def test_stand_in_rejects_missing_model(self, client, tfhelper):
+        tfhelper.write_tfvars(dict(STUB_COS_OFFERS))
+        with pytest.raises(TerraformException, match="machine_model"):
+            tfhelper.apply()
+
+    def test_run_fails_on_terraform_error(self, client, manifest):
+        manifest.update_tfvars_and_apply_tf.side_effect = TerraformException(
+            "apply failed"
+        )
+        step = DeployGrafanaAgentStep(client, manifest, MODEL)
+        result = step.run()
+        assert result.result_type == ResultType.FAILED
+        assert result.message == "apply failed"
+
+
+class TestEnablePlans:
+    def test_enable_without_offers(self, plugin, manifest):
+        manifest.deployment_config = {}
+        with (
+            patch.object(
+                observability.Manifest,
+                "load_latest_from_clusterdb",
+                return_value=manifest,
+            ),
+            patch.object(observability, "run_plan") as run_plan,
+        ):
+            with pytest.raises(click.ClickException):
+                plugin.run_enable_plans()
+        run_plan.assert_not_called()
+
+    def test_enable_applies_plan(self, plugin, client, tfhelper, config_store):
+        def run_plan(plan, console):
+            # The stand-in needs no Terraform initialisation
+            for step in plan:
+                if not isinstance(step, TerraformInitStep):
+                    assert step.run().result_type == ResultType.COMPLETED
+
+        with (
+            patch.object(
+                observability.Manifest,
+                "load_latest_from_clusterdb",
+                return_value=StandInManifest(tfhelper),
+            ),
+            patch.object(observability, "run_plan", run_plan),
+        ):
+            plugin.run_enable_plans()
+        applied = tfhelper.applied[-1]
+        assert applied["machine_model"] == MODEL
+        assert (
+            applied["prometheus_offer_url"]
+            == (STUB_COS_OFFERS["prometheus_offer_url"])
+        )
+
+    def test_enable_plan(self, plugin, manifest):
+        with (
+            patch.object(
+                observability.Manifest,
+                "load_latest_from_clusterdb",
+                return_value=manifest,
+            ),
+            patch.object(observability, "run_plan") as run_plan,
+        ):
+            plugin.run_enable_plans()
+        plan = run_plan.call_args.args[0]
+        assert [type(step) for step in plan] == [
+            TerraformInitStep,
+            DeployGrafanaAgentStep,
+        ]
+        assert (
+            plan[1].extra_tfvars()["prometheus_offer_url"]
+            == (STUB_COS_OFFERS["prometheus_offer_url"])
+        )
+
+    def test_plan_integrates_every_offer(self):
+        main = (TFPLAN_DIR / "main.tf").read_text()
+        for offer in COS_OFFERS:
+            assert f"offer_url = var.{offer}" in main
+
+
+class TestDashboards:
+    def test_export(self, plugin, tmp_path: Path):
+        output = tmp_path / "dashboards"
+        ObservabilityPlugin.dashboards.callback(plugin, output)
+        exported = sorted(path.name for path in output.iterdir())
+        assert exported == sorted(
+            path.name for path in DASHBOARDS_DIR.glob("*.json")
+        )
+
+    @pytest.mark.parametrize(
+        "dashboard",
+        sorted(DASHBOARDS_DIR.glob("*.json")),
+        ids=lambda path: path.stem,
+    )
+    def test_dashboard_queries_prometheus(self, dashboard: Path):
+        content = json.loads(dashboard.read_text())
+        assert content["uid"] and content["title"]
+        targets = [
+            target
+            for panel in content["panels"]
+            for target in panel.get("targets", [])
+        ]
+        assert targets
+        for target in targets:
+            assert target["datasource"]["type"] == "prometheus"
+            assert target["expr"]
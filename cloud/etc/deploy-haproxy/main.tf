@@ -53,12 +53,15 @@ resource "juju_application" "haproxy" {
     local.services,
     local.ssl_cert,
     local.ssl_key,
+    var.charm_haproxy_tuning,
     var.charm_haproxy_config,
   )
 
   constraints = join(" ", [
     "arch=${var.arch}",
   ])
+
+  endpoint_bindings = length(var.endpoint_bindings) > 0 ? var.endpoint_bindings : null
 }
 
 resource "juju_application" "keepalived" {
@@ -37,6 +37,12 @@ variable "charm_haproxy_config" {
   default     = {}
 }
 
+variable "charm_haproxy_tuning" {
+  description = "Operator config derived from the MAAS region nodes"
+  type        = map(string)
+  default     = {}
+}
+
 variable "machine_ids" {
   description = "List of machine ids to include"
   type        = list(string)
@@ -95,3 +101,12 @@ variable "charm_keepalived_config" {
   type        = map(string)
   default     = {}
 }
+
+variable "endpoint_bindings" {
+  description = "Juju spaces to bind the endpoints to, a binding without endpoint sets the default space"
+  type = list(object({
+    endpoint = optional(string)
+    space    = string
+  }))
+  default = []
+}
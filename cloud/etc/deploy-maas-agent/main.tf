@@ -47,6 +47,8 @@ resource "juju_application" "maas-agent" {
   constraints = join(" ", [
     "arch=${var.arch}",
   ])
+
+  endpoint_bindings = length(var.endpoint_bindings) > 0 ? var.endpoint_bindings : null
 }
 
 resource "juju_integration" "maas-agent-region" {
@@ -47,3 +47,12 @@ variable "machine_model" {
   description = "Model to deploy to"
   type        = string
 }
+
+variable "endpoint_bindings" {
+  description = "Juju spaces to bind the endpoints to, a binding without endpoint sets the default space"
+  type = list(object({
+    endpoint = optional(string)
+    space    = string
+  }))
+  default = []
+}
@@ -72,6 +72,8 @@ resource "juju_application" "maas-region" {
   constraints = join(" ", [
     "arch=${var.arch}",
   ])
+
+  endpoint_bindings = length(var.endpoint_bindings) > 0 ? var.endpoint_bindings : null
 }
 
 resource "juju_integration" "maas-region-postgresql" {
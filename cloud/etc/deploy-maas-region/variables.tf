@@ -134,3 +134,12 @@ variable "region" {
   type        = string
   default     = ""
 }
+
+variable "endpoint_bindings" {
+  description = "Juju spaces to bind the endpoints to, a binding without endpoint sets the default space"
+  type = list(object({
+    endpoint = optional(string)
+    space    = string
+  }))
+  default = []
+}
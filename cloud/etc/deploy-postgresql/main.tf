@@ -68,12 +68,22 @@ resource "juju_application" "postgresql" {
     local.max_connections,
     # workaround for https://bugs.launchpad.net/maas/+bug/2097079
     { "plugin_audit_enable" : false },
+    var.charm_postgresql_tuning,
     var.charm_postgresql_config
   )
 
   constraints = join(" ", [
     "arch=${var.arch}",
   ])
+
+  endpoint_bindings = length(var.endpoint_bindings) > 0 ? var.endpoint_bindings : null
+
+  storage_directives = var.storage_directives
+
+  lifecycle {
+    # Changing the storage replaces the application and its data
+    ignore_changes = [storage_directives]
+  }
 }
 
 
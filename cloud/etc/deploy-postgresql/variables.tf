@@ -37,6 +37,18 @@ variable "charm_postgresql_config" {
   default     = {}
 }
 
+variable "charm_postgresql_tuning" {
+  description = "Operator config derived from the tuning profile of the database nodes"
+  type        = map(string)
+  default     = {}
+}
+
+variable "storage_directives" {
+  description = "Juju storage directives for the PostgreSQL storage, e.g. data = \"rootfs,100G\""
+  type        = map(string)
+  default     = {}
+}
+
 variable "machine_ids" {
   description = "List of machine ids to include"
   type        = list(string)
@@ -122,3 +134,12 @@ variable "region" {
   type        = string
   default     = ""
 }
+
+variable "endpoint_bindings" {
+  description = "Juju spaces to bind the endpoints to, a binding without endpoint sets the default space"
+  type = list(object({
+    endpoint = optional(string)
+    space    = string
+  }))
+  default = []
+}